@@ -0,0 +1,114 @@
+"""
+Watch several mailboxes from one daemon.
+
+accounts.json (project root) lists one profile per mailbox:
+
+    [
+      {"name": "work",     "token": "tokens/work.json"},
+      {"name": "personal", "token": "tokens/personal.json", "state": "state/personal.json"}
+    ]
+
+Each account has its own OAuth token, history cursor, label cache and poll
+scheduler. MultiAccountPoller polls due accounts on a bounded thread pool.
+An account is never polled twice at once, so its Gmail service (httplib2 is
+not thread-safe) is only ever used by one worker at a time. A slow or failing
+account ties up at most one worker and backs off on its own.
+"""
+from __future__ import annotations
+import json, pathlib, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from gmail_client import ROOT, LabelRegistry, build_service
+from scheduler import PollScheduler, MIN_POLL_SECONDS, MAX_POLL_SECONDS
+
+ACCOUNTS_PATH = ROOT / "accounts.json"
+MAX_WORKERS = 8
+
+class Account:
+    def __init__(self, name: str, token_path: pathlib.Path, state_path: pathlib.Path,
+                 min_interval: float = MIN_POLL_SECONDS, max_interval: float = MAX_POLL_SECONDS,
+                 service_factory: Optional[Callable[["Account"], Any]] = None):
+        self.name = name
+        self.token_path = token_path
+        self.state_path = state_path
+        self.labels = LabelRegistry()
+        self.scheduler = PollScheduler(min_interval, max_interval, state_path=state_path)
+        self._service_factory = service_factory or (lambda acct: build_service(acct.token_path))
+        self._service = None
+
+    def new_service(self):
+        """A fresh service (own HTTP connection) for a thread other than the poller."""
+        return self._service_factory(self)
+
+    def authorize(self) -> None:
+        """Build the polling service now, running the OAuth flow if the token is missing."""
+        if self._service is None:
+            self._service = self.new_service()
+
+    def poll(self) -> List[Dict[str, Any]]:
+        self.authorize()
+        try:
+            msgs = self.scheduler.poll(self._service)
+        except Exception:
+            self._service = None    # rebuild the connection on the next tick
+            raise
+        for m in msgs:
+            m["account"] = self.name
+        return msgs
+
+def load_accounts(path: pathlib.Path = ACCOUNTS_PATH, **kwargs) -> List[Account]:
+    entries = json.loads(path.read_text())
+    accounts = []
+    for e in entries:
+        name = e["name"]
+        token = ROOT / e.get("token", f"tokens/{name}.json")
+        state = ROOT / e.get("state", f"state/{name}.json")
+        token.parent.mkdir(parents=True, exist_ok=True)
+        state.parent.mkdir(parents=True, exist_ok=True)
+        accounts.append(Account(name, token, state, **kwargs))
+    if len({a.name for a in accounts}) != len(accounts):
+        raise ValueError(f"duplicate account names in {path}")
+    return accounts
+
+class MultiAccountPoller:
+    def __init__(self, accounts: List[Account], max_workers: int = MAX_WORKERS):
+        self.accounts = accounts
+        self.max_workers = max(1, min(max_workers, len(accounts)))
+
+    def run(self, on_batch: Callable[[List[Dict[str, Any]]], None], stop: threading.Event) -> None:
+        """Poll until `stop` is set, handing each non-empty batch to `on_batch`."""
+        due: Dict[str, float] = {a.name: 0.0 for a in self.accounts}
+        running: Dict[str, Future] = {}
+        pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="poll")
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                for acct in self.accounts:
+                    fut = running.get(acct.name)
+                    if fut is not None:
+                        if not fut.done():
+                            continue
+                        self._finish(acct, fut, on_batch)
+                        del running[acct.name]
+                        due[acct.name] = now + acct.scheduler.next_delay()
+                    if now >= due[acct.name]:
+                        running[acct.name] = pool.submit(acct.poll)
+                stop.wait(0.2)
+        finally:
+            # don't wait for a hung account on shutdown
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, acct: Account, fut: Future, on_batch) -> None:
+        try:
+            msgs = fut.result()
+        except Exception as e:
+            acct.scheduler.record_failure()
+            print(f"[error] poll {acct.name}: {e!r}")
+            return
+        if msgs:
+            print(f"📥 [{acct.name}] New messages: {len(msgs)}")
+            on_batch(msgs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {a.name: a.scheduler.stats() for a in self.accounts}
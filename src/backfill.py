@@ -0,0 +1,155 @@
+"""
+Score an existing mailbox (or part of it) and store the results.
+
+    python src/backfill.py --after 2024/01/01 --before 2025/01/01
+    python src/backfill.py --query "from:newsletter" --include-spam
+
+Pages through messages.list for the query and date range. Each page is
+fetched in metadata batches, classified in one vectorized call, and written
+to the `messages` table of state.db: sender, subject, snippet, date, whether
+Gmail had it in Spam, and our score and reasons. The next page token is
+checkpointed after each page is stored, so an interrupted run picks up where
+it stopped. A fetcher thread keeps at most two pages ahead of the
+classifier, so memory stays flat however large the mailbox is.
+"""
+from __future__ import annotations
+import argparse, hashlib, json, os, pathlib, queue, threading, time
+from typing import Optional, Tuple
+
+from gmail_client import ROOT, build_service, get_metadata_batch, list_message_ids, message_summary
+from classify.baseline import SPAM_THRESHOLD, load_or_init
+from classify.parallel import score_many
+from storage import Storage, get_storage, message_rows
+from cache import get_result_cache
+
+CHECKPOINT_PATH = ROOT / "backfill.json"
+PAGE_SIZE = 500          # messages.list maximum
+
+def build_query(query: str = "", after: Optional[str] = None, before: Optional[str] = None) -> str:
+    terms = [query] if query else []
+    if after:
+        terms.append(f"after:{after}")
+    if before:
+        terms.append(f"before:{before}")
+    return " ".join(terms)
+
+class Checkpoint:
+    """Resume point for one query: the page token still to do and running totals."""
+
+    def __init__(self, path: pathlib.Path, query: str, include_spam: bool):
+        self.path = path
+        self.key = hashlib.sha1(f"{query}\x00{include_spam}".encode()).hexdigest()
+        self.page_token: Optional[str] = None
+        self.scanned = 0
+        self.done = False
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        if data.get("key") == self.key:
+            self.page_token = data.get("page_token")
+            self.scanned = int(data.get("scanned", 0))
+            self.done = bool(data.get("done"))
+
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"key": self.key, "page_token": self.page_token,
+                                   "scanned": self.scanned, "done": self.done}))
+        os.replace(tmp, self.path)
+
+def _fetch_pages(service, query: str, include_spam: bool, start_token: Optional[str],
+                 out: "queue.Queue", stop: threading.Event, limit: Optional[int]) -> None:
+    """
+    Producer: (messages, ids listed, token to resume from, last page?) per
+    page, then None. A page cut short by `limit` resumes from its own start.
+    """
+    token, n = start_token, 0
+    try:
+        while not stop.is_set():
+            ids, next_token = list_message_ids(service, query, token, PAGE_SIZE, include_spam)
+            truncated = limit is not None and len(ids) > limit - n
+            if truncated:
+                ids = ids[:limit - n]
+            fetched = get_metadata_batch(service, ids, ["From", "Subject"])
+            msgs = [message_summary(fetched[mid]) for mid in ids if mid in fetched]
+            n += len(ids)
+            last = not next_token and not truncated
+            out.put((msgs, len(ids), token if truncated else next_token, last))
+            if last or truncated or (limit is not None and n >= limit):
+                break
+            token = next_token
+    except Exception as e:
+        out.put(e)
+        return
+    out.put(None)
+
+def backfill(service, model, store: Storage, query: str = "", include_spam: bool = False,
+             checkpoint: Optional[Checkpoint] = None, limit: Optional[int] = None,
+             cache=None, progress: bool = True) -> Tuple[int, int]:
+    """Classify and store every message matching `query`. Returns (scanned, flagged as spam)."""
+    ckpt = checkpoint or Checkpoint(CHECKPOINT_PATH, query, include_spam)
+    if ckpt.done:
+        return ckpt.scanned, 0
+    pages: "queue.Queue" = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    fetcher = threading.Thread(target=_fetch_pages, name="backfill-fetch", daemon=True,
+                               args=(service, query, include_spam, ckpt.page_token, pages, stop, limit))
+    fetcher.start()
+    t0, flagged, scanned_now = time.monotonic(), 0, 0
+    try:
+        while True:
+            item = pages.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            msgs, n_ids, resume_token, last = item
+            results = score_many(model, msgs, cache)     # a full page is sharded across cores
+            store.upsert_messages(message_rows(msgs, results))
+            flagged += sum(1 for r in results if r["score"] >= SPAM_THRESHOLD)
+            scanned_now += n_ids
+            ckpt.scanned += n_ids
+            ckpt.page_token, ckpt.done = resume_token, last
+            ckpt.save()
+            if progress:
+                rate = scanned_now / max(1e-9, time.monotonic() - t0)
+                print(f"  {ckpt.scanned} scanned, {flagged} likely spam ({rate:.0f} msgs/s)")
+    finally:
+        stop.set()
+    return ckpt.scanned, flagged
+
+def main():
+    ap = argparse.ArgumentParser(description="Classify existing mail and store the results in state.db.")
+    ap.add_argument("--query", default="", help='Gmail search query, e.g. "in:inbox" or "from:shop.com"')
+    ap.add_argument("--after", help="only mail after this date (YYYY/MM/DD)")
+    ap.add_argument("--before", help="only mail before this date (YYYY/MM/DD)")
+    ap.add_argument("--include-spam", action="store_true", help="also scan Spam and Trash")
+    ap.add_argument("--limit", type=int, default=None, help="stop after this many messages")
+    ap.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    ap.add_argument("--checkpoint", default=str(CHECKPOINT_PATH), help="resume file")
+    args = ap.parse_args()
+
+    query = build_query(args.query, args.after, args.before)
+    ckpt = Checkpoint(pathlib.Path(args.checkpoint), query, args.include_spam)
+    if args.restart:
+        ckpt.page_token, ckpt.scanned, ckpt.done = None, 0, False
+    elif ckpt.done:
+        print(f"Already done ({ckpt.scanned} messages). Use --restart to scan again.")
+        return
+    elif ckpt.page_token:
+        print(f"Resuming after {ckpt.scanned} messages.")
+
+    service = build_service()     # used by the fetch thread
+    print("Loading model…")
+    model = load_or_init()
+    print(f"Backfilling {query or '(all mail)'}…")
+    try:
+        scanned, flagged = backfill(service, model, get_storage(), query, args.include_spam,
+                                    ckpt, args.limit, get_result_cache())
+    except KeyboardInterrupt:
+        print(f"\nStopped at {ckpt.scanned} messages; run again to resume.")
+        return
+    print(f"Done: {scanned} messages, {flagged} likely spam this run.")
+
+if __name__ == "__main__":
+    main()
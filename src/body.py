@@ -0,0 +1,328 @@
+"""
+Second look at borderline mail: fetch the body and score it with its links.
+
+The first pass sees only the subject and Gmail's ~200-character snippet, so
+a phishing mail whose links sit further down reads as harmless. BodyScorer is
+the cascade's third stage (see classify.baseline.Cascade): it runs only for
+messages whose first-pass score lands in the uncertain band. It fetches them
+with format=full in one batch. Gmail leaves attachments out of that format
+(only an attachmentId), and their parts are skipped here. Text and HTML
+parts are decoded and parsed a slice at a time until `max_bytes` of body
+have been read. The cap bounds parsing time and memory, not the download:
+Gmail has no ranged fetch, so format=full carries each text part whole.
+fetched_bytes estimates the download by re-serializing the parsed resource
+as compact JSON; the wire size is not visible through the client. Link count, distinct link domains, suspicious TLDs and links
+whose visible text names another domain feed the rules, and the body text
+feeds the model in place of the snippet.
+
+    SPAM_BODY_FETCH=0          turn the stage off
+    SPAM_BODY_MAX_BYTES=65536  body bytes parsed per message
+    SPAM_CASCADE_BAND=0.45,0.75 blended scores that get a second look
+"""
+from __future__ import annotations
+import base64, binascii, codecs, json, os, re, sys, threading, time
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import metrics
+from gmail_client import get_messages_batch
+from classify.baseline import (HEUR_WEIGHT, MODEL_WEIGHT, SUSPICIOUS_TLDS, _domain_parts,
+                               heuristics_batch, predict, registered_domain)
+
+ENABLED = os.environ.get("SPAM_BODY_FETCH", "1") not in ("", "0")
+MAX_BODY_BYTES = int(os.environ.get("SPAM_BODY_MAX_BYTES", str(64 * 1024)))
+DEFAULT_BAND = (0.45, 0.75)
+MODEL_CHARS = 4000          # body text handed to the model
+SLICE_CHARS = 8192          # base64 characters decoded and parsed at a time
+RECENT = 256                # parsed bodies kept for the shadow model (replay)
+LINK_RE = re.compile(r"https?://[^\s<>\"')]+", re.I)
+DOMAIN_IN_TEXT_RE = re.compile(r"(?:https?://)?((?:[a-z0-9-]+\.)+[a-z]{2,})", re.I)
+
+class BodyFeatures(NamedTuple):
+    text: str
+    links: List[str]
+    domains: Set[str]            # registered domains linked to
+    bad_tld_links: int
+    mismatched: int              # <a> whose visible text names a different domain
+    body_bytes: int              # decoded body bytes parsed
+    fetched_bytes: int           # format=full resource as compact JSON (≈ download size)
+    truncated: bool
+    attachments_skipped: int
+
+class _HTMLText(HTMLParser):
+    """Fed incrementally; collects visible text, hrefs and (href, anchor text) pairs."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text: List[str] = []
+        self.links: List[str] = []
+        self.anchors: List[Tuple[str, str]] = []
+        self._skip = 0
+        self._href: Optional[str] = None
+        self._anchor: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag == "a":
+            self._href = dict(attrs).get("href") or None
+            self._anchor = []
+            if self._href and self._href.lower().startswith(("http://", "https://")):
+                self.links.append(self._href)
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(0, self._skip - 1)
+        elif tag == "a" and self._href:
+            self.anchors.append((self._href, "".join(self._anchor).strip()))
+            self._href = None
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        self.text.append(data)
+        if self._href:
+            self._anchor.append(data)
+
+def _charset(part: Dict[str, Any]) -> str:
+    for h in part.get("headers") or []:
+        if h.get("name", "").lower() == "content-type":
+            m = re.search(r'charset="?([\w.-]+)', h.get("value", ""), re.I)
+            if m:
+                return m.group(1)
+    return "utf-8"
+
+def _leaf_parts(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Leaf MIME parts in document order, without building the whole tree."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            stack.extend(reversed(children))
+        else:
+            yield part
+
+def _decode_slices(data: str, budget: int) -> Iterator[bytes]:
+    """base64url `data` decoded SLICE_CHARS at a time, stopping after `budget` bytes."""
+    for i in range(0, len(data), SLICE_CHARS):
+        if budget <= 0:
+            return
+        chunk = data[i:i + SLICE_CHARS]
+        try:
+            raw = base64.urlsafe_b64decode(chunk + "=" * (-len(chunk) % 4))
+        except (binascii.Error, ValueError):
+            return
+        yield raw[:budget]
+        budget -= len(raw)
+
+def _host_domain(url: str) -> Tuple[str, str]:
+    """(registered domain, public suffix) of a URL's host, or ("", "")."""
+    try:
+        host = (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return "", ""
+    if not host:
+        return "", ""
+    _, suffix, registered = _domain_parts(host)
+    return registered, suffix
+
+def extract(msg: Dict[str, Any], max_bytes: int = MAX_BODY_BYTES) -> BodyFeatures:
+    """Body features of a format=full message, reading at most `max_bytes` of decoded body."""
+    budget, skipped, truncated = max_bytes, 0, False
+    texts: List[str] = []
+    links: List[str] = []
+    anchors: List[Tuple[str, str]] = []
+    for part in _leaf_parts(msg.get("payload") or {}):
+        body = part.get("body") or {}
+        mime = (part.get("mimeType") or "").lower()
+        if part.get("filename") or body.get("attachmentId"):
+            skipped += 1
+            continue
+        data = body.get("data")
+        if mime not in ("text/plain", "text/html") or not data:
+            continue
+        if budget <= 0:
+            truncated = True
+            break
+        try:
+            decoder = codecs.getincrementaldecoder(_charset(part))(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        html = _HTMLText() if mime == "text/html" else None
+        plain: List[str] = []
+        used = 0
+        for raw in _decode_slices(data, budget):
+            used += len(raw)
+            chunk = decoder.decode(raw)
+            if html is not None:
+                html.feed(chunk)
+            else:
+                plain.append(chunk)
+        if used < (len(data) * 3) // 4 - 2:
+            truncated = True
+        budget -= used
+        if html is not None:
+            html.close()
+            texts.append(" ".join(t.strip() for t in html.text if t.strip()))
+            links.extend(html.links)
+            anchors.extend(html.anchors)
+        else:
+            text = "".join(plain)
+            texts.append(text)
+            links.extend(LINK_RE.findall(text))
+    links = list(dict.fromkeys(links))
+    domains: Set[str] = set()
+    bad_tld = 0
+    for url in links:
+        dom, suffix = _host_domain(url)
+        if dom:
+            domains.add(dom)
+        if suffix in SUSPICIOUS_TLDS:
+            bad_tld += 1
+    mismatched = 0
+    for href, shown in anchors:
+        m = DOMAIN_IN_TEXT_RE.search(shown)
+        if m and _host_domain("http://" + m.group(1))[0] not in ("", _host_domain(href)[0]):
+            mismatched += 1
+    fetched = len(json.dumps(msg, separators=(",", ":")))
+    return BodyFeatures(max(texts, key=len) if texts else "", links, domains, bad_tld, mismatched,
+                        max_bytes - budget, fetched, truncated, skipped)
+
+def link_rules(feats: BodyFeatures, sender: str) -> Tuple[float, List[str]]:
+    """Heuristic score and reasons from where the body's links go (their count is a base rule)."""
+    score, reasons = 0.0, []
+    foreign = feats.domains - {registered_domain(sender)} if sender else feats.domains
+    if len(foreign) >= 3:
+        score += 0.1
+        reasons.append(f"links to {len(foreign)} other domains")
+    if feats.bad_tld_links:
+        score += 0.1
+        reasons.append(f"{feats.bad_tld_links} links to suspicious TLDs")
+    if feats.mismatched:
+        score += 0.2
+        reasons.append(f"{feats.mismatched} links whose text shows another domain")
+    return score, reasons
+
+class BodyScorer:
+    """
+    Cascade stage 3. `service_factory(account)` builds a Gmail service for a
+    message's "account" (None in single-account mode); each thread keeps its
+    own, since the transport is not thread-safe.
+    """
+
+    def __init__(self, service_factory: Callable[[Optional[str]], Any], max_bytes: int = MAX_BODY_BYTES):
+        self.service_factory = service_factory
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[str, BodyFeatures]" = OrderedDict()    # for replay()
+        self.totals = {"messages": 0, "fetched_bytes": 0, "body_bytes": 0, "truncated": 0,
+                       "attachments_skipped": 0, "failed": 0, "seconds": 0.0}
+
+    def _service(self, account: Optional[str]):
+        services = getattr(self._local, "services", None)
+        if services is None:
+            services = self._local.services = {}
+        if account not in services:
+            services[account] = self.service_factory(account)
+        return services[account]
+
+    def fetch(self, messages: List[Dict[str, Any]]) -> Dict[str, BodyFeatures]:
+        by_account: Dict[Optional[str], List[str]] = {}
+        for m in messages:
+            by_account.setdefault(m.get("account"), []).append(m["id"])
+        feats: Dict[str, BodyFeatures] = {}
+        for account, ids in by_account.items():
+            t0 = time.perf_counter()
+            try:
+                fetched = get_messages_batch(self._service(account), ids, "full")
+            except Exception as e:
+                print(f"[error] body fetch: {e!r}", file=sys.stderr)
+                metrics.inc("spam_errors_total", where="body_fetch")
+                fetched = {}
+            for mid in ids:
+                if mid in fetched:
+                    feats[mid] = extract(fetched[mid], self.max_bytes)
+            self._record(feats, ids, time.perf_counter() - t0)
+        with self._lock:
+            for mid, f in feats.items():
+                self._recent[mid] = f
+                self._recent.move_to_end(mid)
+            while len(self._recent) > RECENT:
+                self._recent.popitem(last=False)
+        return feats
+
+    def _record(self, feats: Dict[str, BodyFeatures], ids: List[str], seconds: float) -> None:
+        got = [feats[mid] for mid in ids if mid in feats]
+        fetched = sum(f.fetched_bytes for f in got)
+        with self._lock:
+            t = self.totals
+            t["messages"] += len(got)
+            t["failed"] += len(ids) - len(got)
+            t["fetched_bytes"] += fetched
+            t["body_bytes"] += sum(f.body_bytes for f in got)
+            t["truncated"] += sum(f.truncated for f in got)
+            t["attachments_skipped"] += sum(f.attachments_skipped for f in got)
+            t["seconds"] += seconds
+        metrics.inc("spam_body_fetched_total", len(got))
+        metrics.inc("spam_body_bytes_total", fetched)
+        metrics.observe("spam_body_fetch_seconds", seconds)
+
+    def __call__(self, pipe, messages: List[Dict[str, Any]],
+                 scores: np.ndarray) -> List[Optional[Tuple[float, str]]]:
+        return self._score(pipe, messages, self.fetch(messages))
+
+    def replay(self, pipe, messages: List[Dict[str, Any]],
+               scores: np.ndarray) -> List[Optional[Tuple[float, str]]]:
+        """Like calling the scorer, but only with bodies fetched recently; never calls Gmail."""
+        with self._lock:
+            feats = {m["id"]: self._recent[m["id"]] for m in messages if m["id"] in self._recent}
+        return self._score(pipe, messages, feats)
+
+    def _score(self, pipe, messages: List[Dict[str, Any]],
+               feats: Dict[str, BodyFeatures]) -> List[Optional[Tuple[float, str]]]:
+        have = [i for i, m in enumerate(messages) if m["id"] in feats]
+        out: List[Optional[Tuple[float, str]]] = [None] * len(messages)
+        if not have:
+            return out
+        subjects = [(messages[i].get("subject") or "").strip() for i in have]
+        senders = [messages[i].get("from") or "" for i in have]
+        bodies = [feats[messages[i]["id"]].text[:MODEL_CHARS] for i in have]
+        # the base rules read the body (and every link, HTML hrefs included) instead of the snippet
+        heur, _ = heuristics_batch(subjects, [b + "\n" + " ".join(feats[messages[i]["id"]].links)
+                                              for b, i in zip(bodies, have)], senders)
+        model = np.asarray(predict(pipe, [f"{s}\n{b}" for s, b in zip(subjects, bodies)]), dtype=float)
+        for j, i in enumerate(have):
+            f = feats[messages[i]["id"]]
+            extra, reasons = link_rules(f, senders[j])
+            h = min(0.9, float(heur[j]) + extra)
+            score = HEUR_WEIGHT * h + MODEL_WEIGHT * float(model[j])
+            note = f"body {f.body_bytes // 1024} KiB, model={model[j]:.2f}"
+            out[i] = (score, "; ".join(reasons + [note]))
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            t = dict(self.totals)
+        n = t["messages"]
+        t["bytes_per_msg"] = round(t["fetched_bytes"] / n) if n else 0
+        t["ms_per_msg"] = round(t["seconds"] / n * 1000, 2) if n else 0.0
+        t.pop("seconds")
+        return t
+
+def install(service_factory: Callable[[Optional[str]], Any], cascade=None) -> Optional[BodyScorer]:
+    """Make a BodyScorer the cascade's third stage, unless SPAM_BODY_FETCH=0."""
+    from classify.baseline import get_cascade
+    if not ENABLED:
+        return None
+    cascade = cascade or get_cascade()
+    scorer = BodyScorer(service_factory)
+    cascade.deep = scorer
+    if cascade.band is None:
+        cascade.band = DEFAULT_BAND
+    return scorer
@@ -0,0 +1,189 @@
+from __future__ import annotations
+import atexit, hashlib, json, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+from storage import DB_PATH
+
+CACHE_DB_PATH = DB_PATH.with_name("classify_cache.db")
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after they
+    were stored. Used to share Gmail message metadata between MCP tools.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        out = {}
+        for k in keys:
+            v = self.get(k)
+            if v is not None:
+                out[k] = v
+        return out
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+RESULTS_DDL = """
+CREATE TABLE IF NOT EXISTS results (
+  key BLOB PRIMARY KEY,            -- content hash (see classify.baseline.content_key)
+  version BLOB NOT NULL,           -- hash of the model version the result came from
+  value TEXT NOT NULL,             -- JSON {"score", "model_score", "reasons"}
+  created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_created_at ON results (created_at);
+"""
+
+def _version_tag(version: str) -> bytes:
+    return hashlib.blake2b(version.encode(), digest_size=8).digest()
+
+class ResultCache:
+    """
+    Classification results keyed by content hash. Each row records the model
+    version it was scored with and is only served to a reader asking for that
+    version, so processes sharing the file (daemon and MCP server) can each
+    be on their own version. Hot entries are served from an in-memory LRU;
+    every result is also written through to SQLite so a restarted daemon
+    starts warm. Rows from older versions are overwritten as content is
+    re-scored, and the table is kept to about `maxsize` rows by deleting the
+    oldest.
+    """
+
+    def __init__(self, path=CACHE_DB_PATH, maxsize: int = 50_000, memsize: int = 4096):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0             # served from memory
+        self.disk_hits = 0        # served from SQLite
+        self.misses = 0
+        self.invalidations = 0
+        self._mem = TTLCache(memsize, ttl=float("inf"))
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL;")
+        self._db.execute("PRAGMA synchronous=NORMAL;")
+        cols = {r[1] for r in self._db.execute("PRAGMA table_info(results)")}
+        if cols and "version" not in cols:
+            # written before rows carried their version: nothing in it is attributable
+            self._db.executescript("DROP TABLE results; DROP TABLE IF EXISTS meta;")
+        self._db.executescript(RESULTS_DDL)
+        self.version: Optional[str] = None     # the version this process last asked for
+        self._tag = b""
+        self._since_prune = 0
+
+    def _use_version(self, version: str) -> bytes:
+        with self._lock:
+            if version != self.version:
+                if self.version is not None:
+                    self.invalidations += 1
+                # memory only holds this process's current version
+                self._mem = TTLCache(self._mem.maxsize, ttl=float("inf"))
+                self.version, self._tag = version, _version_tag(version)
+            return self._tag
+
+    def get_many(self, version: str, keys: Iterable[bytes]) -> Dict[bytes, Dict[str, Any]]:
+        """Cached results for `keys` under `version`; absent keys are left out."""
+        tag = self._use_version(version)
+        keys = list(keys)
+        out = self._mem.get_many(keys)
+        missing = list({k: None for k in keys if k not in out})
+        from_disk = set()
+        if missing:
+            with self._lock:
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    cur = self._db.execute(
+                        f"SELECT key, value FROM results WHERE version = ? "
+                        f"AND key IN ({','.join('?' * len(chunk))})", (tag, *chunk))
+                    for key, value in cur:
+                        out[key] = json.loads(value)
+                        self._mem.put(key, out[key])
+                        from_disk.add(key)
+        with self._lock:
+            for k in keys:
+                if k in from_disk:
+                    self.disk_hits += 1
+                elif k in out:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return out
+
+    def put_many(self, version: str, items: Dict[bytes, Dict[str, Any]]) -> None:
+        if not items:
+            return
+        tag = self._use_version(version)
+        now = int(time.time())
+        with self._lock, self._db:
+            if tag == self._tag:      # another thread may have moved on meanwhile
+                for key, value in items.items():
+                    self._mem.put(key, value)
+            self._db.executemany("INSERT OR REPLACE INTO results (key, version, value, created_at) "
+                                 "VALUES (?,?,?,?)", [(k, tag, json.dumps(v), now) for k, v in items.items()])
+            self._since_prune += len(items)
+            if self._since_prune >= 1000:
+                self._since_prune = 0
+                self._prune()
+
+    def _prune(self) -> None:
+        (n,) = self._db.execute("SELECT COUNT(*) FROM results").fetchone()
+        if n > self.maxsize:
+            self._db.execute("DELETE FROM results WHERE key IN "
+                             "(SELECT key FROM results ORDER BY created_at LIMIT ?)", (n - self.maxsize,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / total, 3) if total else None,
+                "invalidations": self.invalidations,
+                "version": self.version,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+_results: Optional[ResultCache] = None
+_results_lock = threading.Lock()
+
+def get_result_cache() -> ResultCache:
+    global _results
+    with _results_lock:
+        if _results is None:
+            _results = ResultCache()
+            atexit.register(_results.close)
+        return _results
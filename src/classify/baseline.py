@@ -1,19 +1,29 @@
 from __future__ import annotations
-import re, json, pathlib
-from typing import Tuple, List, Dict
-import tldextract
+import os, re, pathlib, sys, hashlib, threading, time, weakref
+from functools import lru_cache
+from typing import Tuple, List, Dict, Sequence, Any, Optional, Callable, NamedTuple, TYPE_CHECKING
 import numpy as np
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
-from sklearn.utils.validation import check_is_fitted
-from sklearn.exceptions import NotFittedError
+# sklearn, joblib and tldextract are imported inside the functions that need
+# them: together they dominate startup, and the compact model needs none of them.
+if TYPE_CHECKING:
+    from sklearn.pipeline import Pipeline
+    from cache import ResultCache
+    from reputation import Reputation
+    from classify.parallel import ScoringPool
 
-MODEL_PATH = pathlib.Path(__file__).resolve().parents[1] / "model.joblib"
+import metrics
+from classify import compact
 
-# We avoid heavy deps; use joblib from sklearn
-from joblib import dump, load
+MODEL_PATH = pathlib.Path(os.environ.get(
+    "SPAM_MODEL_PATH", pathlib.Path(__file__).resolve().parents[1] / "model.joblib"))
+# "tfidf" (batch-trained Pipeline, default) or "online" (see classify/online.py)
+MODEL_BACKEND = os.environ.get("SPAM_MODEL_BACKEND", "tfidf")
+
+SPAM_THRESHOLD = 0.65
+SUSPICIOUS_THRESHOLD = 0.50
+HEUR_WEIGHT, MODEL_WEIGHT = 0.6, 0.4
+NEUTRAL_SCORE = 0.5           # stands in for the model when it is skipped
 
 SUSPICIOUS_WORDS = [
     "winner","prize","lottery","bitcoin","crypto","viagra","sex","casino","act now",
@@ -21,49 +31,129 @@ SUSPICIOUS_WORDS = [
     "investment","double your","work from home","earn $$$","limited time","risk-free"
 ]
 URL_RE = re.compile(r"https?://", re.I)
+SENDER_RE = re.compile(r"<[^@>]+@([^>]+)>")
+ADDRESS_RE = re.compile(r"<([^<>]+@[^<>]+)>")
+SUSPICIOUS_TLDS = frozenset({"zip","tokyo","top","xyz","loan","click","country","gq","work","review"})
 
+@lru_cache(maxsize=8192)
 def _normalize_sender(sender: str) -> str:
     # Extract domain from "Name <email@domain>"
-    m = re.search(r"<[^@>]+@([^>]+)>", sender)
+    m = SENDER_RE.search(sender)
     domain = (m.group(1) if m else sender.split("@")[-1]).strip().lower()
     return domain
 
-def _heuristics(subject: str, snippet: str, sender: str) -> Tuple[float, List[str]]:
+@lru_cache(maxsize=8192)
+def sender_address(sender: str) -> str:
+    """Lower-cased address from "Name <email@domain>" (or the bare address)."""
+    m = ADDRESS_RE.search(sender)
+    return (m.group(1) if m else sender).strip().lower()
+
+@lru_cache(maxsize=8192)
+def _domain_parts(domain: str) -> Tuple[bool, str, str]:
+    """(has subdomain, public suffix, registered domain) for a sender domain; memoized per domain."""
+    import tldextract
+    ext = tldextract.extract(domain)
+    registered = f"{ext.domain}.{ext.suffix}" if ext.domain and ext.suffix else domain
+    return bool(ext.subdomain and ext.subdomain.strip()), ext.suffix, registered
+
+def registered_domain(sender: str) -> str:
+    """"Name <a@mail.example.co.uk>" -> "example.co.uk"."""
+    return _domain_parts(_normalize_sender(sender))[2]
+
+def _heuristic_features(subject: str, snippet: str, sender: str) -> Tuple[int, int, bool, bool, bool, List[str]]:
+    """(phrase hits, links, nested subdomain, suspicious TLD, all-caps subject, reasons)"""
     text = f"{subject}\n{snippet}".lower()
     reasons = []
-    score = 0.0
 
     # suspicious phrases
     hits = [w for w in SUSPICIOUS_WORDS if w in text]
     if hits:
-        score += min(0.4, 0.05 * len(hits))
         reasons.append(f"suspicious terms: {', '.join(hits[:5])}")
 
     # many links
-    n_links = len(URL_RE.findall(text))
+    n_links = len(URL_RE.findall(text)) if "://" in text else 0
     if n_links >= 2:
-        score += 0.15
         reasons.append(f"{n_links} links")
 
     # sender domain oddities (many subdomains or strange TLDs)
-    domain = _normalize_sender(sender)
-    ext = tldextract.extract(domain)
-    sub_len = len([p for p in [ext.subdomain] if p and p.strip() != ""])
-    if sub_len >= 1:
-        score += 0.05
+    nested, suffix, _ = _domain_parts(_normalize_sender(sender))
+    if nested:
         reasons.append("nested subdomain")
-    if ext.suffix in {"zip","tokyo","top","xyz","loan","click","country","gq","work","review"}:
-        score += 0.1
-        reasons.append(f"suspicious TLD: .{ext.suffix}")
+    bad_tld = suffix in SUSPICIOUS_TLDS
+    if bad_tld:
+        reasons.append(f"suspicious TLD: .{suffix}")
 
     # all-caps subject
-    if subject and subject.isupper() and len(subject) >= 6:
-        score += 0.05
+    caps = bool(subject) and subject.isupper() and len(subject) >= 6
+    if caps:
         reasons.append("ALL-CAPS subject")
 
+    return len(hits), n_links, nested, bad_tld, caps, reasons
+
+def _heuristics(subject: str, snippet: str, sender: str) -> Tuple[float, List[str]]:
+    n_hits, n_links, nested, bad_tld, caps, reasons = _heuristic_features(subject, snippet, sender)
+    score = 0.0
+    if n_hits:
+        score += min(0.4, 0.05 * n_hits)
+    if n_links >= 2:
+        score += 0.15
+    if nested:
+        score += 0.05
+    if bad_tld:
+        score += 0.1
+    if caps:
+        score += 0.05
     return max(0.0, min(score, 0.9)), reasons
 
+@metrics.timed("spam_heuristics_seconds")
+def heuristics_batch(subjects: Sequence[str], snippets: Sequence[str],
+                     senders: Sequence[str]) -> Tuple[np.ndarray, List[List[str]]]:
+    """
+    Score many messages at once. Returns (scores, reasons) where scores is a
+    float array in [0, 0.9] and reasons[i] lists the rules that fired for message i.
+    """
+    feats = [_heuristic_features(s, sn, se) for s, sn, se in zip(subjects, snippets, senders)]
+    if not feats:
+        return np.zeros(0), []
+    n_hits, n_links, nested, bad_tld, caps, reasons = zip(*feats)
+    n_hits = np.asarray(n_hits, dtype=np.int64)
+    n_links = np.asarray(n_links, dtype=np.int64)
+
+    score = np.where(n_hits > 0, np.minimum(0.4, 0.05 * n_hits), 0.0)
+    score = score + np.where(n_links >= 2, 0.15, 0.0)
+    score = score + np.where(np.asarray(nested, dtype=bool), 0.05, 0.0)
+    score = score + np.where(np.asarray(bad_tld, dtype=bool), 0.1, 0.0)
+    score = score + np.where(np.asarray(caps, dtype=bool), 0.05, 0.0)
+    return np.clip(score, 0.0, 0.9), list(reasons)
+
+def content_key(subject: str, snippet: str, sender: str) -> bytes:
+    """
+    Hash of everything classify_batch looks at. The sender is reduced to its
+    domain (the only part the rules use); subject and snippet are hashed as
+    is, since case and spacing feed the heuristics.
+    """
+    data = f"{subject}\x00{snippet}\x00{_normalize_sender(sender)}".encode("utf-8", "surrogatepass")
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+# model -> fingerprint of the file it was loaded from (see model_version)
+_fingerprints: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+
+def _file_fingerprint(path: pathlib.Path) -> str:
+    st = path.stat()
+    return f"{path.name}:{st.st_mtime_ns}:{st.st_size}"
+
+def model_version(model) -> str:
+    """Identifies the weights `model` scores with; cached results are keyed by it."""
+    if is_online(model):
+        # a per-update version would empty the result cache on every label
+        return f"online:{model.epoch}"
+    fp = getattr(model, "fingerprint", None) or _fingerprints.get(model)
+    return fp or f"mem:{id(model)}"
+
 def build_pipeline() -> Pipeline:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
     return Pipeline([
         ("tfidf", TfidfVectorizer(
             strip_accents="unicode",
@@ -75,16 +165,44 @@ def build_pipeline() -> Pipeline:
         ("lr", LogisticRegression(max_iter=200))
     ])
 
-def load_or_init() -> Pipeline:
+def load_or_init(backend: str | None = None) -> Pipeline:
+    if (backend or MODEL_BACKEND) == "online":
+        from classify import online
+        return online.load_or_init()
+    # The registry's CURRENT version wins; model.joblib / model_compact/ are
+    # the unversioned files older installs were trained into.
+    from classify import registry
+    version = registry.current_version()
+    if version:
+        try:
+            return registry.load_version(version)
+        except Exception as e:
+            print(f"[error] loading model {version}: {e!r}", file=sys.stderr)
+    # Prefer the compact export when it is at least as new as model.joblib:
+    # it scores identically and loads without importing sklearn.
+    fast = compact.load()
+    if fast is not None and (not MODEL_PATH.exists()
+                             or fast.path.stat().st_mtime >= MODEL_PATH.stat().st_mtime):
+        return fast
     if MODEL_PATH.exists():
         try:
-            return load(MODEL_PATH)
-        except Exception:
-            pass
-    return build_pipeline()
+            from joblib import load
+            pipe = load(MODEL_PATH)
+            _fingerprints[pipe] = _file_fingerprint(MODEL_PATH)
+            return pipe
+        except Exception as e:
+            print(f"[error] loading {MODEL_PATH}: {e!r}", file=sys.stderr)
+    print("[warn] no trained model; scores come from heuristics only", file=sys.stderr)
+    pipe = build_pipeline()
+    _fingerprints[pipe] = "untrained"
+    return pipe
 
-def save_model(pipe: Pipeline) -> None:
-    dump(pipe, MODEL_PATH)
+def save_model(pipe: Pipeline, promote: bool = True) -> str:
+    """Publish `pipe` as a new registry version (served at once unless promote=False)."""
+    from classify import registry
+    version = registry.publish(pipe, promote)
+    _fingerprints[pipe] = f"registry:{version}"
+    return version
 
 def train(pipe: Pipeline, texts: List[str], labels: List[int]) -> Pipeline:
     # labels: 1 = spam, 0 = ham
@@ -92,8 +210,26 @@ def train(pipe: Pipeline, texts: List[str], labels: List[int]) -> Pipeline:
     save_model(pipe)
     return pipe
 
+def is_online(model) -> bool:
+    return hasattr(model, "partial_fit") and hasattr(model, "predict_spam")
+
+def learn(model, texts: List[str], labels: List[int]) -> bool:
+    """
+    Feed explicit labels (1 = spam, 0 = ham) to an online model. Returns
+    False for the batch-trained Pipeline, which only improves on retrain.
+    """
+    if not is_online(model):
+        return False
+    model.partial_fit(texts, labels)
+    return True
+
+@metrics.timed("spam_predict_seconds")
 def predict(pipe: Pipeline, texts: List[str]) -> np.ndarray:
     # returns probabilities for class 1 (spam)
+    if hasattr(pipe, "predict_spam"):    # online / compact backends
+        return pipe.predict_spam(texts)
+    from sklearn.utils.validation import check_is_fitted
+    from sklearn.exceptions import NotFittedError
     try:
         check_is_fitted(pipe)
     except NotFittedError:
@@ -108,11 +244,237 @@ def predict(pipe: Pipeline, texts: List[str]) -> np.ndarray:
 
 def combine_scores(heur: float, model: float) -> float:
     # Weighted blend; start by trusting heuristics a bit until the model is trained.
-    return float(0.6 * heur + 0.4 * model)
+    return float(HEUR_WEIGHT * heur + MODEL_WEIGHT * model)
+
+# Below this heuristic score even a model score of 1.0 cannot lift the blend
+# to SUSPICIOUS_THRESHOLD, so skipping the model never changes a decision.
+DEFAULT_EXIT_LOW = (SUSPICIOUS_THRESHOLD - MODEL_WEIGHT) / HEUR_WEIGHT
+
+# deep(model, messages, blended scores) -> per message (new score, reason) or None to keep
+DeepScorer = Callable[[Any, List[Dict[str, Any]], np.ndarray], List[Optional[Tuple[float, str]]]]
+
+def _env_bounds(name: str, default: Tuple[Optional[float], Optional[float]]):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    lo, _, hi = value.partition(",")
+    return (float(lo) if lo.strip() else None), (float(hi) if hi.strip() else None)
+
+class Cascade:
+    """
+    Cheapest evidence first. Stage 1 is sender reputation, then the
+    heuristics: a heuristic score below `low` or at/above `high` ends the
+    work there. Stage 2 is the linear model. Stage 3 (`deep`, optional)
+    re-scores messages whose blended score lands in `band`. Each stage counts
+    how many messages reach it, how many leave there, and its time.
+
+    The default `low` never changes a decision (see DEFAULT_EXIT_LOW; with a
+    deep stage it also keeps every message that could reach `band`) and is
+    also the highest `low` allowed; there is no `high` exit by default. calibrate_bounds() derives both from labeled
+    mail; SPAM_CASCADE="low,high" and SPAM_CASCADE_BAND="lo,hi" set them.
+    """
+    STAGES = ("reputation", "heuristics", "model", "deep")
+
+    def __init__(self, low: Optional[float] = DEFAULT_EXIT_LOW, high: Optional[float] = None,
+                 band: Optional[Tuple[float, float]] = None, deep: Optional[DeepScorer] = None):
+        self.low, self.high, self.band, self.deep = low, high, band, deep
+        self.auto_low = low == DEFAULT_EXIT_LOW
+        self._lock = threading.Lock()
+        self._entered = dict.fromkeys(self.STAGES, 0)
+        self._exits = dict.fromkeys(self.STAGES, 0)
+        self._seconds = dict.fromkeys(self.STAGES, 0.0)
+
+    @classmethod
+    def from_env(cls) -> "Cascade":
+        low, high = _env_bounds("SPAM_CASCADE", (DEFAULT_EXIT_LOW, None))
+        if low is not None and low > DEFAULT_EXIT_LOW:
+            print(f"[warn] SPAM_CASCADE low {low} capped at {DEFAULT_EXIT_LOW:.3f}; "
+                  "a higher exit could report suspicious mail as settled", file=sys.stderr)
+            low = DEFAULT_EXIT_LOW
+        band = _env_bounds("SPAM_CASCADE_BAND", (None, None))
+        return cls(low, high, band if None not in band else None)
+
+    @property
+    def exit_low(self) -> Optional[float]:
+        if not self.auto_low or self.deep is None or self.band is None:
+            return self.low
+        return min(self.low, (self.band[0] - MODEL_WEIGHT) / HEUR_WEIGHT)
+
+    @property
+    def key(self) -> str:
+        """Part of the result-cache version: results depend on where stages exit."""
+        deep = getattr(self.deep, "__qualname__", type(self.deep).__name__) if self.deep else ""
+        return f"cascade:{self.exit_low}:{self.high}:{self.band}:{deep}"
+
+    def record(self, stage: str, entered: int, exited: int, seconds: float) -> None:
+        with self._lock:
+            self._entered[stage] += entered
+            self._exits[stage] += exited
+            self._seconds[stage] += seconds
+        metrics.inc("spam_cascade_exit_total", exited, stage=stage)
+        metrics.observe("spam_cascade_stage_seconds", seconds, stage=stage)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per stage: messages that reached it, left there, exit rate and us per message."""
+        with self._lock:
+            return {st: {"entered": n, "exits": self._exits[st],
+                         "exit_rate": round(self._exits[st] / n, 4),
+                         "us_per_msg": round(self._seconds[st] / n * 1e6, 1)}
+                    for st, n in self._entered.items() if n}
+
+def calibrate_bounds(counts: Dict[Tuple[float, int], int],
+                     max_error: float = 0.01) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Exit bounds from {(heuristic score, label): count} over labeled mail. `low`
+    is the widest cut below which at most `max_error` of messages are spam,
+    capped at DEFAULT_EXIT_LOW: above it, mail sent home early as ham would
+    report a blended score the model could have pushed past
+    SUSPICIOUS_THRESHOLD. `high` is the widest cut from which at most
+    `max_error` are ham. None: no exit.
+    """
+    levels = sorted({h for h, _ in counts})
+    low, spam, total = None, 0, 0
+    for i, h in enumerate(levels):
+        spam += counts.get((h, 1), 0)
+        total += counts.get((h, 1), 0) + counts.get((h, 0), 0)
+        if spam > max_error * total:
+            break
+        low = levels[i + 1] if i + 1 < len(levels) else h + 1e-9
+    high, ham, total = None, 0, 0
+    for h in reversed(levels):
+        ham += counts.get((h, 0), 0)
+        total += counts.get((h, 1), 0) + counts.get((h, 0), 0)
+        if ham > max_error * total:
+            break
+        high = h
+    if low is not None:
+        low = min(low, DEFAULT_EXIT_LOW)
+    if low is not None and high is not None:
+        low = min(low, high)
+    return low, high
+
+_cascade: Optional[Cascade] = None
+
+def get_cascade() -> Cascade:
+    """The process-wide cascade, configured from the environment."""
+    global _cascade
+    if _cascade is None:
+        _cascade = Cascade.from_env()
+    return _cascade
+
+def classify_batch(pipe: Pipeline, messages: Sequence[Dict[str, Any]],
+                   cache: Optional[ResultCache] = None,
+                   reputation: Optional[Reputation] = None,
+                   cascade: Optional[Cascade] = None,
+                   pool: Optional[ScoringPool] = None) -> List[Dict[str, Any]]:
+    """
+    Score a batch of message dicts (keys: subject, snippet, from) through the
+    `cascade` (default get_cascade()), with one call per stage. Returns one
+    dict per message with score (blended), model_score and reasons, in input
+    order. With a `cache`, only content not seen before under this model is
+    scored. Senders the `reputation` index can decide on its own skip every
+    later stage, and so do clear-cut heuristic scores (model_score is None
+    for both). With a `pool`, large batches have their heuristics and model
+    stages sharded across processes (see classify/parallel.py).
+    """
+    if not messages:
+        return []
+    cascade = cascade or get_cascade()
+    if reputation is not None:
+        t0 = time.perf_counter()
+        verdicts = [reputation.verdict(m.get("from") or "") for m in messages]
+        rest = [m for m, v in zip(messages, verdicts) if v is None]
+        cascade.record("reputation", len(messages), len(messages) - len(rest), time.perf_counter() - t0)
+        metrics.inc("spam_reputation_bypass_total", len(messages) - len(rest))
+        scored = iter(classify_batch(pipe, rest, cache, cascade=cascade, pool=pool) if rest else [])
+        return [next(scored) if v is None else {"score": v[0], "model_score": None, "reasons": v[1]}
+                for v in verdicts]
+    subjects = [(m.get("subject") or "").strip() for m in messages]
+    snippets = [m.get("snippet") or "" for m in messages]
+    senders = [m.get("from") or "" for m in messages]
+    metrics.inc("spam_classified_total", len(messages))
+    if cache is None:
+        return _score(pipe, list(messages), subjects, snippets, senders, cascade, pool)
+
+    version = f"{model_version(pipe)}|{cascade.key}"
+    keys = [content_key(*t) for t in zip(subjects, snippets, senders)]
+    results = cache.get_many(version, keys)
+    todo: Dict[bytes, int] = {}
+    for i, k in enumerate(keys):
+        if k not in results:
+            todo.setdefault(k, i)     # repeats within the batch are scored once
+    if todo:
+        idx = list(todo.values())
+        fresh = _score(pipe, [messages[i] for i in idx], [subjects[i] for i in idx],
+                       [snippets[i] for i in idx], [senders[i] for i in idx], cascade, pool)
+        new = dict(zip(todo, fresh))
+        cache.put_many(version, new)
+        results.update(new)
+    return [dict(results[k]) for k in keys]
+
+class FirstPass(NamedTuple):
+    """Heuristics and model stages for a batch; the deep stage and explanations come after."""
+    blended: np.ndarray
+    model_scores: List[Optional[float]]
+    reasons: List[List[str]]
+    rest: np.ndarray            # indices that reached the model
+    heur_seconds: float
+    model_seconds: float
+
+def first_pass(pipe: Pipeline, subjects: List[str], snippets: List[str], senders: List[str],
+               low: Optional[float], high: Optional[float]) -> FirstPass:
+    n = len(subjects)
+    t0 = time.perf_counter()
+    heur, reasons = heuristics_batch(subjects, snippets, senders)
+    hi = heur >= high if high is not None else np.zeros(n, dtype=bool)
+    done = (heur < low if low is not None else np.zeros(n, dtype=bool)) | hi
+    rest = np.flatnonzero(~done)
+    heur_s = time.perf_counter() - t0
+
+    blended = HEUR_WEIGHT * heur + MODEL_WEIGHT * NEUTRAL_SCORE
+    blended[hi] = np.maximum(blended[hi], SPAM_THRESHOLD)
+    model_scores: List[Optional[float]] = [None] * n
+    t0 = time.perf_counter()
+    if len(rest):
+        ms = np.asarray(predict(pipe, [f"{subjects[i]}\n{snippets[i]}" for i in rest]), dtype=float)
+        blended[rest] = HEUR_WEIGHT * heur[rest] + MODEL_WEIGHT * ms
+        for i, m in zip(rest, ms):
+            model_scores[i] = float(m)
+    return FirstPass(blended, model_scores, reasons, rest, heur_s, time.perf_counter() - t0)
+
+def _score(pipe: Pipeline, messages: List[Dict[str, Any]], subjects: List[str], snippets: List[str],
+           senders: List[str], cascade: Cascade, pool: Optional[ScoringPool] = None) -> List[Dict[str, Any]]:
+    n = len(subjects)
+    run = pool.first_pass if pool is not None else first_pass
+    blended, model_scores, reasons, rest, heur_s, model_s = run(
+        pipe, subjects, snippets, senders, cascade.exit_low, cascade.high)
+    cascade.record("heuristics", n, n - len(rest), heur_s)
+
+    deep_reasons: Dict[int, str] = {}
+    if len(rest):
+        border: List[int] = []
+        if cascade.deep is not None and cascade.band is not None:
+            lo, hi = cascade.band
+            border = [int(i) for i in rest if lo <= blended[i] < hi]
+        cascade.record("model", len(rest), len(rest) - len(border), model_s)
+        if border:
+            t0 = time.perf_counter()
+            out = cascade.deep(pipe, [messages[i] for i in border], blended[border])
+            for i, o in zip(border, out):
+                if o is not None:
+                    blended[i], deep_reasons[i] = o
+            cascade.record("deep", len(border), len(border), time.perf_counter() - t0)
+    return [
+        {"score": float(blended[i]), "model_score": model_scores[i],
+         "reasons": explain(reasons[i], model_scores[i], deep_reasons.get(i))}
+        for i in range(n)
+    ]
 
-def explain(heur_reasons: List[str], model_score: float) -> str:
+def explain(heur_reasons: List[str], model_score: Optional[float], extra: Optional[str] = None) -> str:
     parts = []
     if heur_reasons:
         parts.append("; ".join(heur_reasons))
-    parts.append(f"model={model_score:.2f}")
+    if extra:
+        parts.append(extra)
+    parts.append(f"model={model_score:.2f}" if model_score is not None else "model skipped")
     return " | ".join(parts)
@@ -0,0 +1,134 @@
+"""
+Compact, sklearn-free form of the TF-IDF + LogisticRegression pipeline.
+
+export() writes a directory next to model.joblib:
+
+    model_compact/
+      weights.npy   float64 [2, n_features]: row 0 = idf, row 1 = coef
+      vocab.json    {term: column}
+      meta.json     intercept, stop words, ngram range, ...
+
+CompactModel reproduces TfidfVectorizer's preprocessing, tokenization and
+l2-normalised tf-idf in plain Python, then scores with one dot product.
+weights.npy is memory-mapped, so loading costs no more than reading the
+vocabulary, and several processes can share the same pages.
+
+    python src/classify/compact.py        # export model.joblib -> model_compact/
+"""
+from __future__ import annotations
+import json, math, os, pathlib, re, shutil, unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+COMPACT_DIR = pathlib.Path(os.environ.get(
+    "SPAM_COMPACT_PATH", pathlib.Path(__file__).resolve().parents[1] / "model_compact"))
+
+def _strip_accents_unicode(s: str) -> str:
+    # same as sklearn.feature_extraction.text.strip_accents_unicode
+    try:
+        s.encode("ASCII", errors="strict")
+        return s
+    except UnicodeEncodeError:
+        normalized = unicodedata.normalize("NFKD", s)
+        return "".join(c for c in normalized if not unicodedata.combining(c))
+
+class CompactModel:
+    def __init__(self, path: pathlib.Path = COMPACT_DIR):
+        self.path = path
+        meta = json.loads((path / "meta.json").read_text())
+        self.vocab: Dict[str, int] = json.loads((path / "vocab.json").read_text())
+        weights = np.load(path / "weights.npy", mmap_mode="r")
+        self.idf, self.coef = weights[0], weights[1]
+        self.intercept = float(meta["intercept"])
+        self.spam_is_positive = bool(meta["spam_is_positive"])
+        self.lowercase = bool(meta["lowercase"])
+        self.strip_accents = meta["strip_accents"] == "unicode"
+        self.token_re = re.compile(meta["token_pattern"])
+        self.stop_words = frozenset(meta["stop_words"])
+        self.ngram_min, self.ngram_max = meta["ngram_range"]
+        self.version = meta.get("version", "")
+        st = (path / "weights.npy").stat()
+        self.fingerprint = f"compact:{self.version}:{st.st_mtime_ns}:{st.st_size}"
+
+    def _terms(self, doc: str) -> List[str]:
+        if self.lowercase:
+            doc = doc.lower()
+        if self.strip_accents:
+            doc = _strip_accents_unicode(doc)
+        tokens = [t for t in self.token_re.findall(doc) if t not in self.stop_words]
+        if self.ngram_max == 1:
+            return tokens
+        terms = list(tokens) if self.ngram_min == 1 else []
+        for n in range(max(2, self.ngram_min), self.ngram_max + 1):
+            terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return terms
+
+    def decision(self, doc: str) -> float:
+        counts = Counter(self.vocab[t] for t in self._terms(doc) if t in self.vocab)
+        if not counts:
+            return self.intercept
+        cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        x = tf * self.idf[cols]
+        norm = math.sqrt(float(x @ x))
+        return float(x @ self.coef[cols]) / norm + self.intercept
+
+    def predict_spam(self, texts: List[str]) -> np.ndarray:
+        z = np.array([self.decision(t) for t in texts], dtype=np.float64)
+        p = 1.0 / (1.0 + np.exp(-z))
+        return p if self.spam_is_positive else 1.0 - p
+
+def export(pipe, path: pathlib.Path = COMPACT_DIR, version: str = "") -> pathlib.Path:
+    """Write a fitted tfidf+lr Pipeline in compact form (atomically replaces `path`)."""
+    tfidf = pipe.named_steps["tfidf"]
+    lr = pipe.named_steps["lr"]
+    if tfidf.norm != "l2" or tfidf.sublinear_tf or tfidf.analyzer != "word" or not tfidf.use_idf:
+        raise ValueError("compact export supports word analyzer, l2 norm, raw tf with idf only")
+    stop = tfidf.get_stop_words() or ()
+
+    n = len(tfidf.vocabulary_)
+    weights = np.empty((2, n), dtype=np.float64)
+    weights[0] = tfidf.idf_
+    weights[1] = lr.coef_[0]
+    meta = {
+        "intercept": float(lr.intercept_[0]),
+        "spam_is_positive": bool(lr.classes_[1] == 1),
+        "lowercase": bool(tfidf.lowercase),
+        "strip_accents": tfidf.strip_accents,
+        "token_pattern": tfidf.token_pattern,
+        "stop_words": sorted(stop),
+        "ngram_range": list(tfidf.ngram_range),
+        "version": version,
+    }
+
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "weights.npy", weights)
+    (tmp / "vocab.json").write_text(json.dumps({t: int(i) for t, i in tfidf.vocabulary_.items()}))
+    (tmp / "meta.json").write_text(json.dumps(meta))
+    old = path.with_name(path.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if path.exists():
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return path
+
+def load(path: Optional[pathlib.Path] = None) -> Optional[CompactModel]:
+    path = path or COMPACT_DIR
+    if not (path / "meta.json").exists():
+        return None
+    try:
+        return CompactModel(path)
+    except Exception:
+        return None
+
+if __name__ == "__main__":
+    import sys
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+    from classify.baseline import MODEL_PATH
+    from joblib import load as joblib_load
+    print(f"exported {export(joblib_load(MODEL_PATH))}")
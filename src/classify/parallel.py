@@ -0,0 +1,175 @@
+"""
+Score large batches on a process pool.
+
+The heuristics are pure Python and the compact model tokenizes in Python
+too, so one process scores on one core however many threads call it.
+ScoringPool.first_pass() runs the heuristics and model stages of a large
+batch as shards on worker processes and merges them back in input order.
+Batches under MIN_PARALLEL messages stay in-process, where pickling would
+cost more than it saves. Reputation, the result cache and the deep (body)
+stage still run in the calling process, around the sharded part.
+
+Workers never receive the model itself, only where to load it from, and
+keep it until the served model changes. A compact model is opened from its
+directory, where weights.npy is memory-mapped. Any other model is dumped
+once per version and loaded with joblib's mmap_mode="r". Either way the
+weight arrays are pages of one file shared by every worker, not a copy
+each; only the vocabulary dict is per-process.
+
+    from classify.parallel import score_many
+    results = score_many(model, messages, cache)      # same as classify_batch
+
+SPAM_SCORE_WORKERS sets the pool size (default: one per core; 1 disables it)
+and SPAM_SCORE_MIN_PARALLEL the smallest batch that is sharded.
+"""
+from __future__ import annotations
+import atexit, hashlib, itertools, multiprocessing, os, pathlib, shutil, tempfile, threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+from classify import compact
+from classify.baseline import FirstPass, classify_batch, first_pass, model_version
+
+WORKERS = int(os.environ.get("SPAM_SCORE_WORKERS", "0")) or (os.cpu_count() or 1)
+# Dispatching a shard costs about 1 ms (IPC plus merge) against about 30 us
+# of scoring per message, so two cores already win from ~100 messages. One
+# backfill page (500) is the smallest batch worth a round trip by a margin.
+MIN_PARALLEL = int(os.environ.get("SPAM_SCORE_MIN_PARALLEL", "500"))
+MIN_SHARD = 250
+
+Spec = Tuple[str, str]    # ("compact" | "joblib", path)
+
+# --- worker side ---
+
+_worker_model: Dict[Spec, Any] = {}
+
+def _load(spec: Spec):
+    model = _worker_model.get(spec)
+    if model is None:
+        kind, path = spec
+        if kind == "compact":
+            model = compact.CompactModel(pathlib.Path(path))
+        else:
+            from joblib import load
+            model = load(path, mmap_mode="r")
+        _worker_model.clear()     # only the model being served is kept
+        _worker_model[spec] = model
+    return model
+
+def _shard(spec: Spec, subjects: List[str], snippets: List[str], senders: List[str],
+           low: Optional[float], high: Optional[float]) -> FirstPass:
+    return first_pass(_load(spec), subjects, snippets, senders, low, high)
+
+# --- caller side ---
+
+def _merge(parts: List[FirstPass]) -> FirstPass:
+    offsets = itertools.accumulate([0] + [len(p.blended) for p in parts[:-1]])
+    return FirstPass(
+        np.concatenate([p.blended for p in parts]),
+        [s for p in parts for s in p.model_scores],
+        [r for p in parts for r in p.reasons],
+        np.concatenate([p.rest + off for p, off in zip(parts, offsets)]),
+        sum(p.heur_seconds for p in parts),      # CPU time summed over workers
+        sum(p.model_seconds for p in parts),
+    )
+
+class ScoringPool:
+    def __init__(self, workers: int = WORKERS, min_parallel: int = MIN_PARALLEL,
+                 min_shard: int = MIN_SHARD):
+        self.workers = max(1, workers)
+        self.min_parallel = min_parallel
+        self.min_shard = min_shard
+        self.sharded = 0          # messages scored on the pool
+        self.inline = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._share_dir: Optional[pathlib.Path] = None
+        self._shared: Dict[str, Spec] = {}     # model version -> spec
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the daemon has live threads, sockets and
+                # SQLite connections that a forked child must not inherit
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _spec(self, model) -> Spec:
+        if isinstance(model, compact.CompactModel):
+            return ("compact", str(model.path))
+        version = model_version(model)
+        with self._lock:
+            spec = self._shared.get(version)
+            if spec is None:
+                from joblib import dump
+                if self._share_dir is None:
+                    self._share_dir = pathlib.Path(tempfile.mkdtemp(prefix="spam-score-"))
+                for _, old in self._shared.values():     # one dump at a time
+                    pathlib.Path(old).unlink(missing_ok=True)
+                path = self._share_dir / f"{hashlib.blake2b(version.encode(), digest_size=8).hexdigest()}.joblib"
+                dump(model, path)
+                spec = ("joblib", str(path))
+                self._shared = {version: spec}
+            return spec
+
+    def first_pass(self, pipe, subjects: List[str], snippets: List[str], senders: List[str],
+                   low: Optional[float], high: Optional[float]) -> FirstPass:
+        """baseline.first_pass(), sharded across the pool when the batch is large."""
+        n = len(subjects)
+        if self.workers <= 1 or n < self.min_parallel:
+            self.inline += n
+            return first_pass(pipe, subjects, snippets, senders, low, high)
+        try:
+            spec = self._spec(pipe)
+            # a couple of shards per worker evens out uneven message lengths
+            size = max(self.min_shard, -(-n // (2 * self.workers)))
+            starts = range(0, n, size)
+            parts = list(self._pool().map(
+                _shard, itertools.repeat(spec),
+                [subjects[i:i + size] for i in starts], [snippets[i:i + size] for i in starts],
+                [senders[i:i + size] for i in starts], itertools.repeat(low), itertools.repeat(high)))
+        except Exception as e:
+            print(f"[error] scoring pool: {e!r}; scoring in-process")
+            metrics.inc("spam_errors_total", where="score_pool")
+            self._reset()
+            self.inline += n
+            return first_pass(pipe, subjects, snippets, senders, low, high)
+        self.sharded += n
+        metrics.inc("spam_score_sharded_total", n)
+        return _merge(parts)
+
+    def _reset(self) -> None:
+        with self._lock:
+            ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        self._reset()
+        with self._lock:
+            if self._share_dir is not None:
+                shutil.rmtree(self._share_dir, ignore_errors=True)
+                self._share_dir, self._shared = None, {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "sharded": self.sharded, "inline": self.inline}
+
+_pool: Optional[ScoringPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ScoringPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ScoringPool()
+            atexit.register(_pool.close)
+        return _pool
+
+def score_many(model, messages: Sequence[Dict[str, Any]], cache=None, reputation=None,
+               cascade=None) -> List[Dict[str, Any]]:
+    """classify_batch() with large batches sharded across get_pool(); results in input order."""
+    return classify_batch(model, messages, cache, reputation, cascade, pool=get_pool())
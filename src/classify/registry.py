@@ -0,0 +1,303 @@
+"""
+Versioned model artifacts, hot swapping and shadow scoring.
+
+    models/
+      20261017-101500-3fa2/     one directory per published model
+        model.joblib
+        model_compact/
+      CURRENT                   version being served
+      SHADOW                    optional candidate scored alongside it
+      shadow.jsonl              per-batch comparison log
+
+publish() builds a version under a temporary name, renames it into place
+and then repoints CURRENT (or SHADOW) with os.replace, so a reader sees the
+old model or the new one, never a half-written file. LiveModel holds the
+serving model. Its watcher polls the pointer files and swaps `current` when
+they change. Callers read `current` once per batch, so batches already in
+flight finish on the model they started with. A shadow model scores copies
+of live batches on its own thread and logs score deltas, decision flips and
+latency against the live model, so a retrain can be checked before
+`python src/classify/registry.py promote`.
+
+    python src/classify/registry.py list
+    python src/classify/registry.py promote [VERSION]   # default: the shadow
+    python src/classify/registry.py shadow VERSION|none
+"""
+from __future__ import annotations
+import json, os, pathlib, queue, shutil, sys, threading, time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import metrics
+from classify import compact
+from classify.baseline import SPAM_THRESHOLD
+
+MODELS_DIR = pathlib.Path(os.environ.get(
+    "SPAM_MODELS_DIR", pathlib.Path(__file__).resolve().parents[1] / "models"))
+KEEP_VERSIONS = 5         # older unreferenced versions are pruned on publish
+WATCH_SECONDS = 5.0
+SHADOW_QUEUE = 8          # batches waiting for the shadow; more are dropped
+
+def _pointer(name: str, root: pathlib.Path) -> Optional[str]:
+    try:
+        return (root / name).read_text().strip() or None
+    except OSError:
+        return None
+
+def _set_pointer(name: str, version: Optional[str], root: pathlib.Path) -> None:
+    tmp = root / f".{name}.tmp"
+    tmp.write_text(version or "")
+    os.replace(tmp, root / name)
+
+def current_version(root: pathlib.Path = MODELS_DIR) -> Optional[str]:
+    return _pointer("CURRENT", root)
+
+def shadow_version(root: pathlib.Path = MODELS_DIR) -> Optional[str]:
+    return _pointer("SHADOW", root)
+
+def versions(root: pathlib.Path = MODELS_DIR) -> List[str]:
+    """Published versions, oldest first."""
+    if not root.is_dir():
+        return []
+    return sorted(p.name for p in root.iterdir() if p.is_dir() and not p.name.startswith("."))
+
+def publish(pipe, promote: bool = True, root: pathlib.Path = MODELS_DIR) -> str:
+    """Write `pipe` as a new version and point CURRENT (or SHADOW) at it. Returns the version."""
+    from joblib import dump
+    root.mkdir(parents=True, exist_ok=True)
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(2).hex()}"
+    tmp = root / f".{version}.tmp"
+    tmp.mkdir()
+    try:
+        dump(pipe, tmp / "model.joblib")
+        try:
+            compact.export(pipe, tmp / "model_compact", version=version)
+        except (ValueError, KeyError, AttributeError) as e:
+            print(f"[warn] compact export skipped: {e}", file=sys.stderr)
+        os.replace(tmp, root / version)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    _set_pointer("CURRENT" if promote else "SHADOW", version, root)
+    _prune(root)
+    return version
+
+def promote(version: Optional[str] = None, root: pathlib.Path = MODELS_DIR) -> str:
+    """Serve `version` (default: the current shadow); the shadow is cleared if promoted."""
+    shadow = shadow_version(root)
+    version = version or shadow
+    if not version or not (root / version).is_dir():
+        raise LookupError(f"no such model version: {version!r}")
+    _set_pointer("CURRENT", version, root)
+    if shadow == version:
+        _set_pointer("SHADOW", None, root)
+    return version
+
+def _prune(root: pathlib.Path) -> None:
+    keep = {current_version(root), shadow_version(root)}
+    for v in versions(root)[:-KEEP_VERSIONS]:
+        if v not in keep:
+            shutil.rmtree(root / v, ignore_errors=True)
+
+def load_version(version: str, root: pathlib.Path = MODELS_DIR):
+    """Load one version (compact form when present). Raises if it is missing or unreadable."""
+    path = root / version
+    if (path / "model_compact" / "meta.json").exists():
+        return compact.CompactModel(path / "model_compact")
+    from joblib import load
+    from classify.baseline import _fingerprints
+    pipe = load(path / "model.joblib")
+    _fingerprints[pipe] = f"registry:{version}"
+    return pipe
+
+class LiveModel:
+    """
+    The model being served, swapped in place by watch(), plus an optional
+    shadow candidate. Read `current` once per batch.
+    """
+
+    def __init__(self, model, version: Optional[str] = None, root: pathlib.Path = MODELS_DIR,
+                 shadow=None, shadow_version: Optional[str] = None, flip_threshold: float = SPAM_THRESHOLD):
+        self.current = model
+        self.version = version
+        self.shadow = shadow
+        self.shadow_version = shadow_version
+        self.root = root
+        self.flip_threshold = flip_threshold
+        self.swaps = 0
+        self.shadow_totals = {"messages": 0, "abs_delta": 0.0, "flips": 0,
+                              "live_seconds": 0.0, "shadow_seconds": 0.0, "dropped": 0}
+        self._failed: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._shadow_q: "queue.Queue[Tuple[list, list, float]]" = queue.Queue(maxsize=SHADOW_QUEUE)
+
+    def _load(self, version: str):
+        try:
+            return load_version(version, self.root)
+        except Exception as e:
+            if version not in self._failed:
+                print(f"[error] loading model {version}: {e!r}; keeping the current one", file=sys.stderr)
+                metrics.inc("spam_errors_total", where="model_load")
+                self._failed.add(version)
+            return None
+
+    def check(self) -> bool:
+        """Pick up CURRENT / SHADOW changes; returns True if the served model changed."""
+        swapped = False
+        with self._lock:
+            cur = current_version(self.root)
+            if cur and cur != self.version and cur not in self._failed:
+                model = self._load(cur)
+                if model is not None:
+                    self.current, self.version = model, cur
+                    self.swaps += 1
+                    swapped = True
+                    metrics.inc("spam_model_swaps_total")
+                    print(f"🔄 Now serving model {cur}", file=sys.stderr)
+            sh = shadow_version(self.root)
+            if sh != self.shadow_version and sh not in self._failed:
+                model = self._load(sh) if sh else None
+                if model is not None or sh is None:
+                    self.shadow, self.shadow_version = model, sh
+                    if sh:
+                        print(f"👥 Shadow scoring with model {sh}", file=sys.stderr)
+        return swapped
+
+    def watch(self, interval: float = WATCH_SECONDS) -> "LiveModel":
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"[error] model watcher: {e!r}", file=sys.stderr)
+        self._start(run, "model-watch")
+        self._start(self._shadow_loop, "model-shadow")
+        return self
+
+    def _start(self, target, name: str) -> None:
+        t = threading.Thread(target=target, name=name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def close(self) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(2.0)
+
+    # --- shadow scoring ---
+
+    def shadow_score(self, messages: Sequence[Dict[str, Any]], results: List[Dict[str, Any]],
+                     live_seconds: float) -> None:
+        """Queue a live batch and its results for the shadow; never blocks."""
+        if self.shadow is None:
+            return
+        try:
+            self._shadow_q.put_nowait((list(messages), results, live_seconds))
+        except queue.Full:
+            self.shadow_totals["dropped"] += 1
+            metrics.inc("spam_shadow_dropped_total")
+
+    def _shadow_loop(self) -> None:
+        from classify.baseline import Cascade, classify_batch, get_cascade
+        while not self._stop.is_set():
+            try:
+                messages, live, live_s = self._shadow_q.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            shadow, version = self.shadow, self.shadow_version
+            if shadow is None:
+                continue
+            try:
+                t0 = time.perf_counter()
+                # same stages, but its own counters, and the body stage reuses
+                # what the live pass fetched instead of calling Gmail again
+                c = get_cascade()
+                deep = getattr(c.deep, "replay", None)
+                scored = classify_batch(shadow, messages,
+                                        cascade=Cascade(c.low, c.high, c.band if deep else None, deep))
+                shadow_s = time.perf_counter() - t0
+            except Exception as e:
+                print(f"[error] shadow {version}: {e!r}", file=sys.stderr)
+                metrics.inc("spam_errors_total", where="shadow")
+                continue
+            self._compare(messages, live, scored, live_s, shadow_s, version)
+
+    def _compare(self, messages, live, scored, live_s: float, shadow_s: float, version: str) -> None:
+        # mail decided before the model (reputation, clear heuristics) scores the same in both
+        pairs = [(m, l["score"], s["score"]) for m, l, s in zip(messages, live, scored)
+                 if l.get("model_score") is not None]
+        if not pairs:
+            return
+        t = self.flip_threshold
+        flips = [m.get("id") for m, l, s in pairs if (l >= t) != (s >= t)]
+        deltas = [abs(s - l) for _, l, s in pairs]
+        tot = self.shadow_totals
+        tot["messages"] += len(pairs)
+        tot["abs_delta"] += sum(deltas)
+        tot["flips"] += len(flips)
+        tot["live_seconds"] += live_s
+        tot["shadow_seconds"] += shadow_s
+        metrics.inc("spam_shadow_messages_total", len(pairs))
+        metrics.inc("spam_shadow_flips_total", len(flips))
+        metrics.observe("spam_shadow_seconds", shadow_s)
+        for d in deltas:
+            metrics.observe("spam_shadow_score_delta", d)
+        entry = {"ts": int(time.time()), "live": self.version, "shadow": version, "n": len(pairs),
+                 "mean_abs_delta": round(sum(deltas) / len(deltas), 4), "max_abs_delta": round(max(deltas), 4),
+                 "flips": flips, "live_ms": round(live_s * 1000, 3), "shadow_ms": round(shadow_s * 1000, 3)}
+        try:
+            with open(self.root / "shadow.jsonl", "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"[error] shadow log: {e!r}", file=sys.stderr)
+
+    def stats(self) -> Dict[str, Any]:
+        tot = self.shadow_totals
+        n = tot["messages"]
+        return {"version": self.version, "swaps": self.swaps, "shadow": self.shadow_version,
+                "shadow_messages": n, "shadow_flips": tot["flips"], "shadow_dropped": tot["dropped"],
+                "mean_abs_delta": round(tot["abs_delta"] / n, 4) if n else None}
+
+def open_live(backend: Optional[str] = None, flip_threshold: float = SPAM_THRESHOLD,
+              watch: bool = True) -> LiveModel:
+    """load_or_init() wrapped in a LiveModel (watched and shadowed unless the backend is online)."""
+    from classify.baseline import load_or_init, is_online
+    model = load_or_init(backend)
+    if is_online(model):
+        return LiveModel(model, flip_threshold=flip_threshold)
+    live = LiveModel(model, current_version(), flip_threshold=flip_threshold)
+    if watch:
+        live.check()      # picks up a shadow; CURRENT is already loaded
+        live.watch()
+    return live
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Inspect and promote published models.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    p = sub.add_parser("promote")
+    p.add_argument("version", nargs="?")
+    p = sub.add_parser("shadow")
+    p.add_argument("version", help='a published version, or "none"')
+    args = ap.parse_args()
+
+    if args.cmd == "list":
+        cur, sh = current_version(), shadow_version()
+        for v in versions():
+            print(f"{v}{'  (current)' if v == cur else ''}{'  (shadow)' if v == sh else ''}")
+    elif args.cmd == "promote":
+        print(f"serving {promote(args.version)}")
+    else:
+        version = None if args.version == "none" else args.version
+        if version and not (MODELS_DIR / version).is_dir():
+            raise SystemExit(f"no such model version: {version}")
+        _set_pointer("SHADOW", version, MODELS_DIR)
+        print(f"shadow: {version or 'none'}")
+
+if __name__ == "__main__":
+    main()
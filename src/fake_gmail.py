@@ -0,0 +1,358 @@
+"""
+In-process stand-in for the subset of the googleapiclient Gmail surface this
+project uses, so polling, classification and the MCP tools can be exercised
+without a Google account:
+
+    users().getProfile, users().history().list,
+    users().messages().get/list/modify/batchModify,
+    users().labels().list/create, new_batch_http_request
+
+Every call costs `latency` seconds (a whole batch costs one round trip) and
+fails with `error_status` with probability `error_rate`. `calls` counts
+round trips per method.
+
+    box = FakeMailbox()
+    svc = FakeGmailService(box, latency=0.05)
+    box.deliver(mailgen.generate(100))
+"""
+from __future__ import annotations
+import base64, html, random, re, threading, time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+_URL_RE = re.compile(r"https?://[^\s<>\"']+")
+
+def _b64(data: str) -> str:
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+def _full_payload(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """format=full payload: multipart/alternative text + HTML, plus an attachment stub if any."""
+    body = msg["_body"]
+    if not body:
+        return msg["payload"]
+    marked = _URL_RE.sub(lambda m: f'<a href="{m.group()}">{m.group()}</a>', html.escape(body, quote=False))
+    page = f"<html><body><p>{marked}</p></body></html>"
+    parts = [{"partId": "0", "mimeType": "text/plain", "filename": "",
+              "headers": [{"name": "Content-Type", "value": "text/plain; charset=UTF-8"}],
+              "body": {"size": len(body), "data": _b64(body)}},
+             {"partId": "1", "mimeType": "text/html", "filename": "",
+              "headers": [{"name": "Content-Type", "value": "text/html; charset=UTF-8"}],
+              "body": {"size": len(page), "data": _b64(page)}}]
+    if msg.get("_attachment"):
+        name, size = msg["_attachment"]
+        parts.append({"partId": "2", "mimeType": "application/octet-stream", "filename": name,
+                      "headers": [], "body": {"attachmentId": f"att-{msg['id']}", "size": size}})
+    return {"mimeType": "multipart/mixed" if msg.get("_attachment") else "multipart/alternative",
+            "headers": msg["payload"]["headers"], "body": {"size": 0}, "parts": parts}
+
+SYSTEM_LABELS = ["INBOX", "SPAM", "TRASH", "UNREAD", "SENT", "DRAFT", "STARRED", "IMPORTANT"]
+
+def _http_error(status: int, reason: str = "") -> HttpError:
+    resp = httplib2.Response({"status": status})
+    resp.reason = reason or {404: "Not Found", 429: "Too Many Requests"}.get(status, "Error")
+    return HttpError(resp, reason.encode(), uri="fake://gmail")
+
+class FakeMailbox:
+    """Messages, labels and the history log of one account."""
+
+    def __init__(self, history_id: int = 1000):
+        self.lock = threading.RLock()
+        self.messages: Dict[str, Dict[str, Any]] = {}
+        self.history: List[Dict[str, Any]] = []
+        self.history_id = history_id
+        self.oldest_history_id = history_id
+        self.labels: Dict[str, str] = {name: name for name in SYSTEM_LABELS}  # name -> id
+        self._next_id = 0
+
+    def deliver(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """
+        Add messages (dicts with from/subject/snippet and optional body,
+        attachment, labelIds) as new INBOX mail and record messageAdded history.
+        """
+        ids = []
+        with self.lock:
+            for m in messages:
+                self._next_id += 1
+                self.history_id += 1
+                mid = m.get("id") or f"{self._next_id:016x}"
+                labels = list(m.get("labelIds") or ["INBOX", "UNREAD"])
+                headers = [{"name": "From", "value": m.get("from", "")},
+                           {"name": "Subject", "value": m.get("subject", "")},
+                           {"name": "To", "value": "me@example.com"}]
+                self.messages[mid] = {
+                    "id": mid,
+                    "threadId": m.get("threadId") or mid,
+                    "labelIds": labels,
+                    "snippet": m.get("snippet", ""),
+                    "historyId": str(self.history_id),
+                    "internalDate": str(int(m.get("internalDate") or time.time() * 1000)),
+                    "sizeEstimate": len(m.get("body", "")) + 500,
+                    "payload": {"mimeType": "text/plain", "headers": headers,
+                                "body": {"size": len(m.get("body", ""))}},
+                    "_body": m.get("body", ""),
+                    "_attachment": m.get("attachment"),     # (filename, size): listed, never sent
+                }
+                self.history.append({
+                    "id": str(self.history_id),
+                    "messages": [{"id": mid, "threadId": mid}],
+                    "messagesAdded": [{"message": {"id": mid, "threadId": mid, "labelIds": labels}}],
+                })
+                ids.append(mid)
+        return ids
+
+    def expire_history(self) -> None:
+        """Drop the history log, as Gmail does after about a week."""
+        with self.lock:
+            self.history.clear()
+            self.oldest_history_id = self.history_id
+
+class _Request:
+    def __init__(self, service: "FakeGmailService", method: str, fn: Callable[[], Any]):
+        self.service = service
+        self.method = method
+        self.fn = fn
+
+    def execute(self, num_retries: int = 0):
+        self.service._round_trip(self.method)
+        return self.service._call(self.fn)
+
+class _Batch:
+    def __init__(self, service: "FakeGmailService", callback):
+        self.service = service
+        self.callback = callback
+        self.items: List[tuple] = []
+
+    def add(self, request: _Request, callback=None, request_id: Optional[str] = None):
+        self.items.append((request_id or str(len(self.items)), request, callback))
+
+    def execute(self):
+        if len(self.items) > 100:
+            raise _http_error(400, "Too many requests in batch")
+        self.service._round_trip("batch")
+        for rid, req, cb in self.items:
+            self.service.calls[req.method] += 1
+            try:
+                resp, exc = self.service._call(req.fn), None
+            except HttpError as e:
+                resp, exc = None, e
+            (cb or self.callback)(rid, resp, exc)
+
+class FakeGmailService:
+    def __init__(self, mailbox: Optional[FakeMailbox] = None, latency: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 500, seed: int = 0):
+        self.mailbox = mailbox or FakeMailbox()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls: Counter = Counter()
+        self._rnd = random.Random(seed)
+
+    # --- plumbing ---
+
+    def _round_trip(self, method: str) -> None:
+        self.calls[method] += 1
+        self.calls["round_trips"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _call(self, fn: Callable[[], Any]):
+        if self.error_rate and self._rnd.random() < self.error_rate:
+            raise _http_error(self.error_status)
+        with self.mailbox.lock:
+            return fn()
+
+    def _req(self, method: str, fn: Callable[[], Any]) -> _Request:
+        return _Request(self, method, fn)
+
+    def new_batch_http_request(self, callback=None) -> _Batch:
+        return _Batch(self, callback)
+
+    def users(self):
+        return _Users(self)
+
+class _Users:
+    def __init__(self, svc: FakeGmailService):
+        self.svc = svc
+        self.box = svc.mailbox
+
+    def getProfile(self, userId: str = "me"):
+        return self.svc._req("users.getProfile", lambda: {
+            "emailAddress": "me@example.com",
+            "messagesTotal": len(self.box.messages),
+            "historyId": str(self.box.history_id),
+        })
+
+    def history(self):
+        return _History(self.svc)
+
+    def messages(self):
+        return _Messages(self.svc)
+
+    def labels(self):
+        return _Labels(self.svc)
+
+_HISTORY_KEYS = {"messageAdded": "messagesAdded", "messageDeleted": "messagesDeleted",
+                 "labelAdded": "labelsAdded", "labelRemoved": "labelsRemoved"}
+
+class _History:
+    def __init__(self, svc: FakeGmailService):
+        self.svc = svc
+        self.box = svc.mailbox
+
+    def list(self, userId: str = "me", startHistoryId: str = "0", historyTypes=None,
+             pageToken: Optional[str] = None, labelId: Optional[str] = None, maxResults: int = 100):
+        def run():
+            start = int(startHistoryId)
+            if start < self.box.oldest_history_id:
+                raise _http_error(404, "startHistoryId too old")
+            entries = [h for h in self.box.history if int(h["id"]) > start]
+            if historyTypes:
+                entries = [h for h in entries if any(_HISTORY_KEYS[t] in h for t in historyTypes)]
+            if labelId:
+                entries = [h for h in entries if any(labelId in r["message"]["labelIds"]
+                                                     for k in _HISTORY_KEYS.values() for r in h.get(k, []))]
+            offset = int(pageToken or 0)
+            page = entries[offset:offset + maxResults]
+            resp: Dict[str, Any] = {"historyId": str(self.box.history_id)}
+            if page:
+                resp["history"] = page
+            if offset + maxResults < len(entries):
+                resp["nextPageToken"] = str(offset + maxResults)
+            return resp
+        return self.svc._req("history.list", run)
+
+def _matches_query(msg: Dict[str, Any], q: str) -> bool:
+    labels = set(msg["labelIds"])
+    for term in (q or "").split():
+        if term == "in:inbox" and "INBOX" not in labels:
+            return False
+        if term == "is:unread" and "UNREAD" not in labels:
+            return False
+        if term == "in:spam" and "SPAM" not in labels:
+            return False
+        if term.startswith("after:") and int(msg["internalDate"]) // 1000 < _epoch(term[6:]):
+            return False
+        if term.startswith("before:") and int(msg["internalDate"]) // 1000 >= _epoch(term[7:]):
+            return False
+    return True
+
+def _epoch(value: str) -> int:
+    if value.isdigit():
+        return int(value)
+    return int(time.mktime(time.strptime(value.replace("-", "/"), "%Y/%m/%d")))
+
+class _Messages:
+    def __init__(self, svc: FakeGmailService):
+        self.svc = svc
+        self.box = svc.mailbox
+
+    def _get(self, mid: str) -> Dict[str, Any]:
+        msg = self.box.messages.get(mid)
+        if msg is None:
+            raise _http_error(404, f"message {mid} not found")
+        return msg
+
+    def get(self, userId: str = "me", id: str = "", format: str = "full",
+            metadataHeaders: Optional[List[str]] = None):
+        def run():
+            msg = self._get(id)
+            out = {k: v for k, v in msg.items() if not k.startswith("_") and k != "payload"}
+            if format == "minimal":
+                return out
+            headers = msg["payload"]["headers"]
+            if format == "metadata":
+                wanted = {h.lower() for h in (metadataHeaders or [])}
+                if wanted:
+                    headers = [h for h in headers if h["name"].lower() in wanted]
+                out["payload"] = {"mimeType": msg["payload"]["mimeType"], "headers": headers}
+            elif format == "raw":
+                raw = "".join(f"{h['name']}: {h['value']}\r\n" for h in headers) + "\r\n" + msg["_body"]
+                out["raw"] = base64.urlsafe_b64encode(raw.encode()).decode()
+            else:
+                out["payload"] = _full_payload(msg)
+            return out
+        return self.svc._req("messages.get", run)
+
+    def list(self, userId: str = "me", q: str = "", maxResults: int = 100,
+             pageToken: Optional[str] = None, labelIds: Optional[List[str]] = None,
+             includeSpamTrash: bool = False):
+        # like Gmail, SPAM and TRASH are left out unless asked for
+        hide = set() if includeSpamTrash else {"SPAM", "TRASH"} - set(labelIds or [])
+        hide -= {t[3:].upper() for t in (q or "").split() if t.startswith("in:")}
+
+        def run():
+            msgs = sorted(self.box.messages.values(), key=lambda m: -int(m["internalDate"]))
+            msgs = [m for m in msgs if _matches_query(m, q)
+                    and all(l in m["labelIds"] for l in (labelIds or []))
+                    and not hide.intersection(m["labelIds"])]
+            offset = int(pageToken or 0)
+            page = msgs[offset:offset + min(int(maxResults), 500)]
+            resp: Dict[str, Any] = {"resultSizeEstimate": len(msgs)}
+            if page:
+                resp["messages"] = [{"id": m["id"], "threadId": m["threadId"]} for m in page]
+            if offset + len(page) < len(msgs):
+                resp["nextPageToken"] = str(offset + len(page))
+            return resp
+        return self.svc._req("messages.list", run)
+
+    def _apply(self, mid: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        msg = self._get(mid)
+        for lab in body.get("addLabelIds", []) + body.get("removeLabelIds", []):
+            if lab not in self.box.labels.values():
+                raise _http_error(400, f"Invalid label: {lab}")
+        with self.box.lock:
+            before = msg["labelIds"]
+            labels = [l for l in before if l not in body.get("removeLabelIds", [])]
+            labels += [l for l in body.get("addLabelIds", []) if l not in labels]
+            msg["labelIds"] = labels
+            added = [l for l in labels if l not in before]
+            removed = [l for l in before if l not in labels]
+            if added or removed:
+                # like Gmail, label changes move the mailbox historyId too
+                self.box.history_id += 1
+                msg["historyId"] = str(self.box.history_id)
+                ref = {"id": mid, "threadId": msg["threadId"], "labelIds": labels}
+                entry: Dict[str, Any] = {"id": str(self.box.history_id), "messages": [ref]}
+                if added:
+                    entry["labelsAdded"] = [{"message": ref, "labelIds": added}]
+                if removed:
+                    entry["labelsRemoved"] = [{"message": ref, "labelIds": removed}]
+                self.box.history.append(entry)
+        return {"id": mid, "threadId": msg["threadId"], "labelIds": labels}
+
+    def modify(self, userId: str = "me", id: str = "", body: Optional[Dict[str, Any]] = None):
+        return self.svc._req("messages.modify", lambda: self._apply(id, body or {}))
+
+    def batchModify(self, userId: str = "me", body: Optional[Dict[str, Any]] = None):
+        def run():
+            body_ = body or {}
+            if len(body_.get("ids", [])) > 1000:
+                raise _http_error(400, "Too many ids")
+            for mid in body_.get("ids", []):
+                if mid in self.box.messages:
+                    self._apply(mid, body_)
+            return {}
+        return self.svc._req("messages.batchModify", run)
+
+class _Labels:
+    def __init__(self, svc: FakeGmailService):
+        self.svc = svc
+        self.box = svc.mailbox
+
+    def list(self, userId: str = "me"):
+        return self.svc._req("labels.list", lambda: {
+            "labels": [{"id": lid, "name": name} for name, lid in self.box.labels.items()]
+        })
+
+    def create(self, userId: str = "me", body: Optional[Dict[str, Any]] = None):
+        def run():
+            name = (body or {})["name"]
+            if name in self.box.labels:
+                raise _http_error(409, "Label name exists or conflicts")
+            lid = f"Label_{len(self.box.labels)}"
+            self.box.labels[name] = lid
+            return {"id": lid, "name": name}
+        return self.svc._req("labels.create", run)
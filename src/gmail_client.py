@@ -1,12 +1,11 @@
 from __future__ import annotations
-import json, pathlib, time
-from typing import Optional, List, Dict, Any
+import calendar, json, pathlib, sys, threading, time
+from typing import Optional, List, Dict, Any, Tuple
 
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+import metrics, quota
+
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 TOKEN_PATH = ROOT / "token.json"
 CREDS_PATH = ROOT / "credentials.json"
@@ -15,32 +14,226 @@ STATE_PATH = ROOT / "state.json"
 # For read-only while we build the pipeline.
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
 
-def _load_state() -> Dict[str, Any]:
-    if STATE_PATH.exists():
-        return json.loads(STATE_PATH.read_text())
+# Gmail accepts at most 100 sub-requests in a single batch call.
+BATCH_LIMIT = 100
+
+# Gmail API quota cost per call (per-user limit: 250 units/second).
+QUOTA_UNITS = {
+    "getProfile": 1, "history.list": 2, "labels.list": 1, "labels.create": 5,
+    "messages.list": 5, "messages.get": 5, "messages.modify": 5, "messages.batchModify": 50,
+}
+
+def _bucket(service) -> "quota.TokenBucket":
+    return quota.bucket_for(getattr(service, "quota_user", "default"))
+
+def execute(service, request, method: str, units: Optional[int] = None):
+    """
+    Run one API request (or batch) made from `service`. Every Gmail call goes
+    through here: it waits for the mailbox's quota (see quota.py), retries
+    429/5xx with backoff, and records latency, calls, errors and units.
+    `units` overrides QUOTA_UNITS[method] (batches).
+    """
+    units = units if units is not None else QUOTA_UNITS.get(method, 0)
+    _refresh_due(service)
+    if not metrics.enabled():
+        return quota.call(request, _bucket(service), units, method)
+    metrics.inc("spam_gmail_requests_total", method=method)
+    metrics.inc("spam_gmail_quota_units_total", units)
+    with metrics.timer("spam_gmail_request_seconds", method=method):
+        try:
+            return quota.call(request, _bucket(service), units, method)
+        except HttpError as e:
+            metrics.inc("spam_gmail_errors_total", method=method, status=e.resp.status)
+            raise
+
+# Functions below take optional token/state paths so several mailboxes can be
+# watched from one process (see accounts.py); None means the single-account files.
+
+def _load_state(path: Optional[pathlib.Path] = None) -> Dict[str, Any]:
+    path = path or STATE_PATH
+    if path.exists():
+        return json.loads(path.read_text())
     return {}
 
-def _save_state(d: Dict[str, Any]) -> None:
-    STATE_PATH.write_text(json.dumps(d, indent=2))
+def _save_state(d: Dict[str, Any], path: Optional[pathlib.Path] = None) -> None:
+    (path or STATE_PATH).write_text(json.dumps(d, indent=2))
+
+# --- service construction ---
+#
+# Building a service used to mean re-reading token.json, maybe refreshing it,
+# rewriting it and fetching/parsing the discovery document. Now each mailbox
+# has one shared Credentials object (loaded once, refreshed ahead of expiry,
+# saved only when it changes), the discovery document is parsed once per
+# process from a local copy, and every thread gets its own service with its
+# own keep-alive connection (httplib2 is not thread-safe).
+
+DISCOVERY_PATH = ROOT / "gmail.v1.discovery.json"
+REFRESH_MARGIN = 300.0      # refresh access tokens this many seconds before they expire
+HTTP_TIMEOUT = 60.0
 
-def get_service():
-    creds: Optional[Credentials] = None
-    if TOKEN_PATH.exists():
-        creds = Credentials.from_authorized_user_file(str(TOKEN_PATH), SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+_discovery: Optional[Dict[str, Any]] = None
+_discovery_lock = threading.Lock()
+
+def _discovery_doc() -> Dict[str, Any]:
+    """
+    The Gmail discovery document, parsed once. Read from DISCOVERY_PATH, else
+    from the copy bundled with google-api-python-client (written to
+    DISCOVERY_PATH for next time), else fetched once over the network.
+    """
+    global _discovery
+    with _discovery_lock:
+        if _discovery is not None:
+            return _discovery
+        text = None
+        try:
+            text = DISCOVERY_PATH.read_text()
+        except OSError:
+            pass
+        if text is None:
+            try:
+                from googleapiclient.discovery_cache import get_static_doc
+                text = get_static_doc("gmail", "v1")
+            except ImportError:
+                pass
+        if text is None:
+            from googleapiclient.discovery import build
+            text = json.dumps(build("gmail", "v1", static_discovery=False)._rootDesc)
+        doc = json.loads(text)
+        if not DISCOVERY_PATH.exists():
+            try:
+                tmp = DISCOVERY_PATH.with_suffix(".tmp")
+                tmp.write_text(text)
+                tmp.replace(DISCOVERY_PATH)
+            except OSError as e:
+                print(f"[warn] caching discovery document: {e!r}", file=sys.stderr)
+        _discovery = doc
+        return doc
+
+class _Token:
+    """One mailbox's credentials, shared by all of its services."""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.creds = None
+        self.refresh_at = 0.0       # epoch seconds; checked before every request
+        self._saved: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def credentials(self):
+        with self._lock:
+            if self.creds is None:
+                self._load()
+            return self.creds
+
+    def _load(self) -> None:
+        from google.oauth2.credentials import Credentials
+        creds = None
+        if self.path.exists():
+            self._saved = self.path.read_text()
+            creds = Credentials.from_authorized_user_info(json.loads(self._saved), SCOPES)
+        if creds and not creds.valid and creds.refresh_token:
             try:
-                from google.auth.transport.requests import Request
-                creds.refresh(Request())
+                self._refresh(creds)
             except Exception:
                 creds = None
-        if not creds:
+        if not creds or not creds.valid:
             if not CREDS_PATH.exists():
                 raise FileNotFoundError("credentials.json not found in project root.")
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(str(CREDS_PATH), SCOPES)
             creds = flow.run_local_server(port=0)
-        TOKEN_PATH.write_text(creds.to_json())
-    return build("gmail", "v1", credentials=creds)
+        self.creds = creds
+        self._schedule()
+        self._save()
+
+    def _refresh(self, creds) -> None:
+        from google.auth.transport.requests import Request
+        creds.refresh(Request())
+        metrics.inc("spam_gmail_token_refreshes_total")
+
+    def _schedule(self) -> None:
+        expiry = self.creds.expiry      # naive UTC, or None if unknown
+        if expiry is None:
+            self.refresh_at = float("inf")
+        else:
+            self.refresh_at = calendar.timegm(expiry.timetuple()) - REFRESH_MARGIN
+
+    def _save(self) -> None:
+        text = self.creds.to_json()
+        if text == self._saved:
+            return
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_text(text)
+        tmp.replace(self.path)
+        self._saved = text
+
+    def ensure_fresh(self) -> None:
+        """Refresh the access token if it expires within REFRESH_MARGIN."""
+        if time.time() < self.refresh_at:
+            return
+        with self._lock:
+            if self.creds is None or time.time() < self.refresh_at:
+                return
+            try:
+                self._refresh(self.creds)
+            except Exception as e:
+                # the transport still refreshes on a 401; try again in a minute
+                print(f"[error] token refresh ({self.path.name}): {e!r}", file=sys.stderr)
+                metrics.inc("spam_errors_total", where="token_refresh")
+                self.refresh_at = time.time() + 60
+                return
+            self._schedule()
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[error] saving {self.path.name}: {e!r}", file=sys.stderr)
+
+_tokens: Dict[str, _Token] = {}
+_tokens_lock = threading.Lock()
+_local = threading.local()
+
+def _token_for(token_path: pathlib.Path) -> _Token:
+    with _tokens_lock:
+        t = _tokens.get(str(token_path))
+        if t is None:
+            t = _tokens[str(token_path)] = _Token(token_path)
+        return t
+
+def _refresh_due(service) -> None:
+    t = _tokens.get(getattr(service, "quota_user", ""))
+    if t is not None:
+        t.ensure_fresh()
+
+def build_service(token_path: Optional[pathlib.Path] = None):
+    """
+    A new service for one mailbox with its own connection; runs the OAuth
+    flow on first use if there is no token. Cheap after the first call.
+    """
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build_from_document
+
+    token_path = token_path or TOKEN_PATH
+    token = _token_for(token_path)
+    creds = token.credentials()
+    token.ensure_fresh()
+    t0 = time.perf_counter()
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    service = build_from_document(_discovery_doc(), http=http)
+    service.quota_user = str(token_path)    # services of one mailbox share its quota bucket
+    metrics.observe("spam_gmail_service_build_seconds", time.perf_counter() - t0)
+    return service
+
+def get_service(token_path: Optional[pathlib.Path] = None):
+    """This thread's service for the mailbox, built on first use and then reused."""
+    token_path = token_path or TOKEN_PATH
+    pool = getattr(_local, "services", None)
+    if pool is None:
+        pool = _local.services = {}
+    service = pool.get(str(token_path))
+    if service is None:
+        service = pool[str(token_path)] = build_service(token_path)
+    return service
 
 def _get_header(headers: List[Dict[str, str]], name: str) -> str:
     name = name.lower()
@@ -49,26 +242,99 @@ def _get_header(headers: List[Dict[str, str]], name: str) -> str:
             return h.get("value", "")
     return ""
 
-def bootstrap_history_id(service) -> int:
+def _chunks(items: List[str], size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _get_request(service, mid: str, fmt: str, headers: Optional[List[str]]):
+    if fmt == "metadata":
+        return service.users().messages().get(
+            userId="me", id=mid, format="metadata", metadataHeaders=headers
+        )
+    return service.users().messages().get(userId="me", id=mid, format=fmt)
+
+def get_metadata_batch(service, ids: List[str], headers: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Fetch format=metadata for many messages (see get_messages_batch)."""
+    return get_messages_batch(service, ids, "metadata", headers)
+
+def get_messages_batch(service, ids: List[str], fmt: str = "metadata",
+                       headers: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch messages in format `fmt` using Gmail batch requests.
+    Returns {message_id: raw message resource}. Items rejected inside a batch
+    for rate are re-batched after a backoff; other failures are retried one
+    by one, and ids that still fail (e.g. deleted meanwhile) are omitted.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    failed: List[str] = []
+    throttled: Dict[str, Exception] = {}
+
+    def _on_item(request_id, response, exception):
+        if exception is None:
+            results[request_id] = response
+        elif quota.is_retryable(exception):
+            throttled[request_id] = exception
+        else:
+            failed.append(request_id)
+
+    pending = list(dict.fromkeys(ids))
+    for attempt in range(quota.MAX_RETRIES + 1):
+        for chunk in _chunks(pending, BATCH_LIMIT):
+            if len(chunk) == 1:
+                failed.extend(chunk)
+                continue
+            batch = service.new_batch_http_request(callback=_on_item)
+            for mid in chunk:
+                batch.add(_get_request(service, mid, fmt, headers), request_id=mid)
+            execute(service, batch, "batch", units=QUOTA_UNITS["messages.get"] * len(chunk))
+        if not throttled:
+            break
+        # sub-requests rejected for rate: back off, then re-batch just those
+        pending, first_error = list(throttled), next(iter(throttled.values()))
+        throttled.clear()
+        if attempt == quota.MAX_RETRIES:
+            failed.extend(pending)
+            break
+        delay = quota.backoff_delay(attempt, first_error)
+        _bucket(service).pause(delay)
+        time.sleep(delay)
+
+    for mid in failed:
+        try:
+            results[mid] = execute(service, _get_request(service, mid, fmt, headers), "messages.get")
+        except HttpError as e:
+            if e.resp.status == 404:
+                continue
+            raise
+    return results
+
+def bootstrap_history_id(service, state_path: Optional[pathlib.Path] = None) -> int:
     """Pick a safe starting point so we only react to *new* mail going forward."""
-    resp = service.users().messages().list(userId="me", maxResults=10).execute()
+    resp = execute(service, service.users().messages().list(userId="me", maxResults=10), "messages.list")
     ids = [m["id"] for m in resp.get("messages", [])]
     max_hid = 0
-    for mid in ids:
-        msg = service.users().messages().get(
-            userId="me", id=mid, format="metadata", metadataHeaders=["Subject"]
-        ).execute()
+    for msg in get_metadata_batch(service, ids, ["Subject"]).values():
         hid = int(msg.get("historyId", 0))
         max_hid = max(max_hid, hid)
     if max_hid == 0:
-        prof = service.users().getProfile(userId="me").execute()
+        prof = execute(service, service.users().getProfile(userId="me"), "getProfile")
         max_hid = int(prof.get("historyId", 1))
-    st = _load_state()
+    st = _load_state(state_path)
     st["last_history_id"] = max_hid
-    _save_state(st)
+    _save_state(st, state_path)
     return max_hid
 
-def _fetch_changes_since(service, start_history_id: int) -> Dict[str, Any]:
+def current_history_id(service) -> int:
+    """The mailbox's latest historyId: one cheap getProfile call."""
+    prof = execute(service, service.users().getProfile(userId="me"), "getProfile")
+    return int(prof.get("historyId", 0))
+
+def last_seen_history_id(state_path: Optional[pathlib.Path] = None) -> Optional[int]:
+    hid = _load_state(state_path).get("last_history_id")
+    return int(hid) if hid is not None else None
+
+def _fetch_changes_since(service, start_history_id: int,
+                         profile_history_id: Optional[int] = None) -> Dict[str, Any]:
     """Return (new_history_id, list_of_new_message_ids)."""
     new_message_ids: List[str] = []
     page_token = None
@@ -83,7 +349,7 @@ def _fetch_changes_since(service, start_history_id: int) -> Dict[str, Any]:
             labelId="INBOX",  # helps focus on inbox changes
             maxResults=100,
         )
-        resp = req.execute()
+        resp = execute(service, req, "history.list")
         for h in resp.get("history", []):
             latest_hid = max(latest_hid, int(h.get("id", start_history_id)))
             for added in h.get("messagesAdded", []):
@@ -99,29 +365,37 @@ def _fetch_changes_since(service, start_history_id: int) -> Dict[str, Any]:
     # If there were no history entries returned, Gmail may still give a 'historyId'
     # from profile that advances; we’ll grab a fresh one to keep moving forward.
     if latest_hid == start_history_id:
-        prof = service.users().getProfile(userId="me").execute()
-        latest_hid = max(latest_hid, int(prof.get("historyId", start_history_id)))
+        if profile_history_id is None:
+            profile_history_id = current_history_id(service) or start_history_id
+        latest_hid = max(latest_hid, profile_history_id)
     return {"latest_history_id": latest_hid, "new_message_ids": list(dict.fromkeys(new_message_ids))}
 
-def poll_once(service) -> List[Dict[str, str]]:
+def messages_added_since(service, start_history_id: int) -> List[str]:
+    """Ids of INBOX mail added after `start_history_id`; doesn't touch the saved cursor."""
+    return _fetch_changes_since(service, start_history_id, start_history_id)["new_message_ids"]
+
+@metrics.timed("spam_poll_seconds")
+def poll_once(service, profile_history_id: Optional[int] = None,
+              state_path: Optional[pathlib.Path] = None) -> List[Dict[str, str]]:
     """
-    Returns a list of dicts with keys: id, from, subject, snippet
-    for *new* messages since last poll. Updates last_history_id.
+    Returns a list of dicts with keys: id, threadId, from, subject, snippet,
+    internalDate for *new* messages since last poll. Updates last_history_id.
+    Pass `profile_history_id` if the caller already fetched it via getProfile.
     """
-    st = _load_state()
+    st = _load_state(state_path)
     if "last_history_id" not in st:
-        hid = bootstrap_history_id(service)
+        hid = bootstrap_history_id(service, state_path)
         print(f"[init] Baseline historyId: {hid}")
-        st = _load_state()
+        st = _load_state(state_path)
 
     start_hid = int(st["last_history_id"])
     try:
-        result = _fetch_changes_since(service, start_hid)
+        result = _fetch_changes_since(service, start_hid, profile_history_id)
     except HttpError as e:
         # If startHistoryId is too old or invalid, reset baseline gracefully.
         if e.resp.status in (404, 400):
             print("[warn] startHistoryId invalid/expired; re-baselining.")
-            hid = bootstrap_history_id(service)
+            hid = bootstrap_history_id(service, state_path)
             return []
         raise
 
@@ -130,42 +404,79 @@ def poll_once(service) -> List[Dict[str, str]]:
 
     if latest_hid != start_hid:
         st["last_history_id"] = latest_hid
-        _save_state(st)
+        _save_state(st, state_path)
 
-    new_msgs: List[Dict[str, str]] = []
-    for mid in new_ids:
-        msg = service.users().messages().get(
-            userId="me",
-            id=mid,
-            format="metadata",
-            metadataHeaders=["From", "Subject"],
-        ).execute()
-        headers = msg.get("payload", {}).get("headers", [])
-        new_msgs.append({
-            "id": mid,
-            "threadId": msg.get("threadId"),
-            "from": _get_header(headers, "From"),
-            "subject": _get_header(headers, "Subject"),
-            "snippet": msg.get("snippet", ""),
-        })
-    return new_msgs
+    fetched = get_metadata_batch(service, new_ids, ["From", "Subject"])
+    return [message_summary(fetched[mid]) for mid in new_ids if mid in fetched]
+
+def message_summary(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields the classifier and storage use, from a format=metadata resource."""
+    headers = msg.get("payload", {}).get("headers", [])
+    return {
+        "id": msg["id"],
+        "threadId": msg.get("threadId"),
+        "from": _get_header(headers, "From"),
+        "subject": _get_header(headers, "Subject"),
+        "snippet": msg.get("snippet", ""),
+        "internalDate": msg.get("internalDate"),
+        "labelIds": msg.get("labelIds", []),
+    }
+
+def list_message_ids(service, query: str = "", page_token: Optional[str] = None,
+                     page_size: int = 500, include_spam_trash: bool = False) -> Tuple[List[str], Optional[str]]:
+    """One page of messages.list: (ids, next page token or None)."""
+    resp = execute(service, service.users().messages().list(
+        userId="me", q=query, pageToken=page_token, maxResults=page_size,
+        includeSpamTrash=include_spam_trash), "messages.list")
+    return [m["id"] for m in resp.get("messages", [])], resp.get("nextPageToken")
 
 # --- Label & modify helpers ---
 
-def _get_or_create_label(service, name: str) -> str:
+# messages.batchModify accepts at most 1000 ids per call.
+MODIFY_LIMIT = 1000
+
+class LabelRegistry:
+    """
+    Cache of label name -> labelId for one mailbox. The label list is loaded
+    once and only re-read on a cache miss or after a stale id was rejected.
+    """
+
+    def __init__(self):
+        self._ids: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, service) -> None:
+        labels_resp = execute(service, service.users().labels().list(userId="me"), "labels.list")
+        self._ids = {lab["name"]: lab["id"] for lab in labels_resp.get("labels", [])}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._ids = None
+
+    def get_or_create(self, service, name: str) -> str:
+        with self._lock:
+            if self._ids is None or name not in self._ids:
+                self._refresh(service)
+            if name in self._ids:
+                return self._ids[name]
+            body = {
+                "name": name,
+                "labelListVisibility": "labelShow",
+                "messageListVisibility": "show",
+            }
+            created = execute(service, service.users().labels().create(userId="me", body=body), "labels.create")
+            self._ids[name] = created["id"]
+            return created["id"]
+
+_labels = LabelRegistry()
+
+def _get_or_create_label(service, name: str, registry: Optional[LabelRegistry] = None) -> str:
     """Return the labelId for a given label name; create it if it doesn't exist."""
-    labels_resp = service.users().labels().list(userId="me").execute()
-    for lab in labels_resp.get("labels", []):
-        if lab.get("name") == name:
-            return lab["id"]
-    # Create label
-    body = {
-        "name": name,
-        "labelListVisibility": "labelShow",
-        "messageListVisibility": "show",
-    }
-    created = service.users().labels().create(userId="me", body=body).execute()
-    return created["id"]
+    return (registry or _labels).get_or_create(service, name)
+
+def _is_stale_label(e: HttpError) -> bool:
+    # Gmail answers 404 (or 400 "Invalid label") when a cached user label was deleted.
+    return e.resp.status in (400, 404)
 
 def mark_as_spam(service, message_id: str) -> None:
     """Move a message to Gmail's Spam (system) label and remove from INBOX."""
@@ -173,7 +484,7 @@ def mark_as_spam(service, message_id: str) -> None:
         "addLabelIds": ["SPAM"],    # system label
         "removeLabelIds": ["INBOX"]
     }
-    service.users().messages().modify(userId="me", id=message_id, body=body).execute()
+    execute(service, service.users().messages().modify(userId="me", id=message_id, body=body), "messages.modify")
 
 def unmark_spam_to_inbox(service, message_id: str) -> None:
     """Remove SPAM label and restore to INBOX."""
@@ -181,9 +492,76 @@ def unmark_spam_to_inbox(service, message_id: str) -> None:
         "addLabelIds": ["INBOX"],
         "removeLabelIds": ["SPAM"]
     }
-    service.users().messages().modify(userId="me", id=message_id, body=body).execute()
+    execute(service, service.users().messages().modify(userId="me", id=message_id, body=body), "messages.modify")
 
-def add_label(service, message_id: str, label_name: str) -> None:
-    lab_id = _get_or_create_label(service, label_name)
+def add_label(service, message_id: str, label_name: str,
+              registry: Optional[LabelRegistry] = None) -> None:
+    registry = registry or _labels
+    lab_id = registry.get_or_create(service, label_name)
     body = {"addLabelIds": [lab_id], "removeLabelIds": []}
-    service.users().messages().modify(userId="me", id=message_id, body=body).execute()
+    try:
+        execute(service, service.users().messages().modify(userId="me", id=message_id, body=body), "messages.modify")
+    except HttpError as e:
+        if not _is_stale_label(e):
+            raise
+        registry.invalidate()
+        body["addLabelIds"] = [registry.get_or_create(service, label_name)]
+        execute(service, service.users().messages().modify(userId="me", id=message_id, body=body), "messages.modify")
+
+class BulkActions:
+    """
+    Collect spam / keep / label actions and apply them with as few
+    messages.batchModify calls as possible: one call per distinct label
+    change per 1000 messages.
+
+        acts = BulkActions()
+        acts.spam(mid1); acts.spam(mid2); acts.label(mid3, "Suspicious")
+        acts.flush(service)   # -> 2 requests
+    """
+
+    SPAM = (("SPAM",), ("INBOX",))
+    KEEP = (("INBOX",), ("SPAM",))
+
+    def __init__(self, registry: Optional[LabelRegistry] = None):
+        self.registry = registry or _labels
+        # (add names, remove names, is_user_label) -> message ids
+        self._pending: Dict[tuple, List[str]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._pending.values())
+
+    def _add(self, key: tuple, message_id: str) -> None:
+        self._pending.setdefault(key, []).append(message_id)
+
+    def spam(self, message_id: str) -> None:
+        self._add(self.SPAM + (False,), message_id)
+
+    def keep(self, message_id: str) -> None:
+        self._add(self.KEEP + (False,), message_id)
+
+    def label(self, message_id: str, label_name: str) -> None:
+        self._add(((label_name,), (), True), message_id)
+
+    def _body(self, service, key: tuple, ids: List[str]) -> Dict[str, Any]:
+        add, remove, user_label = key
+        if user_label:
+            add = [self.registry.get_or_create(service, n) for n in add]
+        return {"ids": ids, "addLabelIds": list(add), "removeLabelIds": list(remove)}
+
+    def flush(self, service) -> int:
+        """Send all pending actions. Returns the number of batchModify requests made."""
+        pending, self._pending = self._pending, {}
+        n_requests = 0
+        for key, ids in pending.items():
+            for chunk in _chunks(list(dict.fromkeys(ids)), MODIFY_LIMIT):
+                msgs = service.users().messages()
+                try:
+                    execute(service, msgs.batchModify(userId="me", body=self._body(service, key, chunk)), "messages.batchModify")
+                except HttpError as e:
+                    if not (key[2] and _is_stale_label(e)):
+                        raise
+                    self.registry.invalidate()
+                    execute(service, msgs.batchModify(userId="me", body=self._body(service, key, chunk)), "messages.batchModify")
+                    n_requests += 1
+                n_requests += 1
+        return n_requests
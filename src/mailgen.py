@@ -0,0 +1,83 @@
+"""
+Synthetic mailbox generator for benchmarks and the fake Gmail service.
+
+Mail comes from a fixed pool of senders with a skewed (Zipf-like) volume, so
+a few newsletters and colleagues account for most messages, as in a real
+inbox. Spam is drawn from a few campaigns that repeat near-identical
+subjects with small variations. Every message carries its ground truth in
+"label" (1 = spam, 0 = ham).
+"""
+from __future__ import annotations
+import random, time
+from typing import Any, Dict, List
+
+from classify.baseline import SUSPICIOUS_WORDS
+
+HAM_SUBJECTS = ["Team sync notes", "Lunch tomorrow?", "Invoice #{n} attached", "Re: project update",
+                "Your order has shipped", "Weekly newsletter", "Meeting moved to 3pm", "Photos from the trip",
+                "Re: Re: quarterly numbers", "Your receipt from the store", "Build #{n} passed", "PR #{n} review requested"]
+HAM_SNIPPETS = ["Hi, see you soon. Let me know if the time still works for you.",
+                "Attached are the notes from today's call, thanks everyone for joining.",
+                "Your package is on the way and should arrive by Thursday.",
+                "This week: three stories from the team and an update on the roadmap.",
+                "Can you take a look at the draft before Friday? Thanks!"]
+SPAM_CAMPAIGNS = [
+    ("YOU ARE A WINNER #{n}", "Claim your prize now, act now before it expires {link} {link}"),
+    ("Final notice: verify account", "Unusual activity detected. Verify account within 24h {link}"),
+    ("Claim your gift card now", "Limited time offer: free gift card for our loyal customers {link}"),
+    ("Double your bitcoin today", "Risk-free crypto investment, double your money {link} {link} {link}"),
+    ("Work from home, earn $$$", "Earn $$$ from home, no experience needed. Reply now {link}"),
+]
+HAM_DOMAINS = ["gmail.com", "company.com", "mail.university.edu", "github.com", "news.example.org",
+               "calendar.example.com", "shop.example.co.uk"]
+SPAM_DOMAINS = ["promo.deals.xyz", "secure-login.top", "win.click", "bonus.casino.loan", "alerts.work",
+                "account-verify.gq", "mail.offers.review"]
+HAM_NAMES = ["Alice", "Bob", "Carol", "Dave", "Erin", "Newsletter", "GitHub", "Calendar", "Store"]
+
+def _pick_zipf(rnd: random.Random, n: int, s: float = 1.1) -> int:
+    weights = [1.0 / (k + 1) ** s for k in range(n)]
+    return rnd.choices(range(n), weights=weights)[0]
+
+def generate(n: int, spam_ratio: float = 0.3, seed: int = 0, n_senders: int = 500,
+             start_ts: float | None = None, spacing_s: float = 60.0) -> List[Dict[str, Any]]:
+    """
+    Return n message dicts with keys id, from, subject, snippet, body,
+    internalDate (ms) and label. Messages are spaced `spacing_s` apart
+    starting at `start_ts` (default: n * spacing_s seconds ago).
+    """
+    rnd = random.Random(seed)
+    start = start_ts if start_ts is not None else time.time() - n * spacing_s
+    spam_senders = [f"user{k}@{rnd.choice(SPAM_DOMAINS)}" for k in range(max(1, n_senders // 3))]
+    ham_senders = [f"{HAM_NAMES[k % len(HAM_NAMES)].lower()}{k}@{rnd.choice(HAM_DOMAINS)}"
+                   for k in range(n_senders)]
+    msgs = []
+    for i in range(n):
+        spam = rnd.random() < spam_ratio
+        if spam:
+            subj_t, snip_t = SPAM_CAMPAIGNS[_pick_zipf(rnd, len(SPAM_CAMPAIGNS))]
+            addr = spam_senders[_pick_zipf(rnd, len(spam_senders))]
+            name = "Rewards Team"
+            extra = " ".join(rnd.sample(SUSPICIOUS_WORDS, 2))
+            snippet = snip_t.replace("{link}", f"https://{rnd.choice(SPAM_DOMAINS)}/r/{i}") + " " + extra
+            subj_t = subj_t.format(n=i)
+            if rnd.random() < 0.3:
+                subj_t = subj_t.upper()
+        else:
+            subj_t = rnd.choice(HAM_SUBJECTS).format(n=i)
+            k = _pick_zipf(rnd, len(ham_senders))
+            addr = ham_senders[k]
+            name = HAM_NAMES[k % len(HAM_NAMES)]
+            snippet = rnd.choice(HAM_SNIPPETS)
+            if rnd.random() < 0.2:
+                snippet += f" https://{addr.split('@')[1]}/docs/{i}"
+        subject = subj_t
+        msgs.append({
+            "id": f"{i + 1:016x}",
+            "from": f"{name} <{addr}>",
+            "subject": subject,
+            "snippet": snippet[:200],
+            "body": (snippet + "\n") * rnd.randint(3, 30),
+            "internalDate": int((start + i * spacing_s) * 1000),
+            "label": 1 if spam else 0,
+        })
+    return msgs
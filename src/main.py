@@ -1,11 +1,17 @@
-import time, json
-from gmail_client import get_service, poll_once, mark_as_spam, unmark_spam_to_inbox, add_label
-from classify.baseline import load_or_init, predict, _heuristics, combine_scores, explain
-from storage import log_decision
-from notify import notify
-import math
-
-POLL_SECONDS = 30
+import argparse
+import metrics
+from gmail_client import get_service
+from classify.registry import open_live
+from pipeline import MailPipeline, CHOSEN
+from scheduler import PollScheduler, MIN_POLL_SECONDS, MAX_POLL_SECONDS
+from accounts import load_accounts, ACCOUNTS_PATH, MAX_WORKERS
+from cache import get_result_cache
+from classify.baseline import get_cascade
+from classify.parallel import get_pool
+import body
+from reputation import get_reputation
+from storage import get_storage
+import retention
 
 def ask_action(msg, suggested: str, score: float, reasons: str):
     print(f"Suggested: {suggested.upper()} (score={score:.2f})")
@@ -18,70 +24,102 @@ def ask_action(msg, suggested: str, score: float, reasons: str):
             return choice
         print("Please enter s/k/l/n or press Enter")
 
-def main():
-    svc = get_service()
-    print("✅ Auth OK. Loading model…")
-    model = load_or_init()
-
-    print("Starting poll loop…")
+def review_loop(pipe: MailPipeline) -> None:
+    """Drain the review queue at the operator's pace; everything else keeps running."""
     while True:
-        try:
-            new_msgs = poll_once(svc)
-            if new_msgs:
-                print(f"📥 New messages: {len(new_msgs)}")
-                texts = []
-                for m in new_msgs:
-                    subj = (m["subject"] or "").strip()
-                    text = f"{subj}\n{m['snippet']}"
-                    texts.append(text)
-
-                model_scores = predict(model, texts)
-
-                for m, mscore in zip(new_msgs, model_scores):
-                    subject = (m["subject"] or "").strip()
-                    heur, reasons_list = _heuristics(subject, m["snippet"], m["from"])
-                    score = math.ceil(combine_scores(heur, float(mscore)))
-                    reasons = explain(reasons_list, float(mscore))
-                    suggested = "spam" if score >= 0.65 else ("suspicious" if score >= 0.50 else "keep")
+        item = pipe.next_for_review()
+        if item is None:
+            continue
+        m = item.message
+        subject = (m["subject"] or "").strip()
+        backlog = pipe.review_q.qsize()
+        print(f"\n— From: {m['from']}\n  Subject: {subject[:200]}\n  Spam Possibility: {item.score * 100:.0f}%\n  Reasons: {item.reasons}")
+        if backlog:
+            print(f"  ({backlog} more waiting)")
+        action_key = ask_action(m, item.suggested, item.score, item.reasons)
+        pipe.submit_action(item, action_key)
+        print({"spam": "→ Moved to Spam", "ham": "→ Kept in Inbox",
+               "suspicious": "→ Labeled 'Suspicious'"}.get(CHOSEN[action_key], "→ No action"))
 
-                    # clickable URL to open the thread in Gmail (works for primary account index 0)
-                    url = None
-                    if m.get("threadId"):
-                        url = f"https://mail.google.com/mail/u/0/#inbox/{m['threadId']}"
-
-                    subtitle = f"{m['from']}"
-                    notif_msg = f"Spam Possibility: {score * 100}% · {subject[:90]}"
-                    notify(title="New Email", subtitle=subtitle, message=notif_msg, url=url)
-
-
-                    # Keep the CLI as the action surface
-                    print(f"\n— From: {m['from']}\n  Subject: {subject[:200]}\n  Spam Possibility: {score * 100}%\n  Reasons: {reasons}")
-                    action_key = ask_action(m, suggested, score, reasons)
+def main():
+    ap = argparse.ArgumentParser(description="Watch Gmail and flag likely spam.")
+    ap.add_argument("--auto", action="store_true",
+                    help="headless: apply the spam/suspicious thresholds without prompting")
+    ap.add_argument("--min-interval", type=float, default=MIN_POLL_SECONDS,
+                    help="poll interval while mail is arriving (seconds)")
+    ap.add_argument("--max-interval", type=float, default=MAX_POLL_SECONDS,
+                    help="upper bound for the idle back-off (seconds)")
+    ap.add_argument("--accounts", nargs="?", const=str(ACCOUNTS_PATH), default=None,
+                    help=f"watch every mailbox listed in this file (default {ACCOUNTS_PATH.name})")
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS,
+                    help="concurrent account polls in --accounts mode")
+    ap.add_argument("--metrics-file", default=None,
+                    help="write Prometheus metrics to this file every 15 s (textfile collector)")
+    ap.add_argument("--metrics-port", type=int, default=None,
+                    help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    ap.add_argument("--profile", action="store_true",
+                    help="run the sampling profiler and print the hottest lines on exit")
+    args = ap.parse_args()
 
-                    if action_key == "s":
-                        mark_as_spam(svc, m["id"])
-                        chosen = "spam"
-                        print("→ Moved to Spam")
-                    elif action_key == "k":
-                        unmark_spam_to_inbox(svc, m["id"])
-                        chosen = "ham"
-                        print("→ Kept in Inbox")
-                    elif action_key == "l":
-                        add_label(svc, m["id"], "Suspicious")
-                        chosen = "suspicious"
-                        print("→ Labeled 'Suspicious'")
-                    else:
-                        chosen = "none"
-                        print("→ No action")
+    exporter = profiler = None
+    if args.metrics_file or args.metrics_port:
+        metrics.enable()
+    if args.metrics_file:
+        exporter = metrics.TextfileExporter(args.metrics_file)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print(f"📊 Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.profile:
+        profiler = metrics.SamplingProfiler().start()
 
-                    log_decision(m["id"], score, chosen, reasons)
+    accounts = None
+    if args.accounts:
+        import pathlib
+        accounts = load_accounts(pathlib.Path(args.accounts),
+                                 min_interval=args.min_interval, max_interval=args.max_interval)
+        for acct in accounts:   # run any OAuth flows before worker threads start
+            acct.authorize()
+            print(f"✅ Auth OK: {acct.name}")
+    else:
+        get_service()  # run the OAuth flow (if needed) before worker threads start
+        print("✅ Auth OK.")
+    print("Loading model…")
+    model = open_live()
+    by_name = {a.name: a for a in accounts or []}
+    body_scorer = body.install(lambda name: by_name[name].new_service() if name else get_service())
 
-        except KeyboardInterrupt:
-            print("\nStopping.")
-            break
-        except Exception as e:
-            print(f"[error] {e!r}")
-        time.sleep(POLL_SECONDS)
+    scheduler = PollScheduler(args.min_interval, args.max_interval)
+    pipe = MailPipeline(get_service, model, auto=args.auto, scheduler=scheduler,
+                        accounts=accounts, max_workers=args.workers,
+                        result_cache=get_result_cache(), reputation=get_reputation())
+    # old decisions are rolled up daily so state.db stays bounded
+    cleaner = retention.RetentionJob(get_storage()) if retention.RETAIN_DAYS > 0 else None
+    print("Starting poll loop…" + (" (auto mode)" if args.auto else ""))
+    pipe.start()
+    try:
+        if args.auto:
+            pipe.stop_event.wait()
+        else:
+            review_loop(pipe)
+    except (KeyboardInterrupt, EOFError):
+        print("\nStopping.")
+    finally:
+        pipe.shutdown()
+        if cleaner:
+            cleaner.close()
+        print(f"poll stats: {pipe.poll_stats()}")
+        print(f"classify cache: {pipe.result_cache.stats()}")
+        print(f"reputation: {pipe.reputation.stats()}")
+        print(f"model: {pipe.live.stats()}")
+        print(f"cascade: {get_cascade().stats()}")
+        print(f"scoring pool: {get_pool().stats()}")
+        if body_scorer:
+            print(f"body fetch: {body_scorer.stats()}")
+        if exporter:
+            exporter.close()
+        if profiler:
+            profiler.stop()
+            print("profile (share of samples):\n" + profiler.report())
 
 if __name__ == "__main__":
     main()
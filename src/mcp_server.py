@@ -1,96 +1,149 @@
+"""
+MCP server exposing the mailbox and classifier as tools.
+
+Tools are async; the blocking Gmail and model work runs on a bounded thread
+pool so parallel calls from the client overlap instead of queueing. Each pool
+thread has its own Gmail service (httplib2 is not thread-safe). The model and
+the first service are warmed in the background as soon as the server starts,
+and identical requests that are already in flight share one result.
+"""
 from __future__ import annotations
-from typing import Optional, List, Dict, Any
+import asyncio, os, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Callable, Hashable
 from mcp.server.fastmcp import FastMCP
 
 # Reuse your app code
-from gmail_client import get_service
+from gmail_client import get_service, get_metadata_batch, execute, message_summary
 from gmail_client import mark_as_spam as gmail_mark_as_spam
-from gmail_client import unmark_spam_to_inbox as gmail_unmark_spam
-from classify.baseline import load_or_init, predict, _heuristics, combine_scores, explain
-from storage import fetch_labeled_data
+from classify.baseline import Cascade, classify_batch, learn, is_online
+from classify.registry import LiveModel, open_live
+from storage import get_decision
+import metrics
+from cache import TTLCache, ResultCache, get_result_cache
+from reputation import Reputation, get_reputation
+import body
 
 mcp = FastMCP("spam-notifier-mcp")
 
-# Lazy singletons
-_gmail = None
-_model = None
+MAX_WORKERS = int(os.environ.get("SPAM_MCP_WORKERS", "8"))
+_pool = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix="mcp")
+
+_service_factory: Callable[[], Any] = get_service
+_local = threading.local()
+_live: Optional[LiveModel] = None
+_results: Optional[ResultCache] = None
+_reputation: Optional[Reputation] = None
+_warm: Optional[Future] = None
+_warm_lock = threading.Lock()
+_inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+_cascade: Optional[Cascade] = None
+
+def _gmail():
+    """This thread's Gmail service."""
+    svc = getattr(_local, "gmail", None)
+    if svc is None:
+        svc = _local.gmail = _service_factory()
+    return svc
+
+def _init():
+    global _live, _results, _reputation, _cascade
+    if _live is None:
+        _live = open_live()
+    if _cascade is None:
+        # borderline scores fetch the body on the calling pool thread's service
+        cascade = Cascade.from_env()
+        body.install(lambda account: _gmail(), cascade)
+        _cascade = cascade
+    if _results is None:
+        _results = get_result_cache()
+    if _reputation is None:
+        _reputation = get_reputation()
+    _gmail()
+
+def warm_up() -> Future:
+    """Load the model and build a service in the background; retried if it failed."""
+    global _warm
+    with _warm_lock:
+        if _warm is None or (_warm.done() and _warm.exception() is not None):
+            _warm = _pool.submit(_init)
+        return _warm
+
+async def _offload(key: Optional[Hashable], fn: Callable[..., Any], *args) -> Any:
+    """Run fn(*args) on the pool once warm; callers with the same key share one run."""
+    await asyncio.wrap_future(warm_up())
+    fut = _inflight.get(key) if key is not None else None
+    if fut is not None:
+        metrics.inc("spam_mcp_coalesced_total")
+    else:
+        fut = asyncio.get_running_loop().run_in_executor(_pool, _timed, fn, *args)
+        if key is not None:
+            _inflight[key] = fut
+            fut.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: one caller giving up must not cancel the others
+    return await asyncio.shield(fut)
+
+def _timed(fn: Callable[..., Any], *args) -> Any:
+    with metrics.timer("spam_mcp_tool_seconds", tool=fn.__name__.strip("_")):
+        return fn(*args)
 
-def _lazy_init():
-    global _gmail, _model
-    if _gmail is None:
-        _gmail = get_service()
-    if _model is None:
-        _model = load_or_init()
+def _gauges() -> Dict[str, float]:
+    g: Dict[str, float] = {"spam_mcp_metadata_cache_size": len(_meta_cache)}
+    if _results is not None:
+        c = _results.stats()
+        g["spam_result_cache_hits"] = c["hits"] + c["disk_hits"]
+        g["spam_result_cache_misses"] = c["misses"]
+    if _reputation is not None:
+        g["spam_reputation_bypassed"] = _reputation.stats()["bypassed"]
+    return g
+
+metrics.register_collector(_gauges)
+
+# Message metadata shared by every tool, so listing and then classifying the
+# same messages costs one Gmail fetch per message, not one per tool call.
+_meta_cache = TTLCache(maxsize=4096, ttl=300)
+
+def _gmail_get_metadata_many(ids: List[str]) -> List[Dict[str, Any]]:
+    """Rows for `ids` in order, from the cache or one batched fetch. Unknown ids are dropped."""
+    rows = _meta_cache.get_many(ids)
+    missing = [mid for mid in ids if mid not in rows]
+    if missing:
+        for mid, msg in get_metadata_batch(_gmail(), missing, ["From","Subject"]).items():
+            rows[mid] = message_summary(msg)
+            _meta_cache.put(mid, rows[mid])
+    return [rows[mid] for mid in ids if mid in rows]
 
 def _gmail_list_unread(limit: int = 10) -> List[Dict[str, Any]]:
-    svc = _gmail
-    resp = svc.users().messages().list(userId="me", q="is:unread in:inbox", maxResults=int(limit)).execute()
-    rows: List[Dict[str, Any]] = []
-    for m in resp.get("messages", []):
-        msg = svc.users().messages().get(
-            userId="me", id=m["id"],
-            format="metadata", metadataHeaders=["From","Subject"]
-        ).execute()
-        headers = msg.get("payload", {}).get("headers", [])
-        def _get(hs, name):
-            for h in hs:
-                if h.get("name","").lower() == name.lower():
-                    return h.get("value","")
-            return ""
-        rows.append({
-            "id": msg["id"],
-            "threadId": msg.get("threadId"),
-            "from": _get(headers, "From"),
-            "subject": _get(headers, "Subject"),
-            "snippet": msg.get("snippet",""),
-        })
-    return rows
+    svc = _gmail()
+    resp = execute(svc, svc.users().messages().list(userId="me", q="is:unread in:inbox", maxResults=int(limit)),
+                   "messages.list")
+    return _gmail_get_metadata_many([m["id"] for m in resp.get("messages", [])])
+
+def _gmail_get_metadata(message_id: str) -> Dict[str, Any]:
+    rows = _gmail_get_metadata_many([message_id])
+    if not rows:
+        raise LookupError(f"message {message_id} not found")
+    return rows[0]
+
+def _classify_many(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # known senders are decided by reputation; the rest get one model call + one
+    # heuristics pass for whatever content isn't cached yet
+    t0 = time.perf_counter()
+    results = classify_batch(_live.current, messages, _results, _reputation, _cascade)
+    _live.shadow_score(messages, results, time.perf_counter() - t0)
+    return [{"score": r["score"], "reasons": r["reasons"]} for r in results]
 
 def _classify_one(message: Dict[str, Any]) -> Dict[str, Any]:
-    subj = (message.get("subject") or "").strip()
-    text = f"{subj}\n{message.get('snippet','')}"
-    ms = float(predict(_model, [text])[0])     # model score (0..1)
-    heur, reasons_list = _heuristics(subj, message.get("snippet",""), message.get("from",""))
-    score = combine_scores(heur, ms)
-    reasons = explain(reasons_list, ms)
-    return {"score": score, "reasons": reasons}
+    return _classify_many([message])[0]
 
-@mcp.tool()
-def list_unread_emails(limit: int = 10) -> str:
-    """
-    List unread INBOX emails (id | from | subject).
-    Args:
-        limit: max number of messages to list (default 10)
-    """
-    _lazy_init()
+def _list_unread_text(limit: int) -> str:
     rows = _gmail_list_unread(limit)
     if not rows:
         return "(no unread)"
     return "\n".join(f"{r['id']} | {r['from']} | {r['subject']}" for r in rows)
 
-@mcp.tool()
-def classify_message(message_id: str) -> str:
-    """
-    Classify a single Gmail message by id.
-    Returns score/reasons + basic headers.
-    """
-    _lazy_init()
-    msg = _gmail.users().messages().get(
-        userId="me", id=message_id,
-        format="metadata", metadataHeaders=["From","Subject"]
-    ).execute()
-    headers = msg.get("payload", {}).get("headers", [])
-    def _get(hs, name):
-        for h in hs:
-            if h.get("name","").lower() == name.lower():
-                return h.get("value","")
-        return ""
-    m = {
-        "id": message_id,
-        "from": _get(headers, "From"),
-        "subject": _get(headers, "Subject"),
-        "snippet": msg.get("snippet",""),
-    }
+def _classify_message_text(message_id: str) -> str:
+    m = _gmail_get_metadata(message_id)
     res = _classify_one(m)
     return (
         f"score={res['score']:.2f}\n"
@@ -99,30 +152,86 @@ def classify_message(message_id: str) -> str:
         f"subject={m['subject']}"
     )
 
+def _classify_unread_text(limit: int) -> str:
+    rows = _gmail_list_unread(limit)
+    if not rows:
+        return "(no unread)"
+    scored = sorted(zip(rows, _classify_many(rows)), key=lambda p: -p[1]["score"])
+    return "\n".join(
+        f"{r['id']} | {res['score']:.2f} | {r['from']} | {r['subject']} | {res['reasons']}"
+        for r, res in scored
+    )
+
+def _mark_as_spam(message_id: str) -> str:
+    model = _live.current
+    m = _gmail_get_metadata(message_id) if is_online(model) else None
+    gmail_mark_as_spam(_gmail(), message_id)
+    _meta_cache.invalidate(message_id)
+    if m is not None:
+        learn(model, [f"{(m['subject'] or '').strip()}\n{m['snippet']}"], [1])
+    return f"ok: moved {message_id} to Spam"
+
+def _explain_text(message_id: str) -> str:
+    r = get_decision(message_id)
+    if r is None:
+        return "(no prior decision logged)"
+    return (
+        f"label={r['label']} predicted={r['predicted']:.2f}\n"
+        f"reasons={r['reasons']}\n"
+        f"created_at={r['created_at']}"
+    )
+
+@mcp.tool()
+async def list_unread_emails(limit: int = 10) -> str:
+    """
+    List unread INBOX emails (id | from | subject).
+    Args:
+        limit: max number of messages to list (default 10)
+    """
+    return await _offload(("list", int(limit)), _list_unread_text, int(limit))
+
+@mcp.tool()
+async def classify_message(message_id: str) -> str:
+    """
+    Classify a single Gmail message by id.
+    Returns score/reasons + basic headers.
+    """
+    return await _offload(("classify", message_id), _classify_message_text, message_id)
+
+@mcp.tool()
+async def classify_unread(limit: int = 20) -> str:
+    """
+    Classify up to `limit` unread INBOX emails in one go, highest score first.
+    One line per message: id | score | from | subject | reasons.
+    """
+    return await _offload(("classify_unread", int(limit)), _classify_unread_text, int(limit))
+
 @mcp.tool()
-def mark_as_spam(message_id: str) -> str:
+async def mark_as_spam(message_id: str) -> str:
     """Move a message to Spam."""
-    _lazy_init()
-    gmail_mark_as_spam(_gmail, message_id)
-    return f"ok: moved {message_id} to Spam"
+    return await _offload(("spam", message_id), _mark_as_spam, message_id)
 
 @mcp.tool()
-def explain_decision(message_id: str) -> str:
+async def explain_decision(message_id: str) -> str:
     """
     Return the last stored decision (if any) for this message_id
     from the local SQLite log.
     """
-    _lazy_init()
-    rows = fetch_labeled_data(limit=200)
-    for r in rows:
-        if r["message_id"] == message_id:
-            return (
-                f"label={r['label']} predicted={r['predicted']:.2f}\n"
-                f"reasons={r['reasons']}\n"
-                f"created_at={r['created_at']}"
-            )
-    return "(no prior decision logged)"
+    return await _offload(("explain", message_id), _explain_text, message_id)
+
+@mcp.tool()
+async def get_metrics() -> str:
+    """
+    Counters and latency histograms for Gmail calls, classification and the
+    tools themselves, in Prometheus text format.
+    """
+    if not metrics.enabled():
+        return "(metrics disabled; unset SPAM_METRICS=0 to enable)"
+    return metrics.render()
 
 if __name__ == "__main__":
     # IMPORTANT: do not print to stdout here; FastMCP handles stdio transport
+    if os.environ.get("SPAM_METRICS") != "0":
+        metrics.enable()
+    warm_up()
     mcp.run(transport="stdio")
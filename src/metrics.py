@@ -0,0 +1,241 @@
+"""
+Lightweight in-process metrics: counters, latency histograms and gauges.
+
+    with metrics.timer("spam_predict_seconds"):
+        ...
+    metrics.inc("spam_gmail_requests_total", method="messages.get")
+
+Everything is off until `enable()` is called (or SPAM_METRICS=1 is set), and
+while off `timer()` returns a shared no-op context manager and `inc()` /
+`observe()` return immediately. `render()` produces the Prometheus text
+format, which the daemon can write to a file (node_exporter textfile
+collector) or serve on a local port; the MCP server returns it from the
+`get_metrics` tool. An optional sampling profiler records which functions
+the process threads are in.
+"""
+from __future__ import annotations
+import contextlib, functools, os, sys, threading, time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_enabled = os.environ.get("SPAM_METRICS", "") not in ("", "0")
+_lock = threading.Lock()
+_counters: Dict[Key, float] = {}
+_histograms: Dict[Key, List[float]] = {}     # bucket counts..., sum, count
+_collectors: List[Callable[[], Dict[str, float]]] = []
+_NULL = contextlib.nullcontext()
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+def enabled() -> bool:
+    return _enabled
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+def observe(name: str, seconds: float, **labels) -> None:
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = [0.0] * (len(BUCKETS) + 2)
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                h[i] += 1
+                break
+        h[-2] += seconds
+        h[-1] += 1
+
+class _Timer:
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name: str, labels: Dict[str, Any]):
+        self.name, self.labels = name, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.t0, **self.labels)
+        if exc_type is not None:
+            inc("spam_errors_total", where=self.name)
+        return False
+
+def timer(name: str, **labels):
+    """Time a block into histogram `name`; an exception also counts in spam_errors_total."""
+    return _Timer(name, labels) if _enabled else _NULL
+
+def timed(name: str, **labels):
+    """Decorator form of timer()."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def register_collector(fn: Callable[[], Dict[str, float]]) -> None:
+    """fn() -> {metric_name: value}, read as gauges each time metrics are rendered."""
+    _collectors.append(fn)
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+# --- export ---
+
+def _labels(pairs, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in pairs]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+    lines: List[str] = []
+    seen = set()
+    for (name, pairs), v in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels(pairs)} {_fmt(v)}")
+    for (name, pairs), h in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cum = 0.0
+        for le, n in zip(BUCKETS, h):
+            cum += n
+            bucket = 'le="' + _fmt(le) + '"'
+            lines.append(f"{name}_bucket{_labels(pairs, bucket)} {_fmt(cum)}")
+        lines.append(f"{name}_sum{_labels(pairs)} {_fmt(h[-2])}")
+        lines.append(f"{name}_count{_labels(pairs)} {_fmt(h[-1])}")
+    for fn in list(_collectors):
+        try:
+            gauges = fn()
+        except Exception:
+            continue
+        for name, v in sorted(gauges.items()):
+            if v is None:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_fmt(v)}")
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+class TextfileExporter:
+    """Rewrites `path` every `interval` seconds and once more on close()."""
+
+    def __init__(self, path, interval: float = 15.0):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-file", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def _write(self) -> None:
+        try:
+            write_textfile(self.path)
+        except OSError as e:
+            print(f"[error] metrics file: {e!r}")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(2.0)
+        self._write()
+
+def serve(port: int, host: str = "127.0.0.1"):
+    """Serve GET /metrics on a daemon thread; returns the server (call .shutdown() to stop)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+# --- sampling profiler ---
+
+class SamplingProfiler:
+    """
+    Every `interval` seconds, records the innermost frame of each other
+    thread as "file:function:line". Threads parked in threading.py (idle
+    queue/event waits) are skipped so the report shows where work happens.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                code = frame.f_code
+                if code.co_filename == threading.__file__:
+                    continue
+                self.samples[f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"] += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(2.0)
+
+    def report(self, top: int = 15) -> str:
+        total = sum(self.samples.values()) or 1
+        return "\n".join(f"{n / total:6.1%}  {where}" for where, n in self.samples.most_common(top))
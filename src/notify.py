@@ -1,40 +1,228 @@
 from __future__ import annotations
+import atexit
+import os
+import pathlib
+import queue
 import shutil
 import subprocess
+import sys
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+import metrics
+
+COALESCE_SECONDS = 2.0   # burst window merged into one digest
+QUEUE_SIZE = 256
+
+class Notification(NamedTuple):
+    title: str
+    subtitle: str = ""
+    message: str = ""
+    url: Optional[str] = None
+    spam: bool = False
 
 def _escape(s: str) -> str:
     return s.replace('"', '\\"')
 
-def notify(title: str, subtitle: str = "", message: str = "", url: str | None = None) -> None:
-    """
-    macOS notifications. Prefer terminal-notifier if available (best reliability),
-    else fall back to AppleScript. No-ops on failure.
-    """
-    try:
-        if shutil.which("terminal-notifier"):
-            cmd = ["terminal-notifier", "-title", title[:80]]
-            if subtitle:
-                cmd += ["-subtitle", subtitle[:120]]
-            if message:
-                cmd += ["-message", message[:200]]
-            if url:
-                cmd += ["-open", url]
-            # Choose a default sound to make it noticeable
-            cmd += ["-sound", "default"]
+# --- Backends: each exposes send(Notification) and must not raise ---
+
+class TerminalNotifierBackend:
+    """macOS via terminal-notifier (best reliability, supports click-to-open)."""
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which("terminal-notifier") is not None
+
+    def send(self, n: Notification) -> bool:
+        cmd = ["terminal-notifier", "-title", n.title[:80]]
+        if n.subtitle:
+            cmd += ["-subtitle", n.subtitle[:120]]
+        if n.message:
+            cmd += ["-message", n.message[:200]]
+        if n.url:
+            cmd += ["-open", n.url]
+        # Choose a default sound to make it noticeable
+        cmd += ["-sound", "default"]
+        try:
             subprocess.run(cmd, check=False, capture_output=True, text=True)
-            return
-    except Exception:
-        pass
-
-    # Fallback: AppleScript (works on many systems but can be blocked by OS settings)
-    try:
-        title_s = _escape(title[:80])
-        subtitle_s = _escape(subtitle[:120])
-        message_s = _escape(message[:200])
+            return True
+        except Exception:
+            return False
+
+class OsascriptBackend:
+    """AppleScript (works on many systems but can be blocked by OS settings)."""
+
+    def send(self, n: Notification) -> bool:
+        title_s = _escape(n.title[:80])
+        subtitle_s = _escape(n.subtitle[:120])
+        message_s = _escape(n.message[:200])
         script = f'display notification "{message_s}" with title "{title_s}"'
         if subtitle_s:
             script += f' subtitle "{subtitle_s}"'
-        subprocess.run(["osascript", "-e", script], check=False, capture_output=True, text=True)
-    except Exception:
-        # Give up silently
-        pass
+        try:
+            subprocess.run(["osascript", "-e", script], check=False, capture_output=True, text=True)
+            return True
+        except Exception:
+            return False
+
+class MacBackend:
+    """Prefer terminal-notifier if available, else fall back to AppleScript."""
+
+    def __init__(self):
+        self._tn = TerminalNotifierBackend() if TerminalNotifierBackend.available() else None
+        self._osa = OsascriptBackend()
+
+    def send(self, n: Notification) -> bool:
+        if self._tn and self._tn.send(n):
+            return True
+        return self._osa.send(n)
+
+class NotifySendBackend:
+    """Linux desktops via libnotify's notify-send."""
+
+    def send(self, n: Notification) -> bool:
+        body = "\n".join(p for p in (n.subtitle[:120], n.message[:200], n.url or "") if p)
+        try:
+            subprocess.run(["notify-send", "--app-name=spam-notifier", n.title[:80], body],
+                           check=False, capture_output=True, text=True)
+            return True
+        except Exception:
+            return False
+
+class FileBackend:
+    """Append one line per notification; for headless servers and tests."""
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = pathlib.Path(path)
+
+    def send(self, n: Notification) -> bool:
+        line = " | ".join(p for p in (n.title, n.subtitle, n.message, n.url or "") if p)
+        try:
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {line}\n")
+            return True
+        except Exception:
+            return False
+
+class NullBackend:
+    def send(self, n: Notification) -> bool:
+        return True
+
+def default_backend():
+    """
+    Pick a backend from SPAM_NOTIFIER_BACKEND ("mac", "notify-send",
+    "file:<path>", "null"), or from the platform when unset.
+    """
+    choice = os.environ.get("SPAM_NOTIFIER_BACKEND", "").strip()
+    if choice == "mac":
+        return MacBackend()
+    if choice == "notify-send":
+        return NotifySendBackend()
+    if choice.startswith("file:"):
+        return FileBackend(choice[len("file:"):])
+    if choice == "null":
+        return NullBackend()
+    if sys.platform == "darwin":
+        return MacBackend()
+    if shutil.which("notify-send"):
+        return NotifySendBackend()
+    return NullBackend()
+
+# --- Dispatcher ---
+
+class Dispatcher:
+    """
+    Background thread that delivers notifications without blocking the caller.
+    Everything arriving within `window` seconds of the first notification of a
+    burst is merged into a single digest; the window is fixed, not extended by
+    later arrivals. When the queue is full new notifications are dropped and
+    counted, and the next digest says how many ("+N more").
+    """
+
+    def __init__(self, backend=None, window: float = COALESCE_SECONDS, maxsize: int = QUEUE_SIZE):
+        self.backend = backend or default_backend()
+        self.window = window
+        self.dropped = 0
+        self._unreported = 0      # dropped since the last digest
+        self._drop_lock = threading.Lock()
+        self._q: "queue.Queue[Optional[Notification]]" = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="notify-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, n: Notification) -> None:
+        try:
+            self._q.put_nowait(n)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+                self._unreported += 1
+            metrics.inc("spam_notifications_dropped_total")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Deliver whatever is queued, then stop the thread."""
+        try:
+            self._q.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _collect(self, first: Notification) -> tuple[List[Notification], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return batch, False
+            try:
+                item = self._q.get(timeout=remaining)
+            except queue.Empty:
+                return batch, False
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+    def _run(self) -> None:
+        while True:
+            first = self._q.get()
+            if first is None:
+                return
+            batch, stop = self._collect(first)
+            with self._drop_lock:
+                dropped, self._unreported = self._unreported, 0
+            with metrics.timer("spam_notify_seconds", backend=type(self.backend).__name__):
+                self.backend.send(batch[0] if len(batch) == 1 and not dropped
+                                  else digest(batch, dropped))
+            metrics.inc("spam_notifications_total", len(batch))
+            if stop:
+                return
+
+def digest(batch: List[Notification], dropped: int = 0) -> Notification:
+    """One notification for `batch`; `dropped` were lost to a full queue."""
+    n_spam = sum(1 for n in batch if n.spam)
+    return Notification(
+        title=batch[0].title,
+        subtitle=f"{len(batch)} new emails, {n_spam} likely spam" + (f" (+{dropped} more)" if dropped else ""),
+        message="; ".join(n.subtitle for n in batch[:3] if n.subtitle)[:200],
+        url="https://mail.google.com/mail/u/0/#inbox",
+        spam=n_spam > 0,
+    )
+
+_dispatcher: Optional[Dispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher() -> Dispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher()
+            atexit.register(_dispatcher.close)
+        return _dispatcher
+
+def notify(title: str, subtitle: str = "", message: str = "", url: str | None = None,
+           spam: bool = False) -> None:
+    """
+    Queue a desktop notification and return immediately. Bursts are coalesced
+    into one digest by the background dispatcher. No-ops on failure.
+    """
+    get_dispatcher().submit(Notification(title, subtitle, message, url, spam))
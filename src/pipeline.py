@@ -0,0 +1,286 @@
+"""
+Staged poll -> classify -> act pipeline.
+
+    poller ──► classify_q ──► classifier ──► review_q ──► operator (main thread)
+                                   │                          │
+                                   └── (auto mode) ──► action_q ◄──┘
+                                                          │
+                                                       executor ──► Gmail + storage
+
+Each stage runs in its own thread, so polling and scoring keep going while
+the operator sits at the prompt. The poller and executor each build their own
+Gmail service because the httplib2 transport is not thread-safe.
+"""
+from __future__ import annotations
+import queue, threading, time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from gmail_client import BulkActions, mark_as_spam, unmark_spam_to_inbox, add_label
+from scheduler import PollScheduler
+from accounts import Account, MultiAccountPoller, MAX_WORKERS
+from classify.baseline import learn, is_online, SPAM_THRESHOLD, SUSPICIOUS_THRESHOLD
+from classify.parallel import score_many
+from classify.registry import LiveModel
+from cache import ResultCache
+from reputation import Reputation
+from storage import log_decision, get_storage, message_rows
+from notify import notify
+import metrics
+
+# action key -> label stored in the decisions log
+CHOSEN = {"s": "spam", "k": "ham", "l": "suspicious", "n": "none"}
+# In auto mode nobody confirmed the label, so it is logged under a distinct name
+# to keep the model's own guesses out of the training data.
+AUTO_CHOSEN = {"s": "auto-spam", "l": "auto-suspicious", "n": "none"}
+
+class Scored(NamedTuple):
+    message: Dict[str, Any]
+    score: float
+    reasons: str
+    suggested: str
+
+class Action(NamedTuple):
+    item: Scored
+    key: str        # s/k/l/n
+    chosen: str     # label written to the decisions log
+
+def suggest(score: float) -> str:
+    return "spam" if score >= SPAM_THRESHOLD else ("suspicious" if score >= SUSPICIOUS_THRESHOLD else "keep")
+
+def auto_action(suggested: str) -> str:
+    """Headless policy: spam -> Spam folder, suspicious -> label, keep -> leave alone."""
+    return {"spam": "s", "suspicious": "l"}.get(suggested, "n")
+
+class MailPipeline:
+    def __init__(self, service_factory: Callable[[], Any], model, auto: bool = False,
+                 scheduler: Optional[PollScheduler] = None,
+                 accounts: Optional[List[Account]] = None, max_workers: int = MAX_WORKERS,
+                 result_cache: Optional[ResultCache] = None,
+                 reputation: Optional[Reputation] = None):
+        self.service_factory = service_factory
+        # a LiveModel is hot-swapped by its watcher; a plain model is wrapped
+        self.live = model if isinstance(model, LiveModel) else LiveModel(model)
+        self.result_cache = result_cache
+        self.reputation = reputation
+        self.auto = auto
+        self.scheduler = scheduler or PollScheduler()
+        # multi-account mode: messages carry an "account" key and actions are
+        # applied with that account's own service and label cache
+        self.accounts = {a.name: a for a in accounts} if accounts else None
+        self.multi_poller = MultiAccountPoller(accounts, max_workers) if accounts else None
+        self.classify_q: "queue.Queue[List[Dict[str, Any]]]" = queue.Queue(maxsize=64)
+        self.review_q: "queue.Queue[Scored]" = queue.Queue()
+        self.action_q: "queue.Queue[Action]" = queue.Queue()
+        self.stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # --- lifecycle ---
+
+    def start(self) -> None:
+        metrics.register_collector(self.gauges)
+        for name, target in (("poller", self._poller), ("classifier", self._classifier),
+                             ("executor", self._executor)):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        self.stop_event.set()
+        for t in self._threads:
+            t.join(timeout)
+        self.live.close()
+        if is_online(self.model):
+            self.model.close()
+
+    @property
+    def model(self):
+        return self.live.current
+
+    def submit_action(self, item: Scored, key: str) -> None:
+        chosen = (AUTO_CHOSEN if self.auto else CHOSEN)[key]
+        self.action_q.put(Action(item, key, chosen))
+
+    def next_for_review(self, timeout: float = 1.0) -> Optional[Scored]:
+        try:
+            return self.review_q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # --- stages ---
+
+    def poll_stats(self) -> Dict[str, Any]:
+        return self.multi_poller.stats() if self.multi_poller else self.scheduler.stats()
+
+    def gauges(self) -> Dict[str, float]:
+        g = {"spam_classify_queue_depth": self.classify_q.qsize(),
+             "spam_review_queue_depth": self.review_q.qsize(),
+             "spam_action_queue_depth": self.action_q.qsize()}
+        if not self.multi_poller:
+            g["spam_poll_interval_seconds"] = self.scheduler.stats()["interval_s"]
+        if self.result_cache is not None:
+            c = self.result_cache.stats()
+            g["spam_result_cache_hits"] = c["hits"] + c["disk_hits"]
+            g["spam_result_cache_misses"] = c["misses"]
+        if self.live.shadow is not None:
+            s = self.live.stats()
+            g["spam_shadow_mean_abs_delta"] = s["mean_abs_delta"]
+        if self.reputation is not None:
+            r = self.reputation.stats()
+            g["spam_reputation_senders"] = r["senders"]
+            g["spam_reputation_bypassed"] = r["bypassed"]
+        return g
+
+    def _poller(self) -> None:
+        if self.multi_poller:
+            self.multi_poller.run(self.classify_q.put, self.stop_event)
+            return
+        svc = None
+        while not self.stop_event.is_set():
+            try:
+                if svc is None:
+                    svc = self.service_factory()
+                new_msgs = self.scheduler.poll(svc)
+                if new_msgs:
+                    print(f"📥 New messages: {len(new_msgs)}")
+                    self.classify_q.put(new_msgs)
+            except Exception as e:
+                print(f"[error] poll: {e!r}")
+                self.scheduler.record_failure()     # counts it and backs off
+                svc = None                          # rebuild the connection on the next tick
+            self.stop_event.wait(self.scheduler.next_delay())
+
+    def _classifier(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                batch = self.classify_q.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            model = self.live.current     # one model per batch, even across a swap
+            try:
+                t0 = time.perf_counter()
+                with metrics.timer("spam_classify_batch_seconds"):
+                    results = score_many(model, batch, self.result_cache, self.reputation)
+            except Exception as e:
+                print(f"[error] classify: {e!r}")
+                continue
+            self.live.shadow_score(batch, results, time.perf_counter() - t0)
+            try:
+                # keep subject/snippet/sender so decisions can be trained on later
+                get_storage().upsert_messages(message_rows(batch, results))
+            except Exception as e:
+                print(f"[error] store messages: {e!r}")
+                metrics.inc("spam_errors_total", where="store_messages")
+            for m, res in zip(batch, results):
+                item = Scored(m, res["score"], res["reasons"], suggest(res["score"]))
+                self._notify(item)
+                if self.auto:
+                    self.submit_action(item, auto_action(item.suggested))
+                else:
+                    self.review_q.put(item)
+
+    def _notify(self, item: Scored) -> None:
+        m = item.message
+        subject = (m["subject"] or "").strip()
+        # clickable URL to open the thread in Gmail (works for primary account index 0)
+        url = None
+        if m.get("threadId"):
+            url = f"https://mail.google.com/mail/u/0/#inbox/{m['threadId']}"
+        notif_msg = f"Spam Possibility: {item.score * 100:.0f}% · {subject[:90]}"
+        notify(title="New Email", subtitle=f"{m['from']}", message=notif_msg, url=url,
+               spam=(item.suggested == "spam"))
+
+    def _drain_actions(self) -> List[Action]:
+        try:
+            actions = [self.action_q.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                actions.append(self.action_q.get_nowait())
+            except queue.Empty:
+                return actions
+
+    def _executor(self) -> None:
+        services: Dict[Optional[str], Any] = {}
+        while not (self.stop_event.is_set() and self.action_q.empty()):
+            actions = self._drain_actions()
+            if not actions:
+                continue
+            by_account: Dict[Optional[str], List[Action]] = {}
+            for a in actions:
+                by_account.setdefault(a.item.message.get("account"), []).append(a)
+            done: List[Action] = []
+            for name, group in by_account.items():
+                acct = self.accounts[name] if self.accounts else None
+                try:
+                    if name not in services:
+                        services[name] = acct.new_service() if acct else self.service_factory()
+                    # our own writes move historyId; don't let them wake the poller
+                    with (acct.scheduler if acct else self.scheduler).own_writes(services[name]):
+                        done.extend(self._apply(services[name], group, acct.labels if acct else None))
+                except Exception as e:
+                    # e.g. auth or network while building the service; rebuilt next time
+                    print(f"[error] actions{f' ({name})' if name else ''}: {e!r}")
+                    metrics.inc("spam_errors_total", where="action")
+                    services.pop(name, None)
+            if len(done) < len(actions):
+                metrics.inc("spam_actions_failed_total", len(actions) - len(done))
+            # only what Gmail actually applied is logged and learned from
+            for a in done:
+                metrics.inc("spam_actions_total", chosen=a.chosen)
+                try:
+                    log_decision(a.item.message["id"], a.item.score, a.chosen, a.item.reasons,
+                                 a.item.message.get("from"))
+                except Exception as e:
+                    print(f"[error] log_decision: {e!r}")
+                    metrics.inc("spam_errors_total", where="log_decision")
+            self._learn(done)
+
+    def _apply(self, svc, actions: List[Action], labels=None) -> List[Action]:
+        """Apply `actions` on Gmail; returns the ones that took effect."""
+        bulk = BulkActions(labels)
+        for a in actions:
+            mid = a.item.message["id"]
+            if a.key == "s":
+                bulk.spam(mid)
+            elif a.key == "k":
+                bulk.keep(mid)
+            elif a.key == "l":
+                bulk.label(mid, "Suspicious")
+        try:
+            bulk.flush(svc)
+            return actions
+        except Exception as e:
+            print(f"[error] batchModify: {e!r}; retrying one by one")
+            metrics.inc("spam_errors_total", where="batchModify")
+            return self._apply_individually(svc, actions, labels)
+
+    def _learn(self, actions: List[Action]) -> None:
+        # only human-confirmed spam/ham labels update the online model
+        labeled = [a for a in actions if a.chosen in ("spam", "ham")]
+        if not labeled:
+            return
+        texts = [f"{(a.item.message['subject'] or '').strip()}\n{a.item.message['snippet']}" for a in labeled]
+        try:
+            learn(self.model, texts, [1 if a.chosen == "spam" else 0 for a in labeled])
+        except Exception as e:
+            print(f"[error] online update: {e!r}")
+            metrics.inc("spam_errors_total", where="online_update")
+
+    def _apply_individually(self, svc, actions: List[Action], labels=None) -> List[Action]:
+        done = []
+        for a in actions:
+            mid = a.item.message["id"]
+            try:
+                if a.key == "s":
+                    mark_as_spam(svc, mid)
+                elif a.key == "k":
+                    unmark_spam_to_inbox(svc, mid)
+                elif a.key == "l":
+                    add_label(svc, mid, "Suspicious", labels)
+            except Exception as e:
+                print(f"[error] action {a.key} on {mid}: {e!r}")
+                metrics.inc("spam_errors_total", where="action")
+                continue
+            done.append(a)
+        return done
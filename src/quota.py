@@ -0,0 +1,123 @@
+"""
+Gmail per-user rate limiting and retries.
+
+Gmail allows each mailbox about 250 quota units per second, where every
+method has its own cost (gmail_client.QUOTA_UNITS). Each mailbox gets one
+TokenBucket shared by all of its services and threads. Callers take the
+call's units before sending it, so bursts like a backlog fetch or several
+accounts at once are paced instead of being rejected. A call larger than
+the bucket (a 100-message batch costs 500 units) may drive it negative and
+later callers wait until it is paid back.
+
+Calls that still fail with 429, 5xx or a rate-limit 403 are retried with
+full-jitter exponential backoff. A Retry-After header is honored and also
+pauses every other caller of the same mailbox.
+"""
+from __future__ import annotations
+import json, random, threading, time
+from typing import Dict, Optional
+
+import metrics
+
+UNITS_PER_SECOND = 250.0
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0        # seconds
+BACKOFF_CAP = 32.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RATE_LIMIT_REASONS = frozenset({"rateLimitExceeded", "userRateLimitExceeded"})
+
+class TokenBucket:
+    def __init__(self, rate: float = UNITS_PER_SECOND, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self._paused_until = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, units: float) -> float:
+        """Block until `units` may be spent; returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self.tokens >= min(units, self.capacity):
+                    self.tokens -= units
+                    return waited
+                wait = max(self._paused_until - now, (min(units, self.capacity) - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller for `seconds` (server asked us to back off)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+def bucket_for(user: str) -> TokenBucket:
+    """The shared bucket for one mailbox (keyed by e.g. its token path)."""
+    with _buckets_lock:
+        b = _buckets.get(user)
+        if b is None:
+            b = _buckets[user] = TokenBucket()
+        return b
+
+def _status(exc: Exception) -> Optional[int]:
+    resp = getattr(exc, "resp", None)
+    return getattr(resp, "status", None)
+
+def _reason(exc: Exception) -> str:
+    try:
+        err = json.loads(exc.content.decode("utf-8"))["error"]
+        return err["errors"][0].get("reason", "")
+    except Exception:
+        return ""
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    status = _status(exc)
+    if status in RETRY_STATUSES:
+        return True
+    return status == 403 and _reason(exc) in RATE_LIMIT_REASONS
+
+def retry_after(exc: Exception) -> Optional[float]:
+    resp = getattr(exc, "resp", None)
+    value = resp.get("retry-after") if hasattr(resp, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None    # HTTP-date form; fall back to backoff
+
+def backoff_delay(attempt: int, exc: Optional[Exception] = None) -> float:
+    """Full-jitter exponential delay for retry `attempt` (0-based), at least Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    hint = retry_after(exc) if exc is not None else None
+    return max(delay, hint) if hint is not None else delay
+
+def call(request, bucket: TokenBucket, units: float, method: str = ""):
+    """request.execute() under `bucket`, retrying transient failures."""
+    attempt = 0
+    while True:
+        waited = bucket.acquire(units)
+        if waited:
+            metrics.observe("spam_quota_wait_seconds", waited)
+        try:
+            return request.execute()
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            if retry_after(e) is not None or _status(e) in (429, 403):
+                bucket.pause(delay)
+            metrics.inc("spam_gmail_retries_total", method=method, status=_status(e) or type(e).__name__)
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,137 @@
+"""
+Sender / domain reputation built from the operator's own spam and ham calls.
+
+Every confirmed decision adds one vote for its sender address and for the
+sender's registered domain. Votes decay with a half-life, so a sender that
+changes behaviour is reassessed. The index is held in memory, updated by a
+storage listener on each log_decision, and snapshotted to reputation.json.
+It is rebuilt from the decisions table when no snapshot exists.
+
+classify_batch asks `verdict()` first. A sender with enough one-sided
+history (a colleague who is always kept, a domain that is always spam) is
+decided right there, and the heuristics and model are skipped.
+"""
+from __future__ import annotations
+import atexit, json, os, threading, time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import storage
+from classify.baseline import registered_domain, sender_address
+from gmail_client import ROOT
+
+SNAPSHOT_PATH = ROOT / "reputation.json"
+HALF_LIFE_DAYS = 90.0
+MIN_SENDER_VOTES = 5.0     # decayed votes before a sender can bypass the model
+MIN_DOMAIN_VOTES = 10.0
+BYPASS_RATIO = 0.95        # share of votes that must agree
+
+Entry = List[float]        # [spam votes, ham votes, updated_at (unix s)]
+
+class Reputation:
+    def __init__(self, path=SNAPSHOT_PATH, half_life_days: float = HALF_LIFE_DAYS,
+                 save_every: int = 50):
+        self.path = path
+        self.half_life = half_life_days * 86400
+        self.save_every = save_every
+        self.senders: Dict[str, Entry] = {}
+        self.domains: Dict[str, Entry] = {}
+        self.bypassed = 0
+        self._dirty = 0
+        self._lock = threading.Lock()
+
+    def _decayed(self, e: Entry, now: float) -> Tuple[float, float]:
+        f = 0.5 ** (max(0.0, now - e[2]) / self.half_life)
+        return e[0] * f, e[1] * f
+
+    def _vote(self, table: Dict[str, Entry], key: str, spam: bool, now: float) -> None:
+        e = table.get(key)
+        s, h = self._decayed(e, now) if e else (0.0, 0.0)
+        table[key] = [s + spam, h + (not spam), now]
+
+    def _add(self, sender: str, label: str, now: float) -> bool:
+        if label not in ("spam", "ham") or not sender:
+            return False
+        addr, dom = sender_address(sender), registered_domain(sender)
+        with self._lock:
+            self._vote(self.senders, addr, label == "spam", now)
+            self._vote(self.domains, dom, label == "spam", now)
+            self._dirty += 1
+        return True
+
+    def record(self, sender: str, label: str, now: Optional[float] = None) -> None:
+        """Count a "spam" or "ham" decision; other labels are not evidence and are ignored."""
+        if self._add(sender, label, time.time() if now is None else now) and self._dirty >= self.save_every:
+            self.save()
+
+    def on_decision(self, message_id: str, label: str, sender: Optional[str], created_at: int) -> None:
+        self.record(sender or "", label, created_at)
+
+    def verdict(self, sender: str, now: Optional[float] = None) -> Optional[Tuple[float, str]]:
+        """
+        (score, reason) when history alone decides, else None. Senders bypass
+        either way; domains only towards spam, since one good colleague at a
+        freemail domain says nothing about its other users.
+        """
+        if not sender:
+            return None
+        now = time.time() if now is None else now
+        with self._lock:
+            e = self.senders.get(sender_address(sender))
+            if e is not None:
+                s, h = self._decayed(e, now)
+                if s + h >= MIN_SENDER_VOTES and max(s, h) >= BYPASS_RATIO * (s + h):
+                    self.bypassed += 1
+                    return (s + 1) / (s + h + 2), f"sender reputation: {s:.0f} spam / {h:.0f} ham"
+            e = self.domains.get(registered_domain(sender))
+            if e is not None:
+                s, h = self._decayed(e, now)
+                if s + h >= MIN_DOMAIN_VOTES and s >= BYPASS_RATIO * (s + h):
+                    self.bypassed += 1
+                    return (s + 1) / (s + h + 2), f"domain reputation: {s:.0f} spam / {h:.0f} ham"
+        return None
+
+    def save(self) -> None:
+        with self._lock:
+            data = {"half_life_days": self.half_life / 86400,
+                    "senders": self.senders, "domains": self.domains}
+            self._dirty = 0
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.path)
+
+    def load(self) -> bool:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            self.senders, self.domains = data["senders"], data["domains"]
+        return True
+
+    def rebuild(self, rows: Iterable[Tuple[str, str, int]]) -> None:
+        """Replay (sender, label, created_at) rows, oldest first."""
+        with self._lock:
+            self.senders, self.domains = {}, {}
+        for sender, label, created_at in rows:
+            self._add(sender, label, created_at)
+        self.save()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"senders": len(self.senders), "domains": len(self.domains), "bypassed": self.bypassed}
+
+_reputation: Optional[Reputation] = None
+_init_lock = threading.Lock()
+
+def get_reputation() -> Reputation:
+    """The shared index, loaded (or rebuilt from state.db) and subscribed to new decisions."""
+    global _reputation
+    with _init_lock:
+        if _reputation is None:
+            rep = Reputation()
+            if not rep.load():
+                rep.rebuild(storage.get_storage().sender_labels())
+            storage.add_listener(rep.on_decision)
+            atexit.register(rep.save)
+            _reputation = rep
+        return _reputation
@@ -0,0 +1,126 @@
+"""
+Keep the decisions log bounded.
+
+    python src/retention.py [--days 365] [--dry-run]
+    python src/retention.py --report [--since 2024-01-01]
+
+Decisions older than --days (counted in whole UTC days) are folded into
+one compressed rollup per day in `decision_rollups`. Each rollup holds
+counts and a score histogram per label and sender domain. The raw rows are
+then deleted in the same transaction. The latest spam/ham decision for each
+message is kept whatever its age, since training and sender reputation
+read it; those rows grow with what you label, not with mail volume. Stored
+message features (the `messages` table the daemon and backfill fill) go
+once they were last classified before the cutoff, except for messages a
+remaining decision still refers to. Freed
+pages are returned to the filesystem with incremental VACUUM. The first run
+on an older database switches it over with one full VACUUM.
+
+The daemon runs the same job once a day (SPAM_RETENTION_DAYS, default 365;
+0 keeps everything).
+"""
+from __future__ import annotations
+import argparse, os, threading, time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import metrics
+from storage import Rollup, Storage, get_storage, merge_rollups
+
+RETAIN_DAYS = int(os.environ.get("SPAM_RETENTION_DAYS", "365"))
+HIST_BINS = 10            # score histogram: [0, 0.1), [0.1, 0.2), ... [0.9, 1.0]
+INTERVAL = 24 * 3600.0
+DAY = 86400
+
+def _day(ts: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+def rollup(rows: Iterable[Tuple[int, str, Optional[str], float, int]]) -> Dict[str, Rollup]:
+    """Per-day rollups of (id, label, sender, predicted, created_at) rows."""
+    from classify.baseline import registered_domain
+    out: Dict[str, Rollup] = {}
+    for _, label, sender, predicted, created_at in rows:
+        domain = registered_domain(sender) if sender else ""
+        per_domain = out.setdefault(_day(created_at), {}).setdefault(label, {})
+        counts = per_domain.get(domain)
+        if counts is None:
+            counts = per_domain[domain] = [0] * (1 + HIST_BINS)
+        counts[0] += 1
+        counts[1 + min(HIST_BINS - 1, max(0, int(predicted * HIST_BINS)))] += 1
+    return out
+
+def run(storage: Storage, days: int = RETAIN_DAYS, now: Optional[float] = None,
+        dry_run: bool = False, chunk_size: int = 5000) -> Dict[str, Any]:
+    """Archive decisions and expire message features older than `days`, then vacuum. Returns what was done."""
+    cutoff = (int(now if now is not None else time.time()) // DAY - days) * DAY
+    archived, touched = 0, set()
+    for rows in storage.expired_decisions(cutoff, chunk_size):
+        if not dry_run:
+            rolled = rollup(rows)
+            storage.archive_decisions(rolled, [r[0] for r in rows])
+            touched.update(rolled)
+        archived += len(rows)
+    expired = storage.expire_messages(cutoff, chunk_size, dry_run)
+    freed = storage.vacuum() if (archived or expired) and not dry_run else 0
+    metrics.inc("spam_decisions_archived_total", 0 if dry_run else archived)
+    metrics.inc("spam_messages_expired_total", 0 if dry_run else expired)
+    return {"before": _day(cutoff), "archived": archived, "days": len(touched),
+            "messages": expired, "freed_pages": freed}
+
+class RetentionJob:
+    """Runs run() on its own thread every `interval` seconds, starting `delay` seconds from now."""
+
+    def __init__(self, storage: Storage, days: int = RETAIN_DAYS, interval: float = INTERVAL,
+                 delay: float = 60.0):
+        self.storage = storage
+        self.days = days
+        self.interval = interval
+        self._stop = threading.Event()
+        self._delay = delay
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        wait = self._delay
+        while not self._stop.wait(wait):
+            wait = self.interval
+            try:
+                r = run(self.storage, self.days)
+                if r["archived"] or r["messages"]:
+                    print(f"🧹 Archived {r['archived']} decisions from before {r['before']} "
+                          f"into {r['days']} daily rollups, dropped {r['messages']} stored messages; "
+                          f"freed {r['freed_pages']} pages")
+            except Exception as e:
+                print(f"[error] retention: {e!r}")
+                metrics.inc("spam_errors_total", where="retention")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(2.0)
+
+def main():
+    ap = argparse.ArgumentParser(description="Roll up and delete old decisions, drop old stored messages, then vacuum state.db.")
+    ap.add_argument("--days", type=int, default=RETAIN_DAYS or 365, help="keep this many days of raw decisions")
+    ap.add_argument("--dry-run", action="store_true", help="only count what would be archived")
+    ap.add_argument("--report", action="store_true", help="print archived totals per label instead")
+    ap.add_argument("--since", default="", help="with --report: first day, YYYY-MM-DD")
+    args = ap.parse_args()
+
+    st = get_storage()
+    if args.report:
+        total: Rollup = {}
+        for _, r in st.rollups(args.since):
+            merge_rollups(total, r)
+        for label, domains in sorted(total.items()):
+            top = sorted(domains.items(), key=lambda kv: -kv[1][0])[:5]
+            print(f"{label:16s} {sum(c[0] for c in domains.values()):>9,d}  "
+                  + ", ".join(f"{d or '?'} {c[0]}" for d, c in top))
+        return
+    r = run(st, args.days, dry_run=args.dry_run)
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} {r['archived']} decisions from before {r['before']}"
+          + ("" if args.dry_run else f" into {r['days']} daily rollups")
+          + f" and {'drop' if args.dry_run else 'dropped'} {r['messages']} stored messages"
+          + ("" if args.dry_run else f"; freed {r['freed_pages']} pages"))
+
+if __name__ == "__main__":
+    main()
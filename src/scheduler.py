@@ -0,0 +1,132 @@
+"""
+Adaptive polling: replaces the fixed sleep between poll_once calls.
+
+Each tick first asks getProfile for the mailbox historyId (one cheap call)
+and runs the full history.list + metadata fetch only when it moved. The
+interval drops to `min_interval` as soon as mail arrives and backs off
+exponentially, with jitter, up to `max_interval` while the mailbox is idle.
+
+The daemon's own batchModify and label writes move the historyId too. The
+executor wraps them in own_writes(), which reads the historyId either side.
+If nothing else had happened before the write, one history.list over the
+write's range (2 units, against a full poll's metadata fetches) checks that
+no mail arrived meanwhile; only then does the next tick treat ids up to the
+later one as unchanged. Mail delivered during a write keeps them counted as
+changes, so it is found on the next tick.
+"""
+from __future__ import annotations
+import contextlib, pathlib, random, threading, time
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
+from gmail_client import current_history_id, last_seen_history_id, messages_added_since, poll_once
+
+MIN_POLL_SECONDS = 5.0
+MAX_POLL_SECONDS = 120.0
+
+class PollScheduler:
+    def __init__(self, min_interval: float = MIN_POLL_SECONDS, max_interval: float = MAX_POLL_SECONDS,
+                 backoff: float = 2.0, jitter: float = 0.2, seed: Optional[int] = None,
+                 state_path: Optional[pathlib.Path] = None):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("need 0 < min_interval <= max_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = min_interval
+        self.state_path = state_path    # history cursor file; None = gmail_client.STATE_PATH
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self.polls = 0            # ticks (each costs at least one getProfile)
+        self.full_polls = 0       # ticks that ran history.list
+        self.wasted_polls = 0     # ticks that found no new mail
+        self.messages = 0
+        self.errors = 0
+        self._latencies: List[float] = []   # seconds from internalDate to detection
+        self._own_hid = 0         # history up to here came from our own writes
+
+    def poll(self, service) -> List[Dict[str, Any]]:
+        """One tick: cheap historyId check, then a full poll only if it moved."""
+        hid = current_history_id(service)
+        seen = last_seen_history_id(self.state_path)
+        with self._lock:
+            own = self._own_hid
+        if seen is not None and hid <= max(seen, own):
+            msgs: List[Dict[str, Any]] = []
+            full = False
+        else:
+            msgs = poll_once(service, profile_history_id=hid, state_path=self.state_path)
+            full = True
+        self._record(msgs, full)
+        return msgs
+
+    @contextlib.contextmanager
+    def own_writes(self, service) -> Iterator[None]:
+        """Wrap the daemon's own label writes so the next tick doesn't poll for them."""
+        try:
+            before = current_history_id(service)
+        except Exception:
+            before = None         # untracked: the next tick just runs a full poll
+        yield
+        if before is None:
+            return
+        try:
+            after = current_history_id(service)
+            seen = last_seen_history_id(self.state_path) or 0
+            with self._lock:
+                ours = before <= max(seen, self._own_hid) < after
+            # history (seen, before] is already known; was anything delivered since?
+            if not ours or messages_added_since(service, before):
+                return
+        except Exception:
+            return
+        with self._lock:
+            self._own_hid = max(self._own_hid, after)
+
+    def _record(self, msgs: List[Dict[str, Any]], full: bool) -> None:
+        metrics.inc("spam_polls_total", full=str(full).lower())
+        metrics.inc("spam_messages_total", len(msgs))
+        now_ms = time.time() * 1000
+        with self._lock:
+            self.polls += 1
+            self.full_polls += int(full)
+            if msgs:
+                self.messages += len(msgs)
+                self.interval = self.min_interval
+                for m in msgs:
+                    if m.get("internalDate"):
+                        self._latencies.append(max(0.0, (now_ms - int(m["internalDate"])) / 1000))
+                del self._latencies[:-1000]
+            else:
+                self.wasted_polls += 1
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def record_failure(self) -> None:
+        """A tick that raised: back off like an idle tick."""
+        metrics.inc("spam_errors_total", where="poll")
+        with self._lock:
+            self.polls += 1
+            self.errors += 1
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def next_delay(self) -> float:
+        """Seconds to wait before the next tick (current interval ± jitter)."""
+        with self._lock:
+            spread = self.interval * self.jitter
+            delay = self.interval + self._rnd.uniform(-spread, spread)
+        return min(self.max_interval, max(self.min_interval, delay))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latencies)
+            return {
+                "polls": self.polls,
+                "full_polls": self.full_polls,
+                "wasted_polls": self.wasted_polls,
+                "messages": self.messages,
+                "errors": self.errors,
+                "interval_s": round(self.interval, 2),
+                "detection_latency_p50_s": round(lat[len(lat) // 2], 2) if lat else None,
+                "detection_latency_max_s": round(lat[-1], 2) if lat else None,
+            }
@@ -1,6 +1,8 @@
 from __future__ import annotations
-import sqlite3, pathlib, time
-from typing import Optional, Dict, Any
+import atexit, itertools, json, sqlite3, pathlib, threading, time, zlib
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterator, Sequence
+
+import metrics
 
 DB_PATH = pathlib.Path(__file__).resolve().parents[1] / "state.db"
 
@@ -9,31 +11,413 @@ CREATE TABLE IF NOT EXISTS decisions (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   message_id TEXT NOT NULL,
   predicted REAL NOT NULL,         -- model spam probability
-  label TEXT NOT NULL,             -- "spam"|"ham"|"suspicious"|"none"
+  label TEXT NOT NULL,             -- "spam"|"ham"|"suspicious"|"none"|"auto-spam"|"auto-suspicious"
   reasons TEXT NOT NULL,           -- short JSON/text blob
-  created_at INTEGER NOT NULL
+  created_at INTEGER NOT NULL,
+  sender TEXT                      -- raw From header (NULL for rows logged before it was kept)
+);
+CREATE INDEX IF NOT EXISTS idx_decisions_message_id ON decisions (message_id);
+CREATE INDEX IF NOT EXISTS idx_decisions_created_at ON decisions (created_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+  message_id TEXT PRIMARY KEY,
+  thread_id TEXT,
+  sender TEXT,
+  subject TEXT,
+  snippet TEXT,
+  internal_date INTEGER NOT NULL,  -- Gmail internalDate (ms since epoch); fetch time if unknown
+  gmail_spam INTEGER,              -- 1/0: in Gmail's SPAM label when fetched; NULL if unknown
+  predicted REAL,                  -- blended spam score when last classified
+  reasons TEXT,
+  seen_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_internal_date ON messages (internal_date);
+CREATE INDEX IF NOT EXISTS idx_messages_seen_at ON messages (seen_at);
+
+CREATE TABLE IF NOT EXISTS decision_rollups (
+  day TEXT PRIMARY KEY,            -- UTC date, YYYY-MM-DD
+  rollup BLOB NOT NULL             -- zlib JSON {label: {sender domain: [count, score histogram...]}}
 );
 """
 
-def _conn():
-    c = sqlite3.connect(DB_PATH)
-    c.execute("PRAGMA journal_mode=WAL;")
-    c.execute(DDL)
-    return c
+COLUMNS = "message_id, predicted, label, reasons, created_at, sender"
+INSERT_SQL = f"INSERT INTO decisions ({COLUMNS}) VALUES (?,?,?,?,?,?)"
+SELECT_BY_MESSAGE_SQL = f"SELECT {COLUMNS} FROM decisions WHERE message_id = ? ORDER BY id DESC LIMIT 1"
 
-def log_decision(message_id: str, predicted: float, label: str, reasons: str) -> None:
-    ts = int(time.time())
-    with _conn() as c:
-        c.execute(
-            "INSERT INTO decisions (message_id, predicted, label, reasons, created_at) VALUES (?,?,?,?,?)",
-            (message_id, predicted, label, reasons, ts),
-        )
+# Decisions are read in keyset pages: each page resumes after the last key
+# of the previous one, so every page is an index range scan of the same
+# cost however deep into the table it is.
+DECISION_ORDERS = {"id": "id", "created_at": "created_at, id"}
 
-def fetch_labeled_data(limit: Optional[int] = None) -> list[dict[str, Any]]:
-    q = "SELECT message_id, predicted, label, reasons, created_at FROM decisions ORDER BY id DESC"
-    if limit:
-        q += f" LIMIT {int(limit)}"
-    with _conn() as c:
-        cur = c.execute(q)
+def _decisions_sql(order: str, descending: bool, n_labels: int, since: bool, until: bool) -> str:
+    cols = DECISION_ORDERS[order].split(", ")
+    where = [f"({', '.join(cols)}) {'<' if descending else '>'} ({', '.join('?' * len(cols))})"]
+    if n_labels:
+        where.append(f"label IN ({', '.join('?' * n_labels)})")
+    if since:
+        where.append("created_at >= ?")
+    if until:
+        where.append("created_at < ?")
+    order_by = ", ".join(c + (" DESC" if descending else "") for c in cols)
+    return f"SELECT id, {COLUMNS} FROM decisions WHERE {' AND '.join(where)} ORDER BY {order_by} LIMIT ?"
+
+# Retention: a decision older than the cutoff is rolled up and deleted unless
+# it is the latest spam/ham decision for its message, which training and the
+# sender reputation still read.
+_IS_LABEL = ("label IN ('spam', 'ham') AND id = (SELECT MAX(d.id) FROM decisions d "
+             "WHERE d.message_id = decisions.message_id AND d.label IN ('spam', 'ham'))")
+SELECT_EXPIRED_SQL = (f"SELECT id, label, sender, predicted, created_at FROM decisions "
+                      f"WHERE (created_at, id) > (?, ?) AND created_at < ? AND NOT ({_IS_LABEL}) "
+                      f"ORDER BY created_at, id LIMIT ?")
+DELETE_DECISION_SQL = "DELETE FROM decisions WHERE id = ?"
+# Message features expire by when they were last classified, unless a decision
+# still refers to them (run after the decisions themselves were archived).
+_EXPIRED_MESSAGES = ("FROM messages WHERE seen_at < ? AND NOT EXISTS "
+                     "(SELECT 1 FROM decisions d WHERE d.message_id = messages.message_id)")
+COUNT_EXPIRED_MESSAGES_SQL = f"SELECT COUNT(*) {_EXPIRED_MESSAGES}"
+DELETE_EXPIRED_MESSAGES_SQL = f"DELETE FROM messages WHERE rowid IN (SELECT rowid {_EXPIRED_MESSAGES} LIMIT ?)"
+SELECT_ROLLUP_SQL = "SELECT rollup FROM decision_rollups WHERE day = ?"
+UPSERT_ROLLUP_SQL = "INSERT OR REPLACE INTO decision_rollups (day, rollup) VALUES (?, ?)"
+SELECT_ROLLUPS_SQL = "SELECT day, rollup FROM decision_rollups WHERE day >= ? AND day < ? ORDER BY day"
+
+# {label: {sender domain: [count, histogram bin 0, bin 1, ...]}}
+Rollup = Dict[str, Dict[str, List[int]]]
+
+MESSAGE_COLUMNS = ("message_id, thread_id, sender, subject, snippet, internal_date, "
+                   "gmail_spam, predicted, reasons, seen_at")
+UPSERT_MESSAGE_SQL = (
+    f"INSERT INTO messages ({MESSAGE_COLUMNS}) VALUES (?,?,?,?,?,?,?,?,?,?) "
+    "ON CONFLICT (message_id) DO UPDATE SET "
+    "gmail_spam = COALESCE(excluded.gmail_spam, gmail_spam), predicted = excluded.predicted, "
+    "reasons = excluded.reasons, seen_at = excluded.seen_at"
+)
+
+# Training examples: messages with a confirmed spam/ham decision (latest one
+# wins) or, when asked, Gmail's own spam flag. Oldest first, paged by keyset
+# on (internal_date, rowid) so every chunk is a range scan of the date index.
+_TRAINING_LABEL = ("COALESCE((SELECT d.label = 'spam' FROM decisions d "
+                   "WHERE d.message_id = m.message_id AND d.label IN ('spam', 'ham') "
+                   "ORDER BY d.id DESC LIMIT 1), CASE WHEN ? THEN m.gmail_spam END)")
+SELECT_TRAINING_SQL = (f"SELECT m.internal_date, m.rowid, m.subject, m.snippet, m.sender, "
+                       f"{_TRAINING_LABEL} AS label FROM messages m "
+                       f"WHERE (m.internal_date, m.rowid) > (?, ?) AND label IS NOT NULL "
+                       f"ORDER BY m.internal_date, m.rowid LIMIT ?")
+COUNT_TRAINING_SQL = f"SELECT COUNT(*) FROM messages m WHERE {_TRAINING_LABEL} IS NOT NULL"
+
+TrainingRow = Tuple[int, int, str, str, str, int]   # internal_date (ms), rowid, subject, snippet, sender, label
+
+# columns added after the first release: (name, type) appended to older databases
+MIGRATIONS = [("sender", "TEXT")]
+
+Row = Tuple[str, float, str, str, int, Optional[str]]
+MessageRow = Tuple[str, Optional[str], str, str, str, Optional[int], Optional[int], Optional[float],
+                   Optional[str], int]
+
+class Storage:
+    """
+    One long-lived SQLite connection shared by all threads (access is
+    serialized with a lock). sqlite3 keeps the fixed SQL above in its
+    statement cache, so repeated calls skip re-preparing.
+    """
+
+    def __init__(self, path: pathlib.Path | str = DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, cached_statements=64)
+        # only takes effect on a new database; vacuum() converts older ones
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        self._db.execute("PRAGMA journal_mode=WAL;")
+        self._db.execute("PRAGMA synchronous=NORMAL;")
+        self._migrate()
+        self._db.executescript(DDL)
+
+    def _migrate(self) -> None:
+        have = {r[1] for r in self._db.execute("PRAGMA table_info(decisions)")}
+        if not have:
+            return    # new database, DDL creates the full table
+        for name, typ in MIGRATIONS:
+            if name not in have:
+                self._db.execute(f"ALTER TABLE decisions ADD COLUMN {name} {typ}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _rows(self, cur) -> List[Dict[str, Any]]:
         cols = [d[0] for d in cur.description]
         return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def insert_many(self, rows: List[Row]) -> None:
+        if not rows:
+            return
+        with metrics.timer("spam_sqlite_commit_seconds"), self._lock, self._db:
+            self._db.executemany(INSERT_SQL, rows)
+        metrics.inc("spam_decisions_written_total", len(rows))
+
+    def log_decision(self, message_id: str, predicted: float, label: str, reasons: str,
+                     sender: Optional[str] = None) -> None:
+        self.insert_many([(message_id, predicted, label, reasons, int(time.time()), sender)])
+
+    def fetch_labeled_data(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """The `limit` newest decisions as a list; iter_decisions() streams instead."""
+        rows = self.iter_decisions(descending=True)
+        return list(itertools.islice(rows, int(limit)) if limit else rows)
+
+    def iter_decisions(self, order: str = "id", descending: bool = False,
+                       labels: Optional[Sequence[str]] = None, since: Optional[int] = None,
+                       until: Optional[int] = None, chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        Decisions one dict at a time, ordered by "id" or "created_at" (ties
+        broken by id), optionally only `labels` and created_at in
+        [since, until). Rows are read `chunk_size` at a time by keyset, so
+        memory stays constant and the lock is only held per chunk.
+        """
+        if order not in DECISION_ORDERS:
+            raise ValueError(f"order must be one of {sorted(DECISION_ORDERS)}, not {order!r}")
+        labels = tuple(labels or ())
+        sql = _decisions_sql(order, descending, len(labels), since is not None, until is not None)
+        filters = labels + tuple(v for v in (since, until) if v is not None)
+        edge = 2 ** 63 - 1 if descending else -1
+        after: Tuple[int, ...] = (edge,) if order == "id" else (edge, edge)
+        while True:
+            with self._lock:
+                rows = self._rows(self._db.execute(sql, (*after, *filters, int(chunk_size))))
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1]
+            after = (last["id"],) if order == "id" else (last["created_at"], last["id"])
+
+    def get_decision(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Latest decision for a message, via the message_id index."""
+        with self._lock:
+            rows = self._rows(self._db.execute(SELECT_BY_MESSAGE_SQL, (message_id,)))
+        return rows[0] if rows else None
+
+    def upsert_messages(self, rows: List[MessageRow]) -> None:
+        """Store message features and scores; a message seen again keeps its features."""
+        if not rows:
+            return
+        with metrics.timer("spam_sqlite_commit_seconds"), self._lock, self._db:
+            self._db.executemany(UPSERT_MESSAGE_SQL, rows)
+
+    def count_training_rows(self, include_gmail: bool = False) -> int:
+        with self._lock:
+            return self._db.execute(COUNT_TRAINING_SQL, (int(include_gmail),)).fetchone()[0]
+
+    def iter_training_rows(self, chunk_size: int = 5000,
+                           include_gmail: bool = False) -> Iterator[List[TrainingRow]]:
+        """
+        Labeled examples oldest first, `chunk_size` rows at a time. Human
+        spam/ham decisions win over Gmail's spam flag, which is only used with
+        `include_gmail`. Each chunk is one indexed query, so memory stays bounded.
+        """
+        after: Tuple[int, int] = (-1, -1)
+        while True:
+            with self._lock:
+                rows = self._db.execute(SELECT_TRAINING_SQL,
+                                        (int(include_gmail), *after, int(chunk_size))).fetchall()
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1][0], rows[-1][1])
+
+    def sender_labels(self) -> Iterator[Tuple[str, str, int]]:
+        """(sender, "spam"|"ham", created_at) for every confirmed decision, oldest first."""
+        for r in self.iter_decisions(labels=("spam", "ham")):
+            if r["sender"] is not None:
+                yield r["sender"], r["label"], r["created_at"]
+
+    # --- retention ---
+
+    def expired_decisions(self, before: int, chunk_size: int = 5000
+                          ) -> Iterator[List[Tuple[int, str, Optional[str], float, int]]]:
+        """
+        (id, label, sender, predicted, created_at) chunks of decisions older
+        than `before` that retention may drop, oldest first. Safe to delete
+        each chunk before asking for the next.
+        """
+        after: Tuple[int, int] = (-1, -1)
+        while True:
+            with self._lock:
+                rows = self._db.execute(SELECT_EXPIRED_SQL, (*after, int(before), int(chunk_size))).fetchall()
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1][4], rows[-1][0])
+
+    def archive_decisions(self, rollups: Dict[str, Rollup], ids: List[int]) -> None:
+        """Add `rollups` to the stored per-day rollups and delete `ids`, in one transaction."""
+        with metrics.timer("spam_sqlite_commit_seconds"), self._lock, self._db:
+            for day, add in rollups.items():
+                row = self._db.execute(SELECT_ROLLUP_SQL, (day,)).fetchone()
+                merged = merge_rollups(_unpack(row[0]), add) if row else add
+                self._db.execute(UPSERT_ROLLUP_SQL, (day, _pack(merged)))
+            self._db.executemany(DELETE_DECISION_SQL, [(i,) for i in ids])
+
+    def expire_messages(self, before: int, chunk_size: int = 5000, dry_run: bool = False) -> int:
+        """
+        Delete stored message features last classified before `before` that no
+        decision refers to, `chunk_size` rows per transaction. Returns how many
+        were (or with `dry_run`, would be) deleted.
+        """
+        if dry_run:
+            with self._lock:
+                return self._db.execute(COUNT_EXPIRED_MESSAGES_SQL, (int(before),)).fetchone()[0]
+        deleted = 0
+        while True:
+            with metrics.timer("spam_sqlite_commit_seconds"), self._lock, self._db:
+                n = self._db.execute(DELETE_EXPIRED_MESSAGES_SQL, (int(before), int(chunk_size))).rowcount
+            deleted += n
+            if n < chunk_size:
+                return deleted
+
+    def rollups(self, since: str = "", until: str = "9999") -> Iterator[Tuple[str, Rollup]]:
+        """(day, rollup) for archived days in [since, until), as YYYY-MM-DD strings."""
+        with self._lock:
+            rows = self._db.execute(SELECT_ROLLUPS_SQL, (since, until)).fetchall()
+        for day, blob in rows:
+            yield day, _unpack(blob)
+
+    def vacuum(self, max_pages: Optional[int] = None) -> int:
+        """
+        Return free pages to the filesystem (at most `max_pages`). A database
+        created before incremental auto-vacuum is switched over with one full
+        VACUUM first. Returns the number of pages freed.
+        """
+        with self._lock:
+            if self._db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                before = self._db.execute("PRAGMA page_count").fetchone()[0]
+                self._db.execute("VACUUM")
+                return before - self._db.execute("PRAGMA page_count").fetchone()[0]
+            free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+            n = free if max_pages is None else min(free, int(max_pages))
+            if n:
+                # executescript steps the pragma to completion; execute() frees one page
+                self._db.executescript(f"PRAGMA incremental_vacuum({n});")
+            self._db.execute("PRAGMA optimize")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")    # shrink the file now
+            return n
+
+class DecisionWriter:
+    """
+    Buffers decisions and commits them in one transaction once `batch_size`
+    rows are pending or `flush_seconds` have passed, whichever comes first.
+    """
+
+    def __init__(self, storage: Storage, batch_size: int = 256, flush_seconds: float = 1.0):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._buf: List[Row] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="decision-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message_id: str, predicted: float, label: str, reasons: str,
+              sender: Optional[str] = None) -> None:
+        with self._lock:
+            self._buf.append((message_id, predicted, label, reasons, int(time.time()), sender))
+            full = len(self._buf) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            rows, self._buf = self._buf, []
+        self.storage.insert_many(rows)
+
+    def close(self) -> None:
+        self._closed = True
+        self._wake.set()
+        self._thread.join(5.0)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"[error] decision writer: {e!r}")
+
+def _pack(rollup: Rollup) -> bytes:
+    return zlib.compress(json.dumps(rollup, separators=(",", ":"), sort_keys=True).encode(), 9)
+
+def _unpack(blob: bytes) -> Rollup:
+    return json.loads(zlib.decompress(blob))
+
+def merge_rollups(a: Rollup, b: Rollup) -> Rollup:
+    """Element-wise sum of two rollups (`a` is updated and returned)."""
+    for label, domains in b.items():
+        into = a.setdefault(label, {})
+        for domain, counts in domains.items():
+            have = into.get(domain)
+            into[domain] = [x + y for x, y in zip(have, counts)] if have else list(counts)
+    return a
+
+def message_rows(msgs: List[Dict[str, Any]], results: List[Dict[str, Any]]) -> List[MessageRow]:
+    """messages-table rows for message summaries and their classify_batch results."""
+    now = int(time.time())
+    return [
+        (m["id"], m.get("threadId"), m.get("from") or "", m.get("subject") or "", m.get("snippet") or "",
+         int(m["internalDate"]) if m.get("internalDate") else now * 1000,
+         int("SPAM" in m["labelIds"]) if "labelIds" in m else None, r["score"], r["reasons"], now)
+        for m, r in zip(msgs, results)
+    ]
+
+_storage: Optional[Storage] = None
+_writer: Optional[DecisionWriter] = None
+_init_lock = threading.Lock()
+_listeners: List[Callable[[str, str, Optional[str], int], None]] = []
+
+def add_listener(fn: Callable[[str, str, Optional[str], int], None]) -> None:
+    """Call fn(message_id, label, sender, created_at) for every decision logged from now on."""
+    _listeners.append(fn)
+
+def get_storage() -> Storage:
+    global _storage
+    with _init_lock:
+        if _storage is None:
+            _storage = Storage(DB_PATH)
+        return _storage
+
+def get_writer() -> DecisionWriter:
+    global _writer
+    storage = get_storage()
+    with _init_lock:
+        if _writer is None:
+            _writer = DecisionWriter(storage)
+            atexit.register(_writer.close)
+        return _writer
+
+def log_decision(message_id: str, predicted: float, label: str, reasons: str,
+                 sender: Optional[str] = None) -> None:
+    """Queue a decision; it is committed within about a second (or on exit)."""
+    get_writer().write(message_id, predicted, label, reasons, sender)
+    now = int(time.time())
+    for fn in _listeners:
+        try:
+            fn(message_id, label, sender, now)
+        except Exception as e:
+            print(f"[error] decision listener: {e!r}")
+
+def fetch_labeled_data(limit: Optional[int] = None) -> list[dict[str, Any]]:
+    if _writer is not None:
+        _writer.flush()
+    return get_storage().fetch_labeled_data(limit)
+
+def iter_decisions(**kwargs) -> Iterator[Dict[str, Any]]:
+    """Storage.iter_decisions() on the shared database, after flushing queued decisions."""
+    if _writer is not None:
+        _writer.flush()
+    return get_storage().iter_decisions(**kwargs)
+
+def get_decision(message_id: str) -> Optional[Dict[str, Any]]:
+    if _writer is not None:
+        _writer.flush()
+    return get_storage().get_decision(message_id)
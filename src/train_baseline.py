@@ -1,28 +1,224 @@
+"""
+Train and evaluate the spam model from state.db without loading it into memory.
+
+    python src/train_baseline.py [--include-gmail] [--folds 4] [--workers 4] [--dry-run] [--shadow]
+
+Examples are messages with a spam/ham decision (or, with --include-gmail,
+Gmail's own spam flag from backfill.py), streamed oldest first in chunks.
+Each candidate in GRID is evaluated in its own process. A first pass
+counts document frequencies to fix the TF-IDF vocabulary. A second pass
+feeds chunks to an SGD logistic regression. Each time-ordered fold is
+scored before the model trains on it, so every fold is predicted only
+from older mail (forward-chaining cross-validation in a single pass).
+
+The best candidate by mean F1 is published to the model registry only if
+it beats the current model on the most recent fold. Running daemons swap it
+in; with --shadow it is scored alongside the live model until promoted. It
+keeps the TF-IDF + LR layout, so it also exports to the compact format.
+"""
 from __future__ import annotations
-import json
-from typing import List
-from storage import fetch_labeled_data
-from classify.baseline import build_pipeline, train, save_model
+import argparse, os, time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from storage import DB_PATH, Storage, TrainingRow
+from classify.baseline import (load_or_init, predict, save_model, heuristics_batch,
+                               calibrate_bounds, DEFAULT_EXIT_LOW)
+
+GRID: List[Dict[str, Any]] = [
+    {"alpha": alpha, "ngram_range": ngrams}
+    for alpha in (1e-6, 1e-5, 1e-4) for ngrams in ((1, 1), (1, 2))
+]
+MAX_FEATURES = 5000
+MAX_TERMS = 500_000      # document-frequency counter is pruned beyond this
+EPOCHS_PER_CHUNK = 5     # SGD passes over each chunk (labeled data is usually small)
+CHUNK_SIZE = 5000
+MIN_ROWS = 20
+
+class Counts:
+    def __init__(self):
+        self.tp = self.fp = self.fn = self.tn = 0
+
+    def add(self, y: np.ndarray, pred: np.ndarray) -> None:
+        self.tp += int(np.sum(pred & (y == 1)))
+        self.fp += int(np.sum(pred & (y == 0)))
+        self.fn += int(np.sum(~pred & (y == 1)))
+        self.tn += int(np.sum(~pred & (y == 0)))
+
+    @property
+    def precision(self) -> float:
+        return self.tp / (self.tp + self.fp) if self.tp + self.fp else 0.0
+
+    @property
+    def recall(self) -> float:
+        return self.tp / (self.tp + self.fn) if self.tp + self.fn else 0.0
+
+    @property
+    def f1(self) -> float:
+        p, r = self.precision, self.recall
+        return 2 * p * r / (p + r) if p + r else 0.0
+
+def _texts(rows: List[TrainingRow]) -> List[str]:
+    # same text classify_batch feeds the model
+    return [f"{(subject or '').strip()}\n{snippet or ''}" for _, _, subject, snippet, _, _ in rows]
+
+def _vectorizer(params: Dict[str, Any], vocabulary=None):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(strip_accents="unicode", lowercase=True, stop_words="english",
+                           ngram_range=params["ngram_range"], vocabulary=vocabulary)
+
+def _fit_vocabulary(st: Storage, params: Dict[str, Any], include_gmail: bool, chunk_size: int):
+    """TF-IDF vectorizer whose vocabulary and idf come from one streaming pass."""
+    analyzer = _vectorizer(params).build_analyzer()
+    df: Counter = Counter()
+    n_docs = 0
+    for rows in st.iter_training_rows(chunk_size, include_gmail):
+        for text in _texts(rows):
+            df.update(set(analyzer(text)))
+        n_docs += len(rows)
+        if len(df) > MAX_TERMS:
+            df = Counter(dict(df.most_common(MAX_TERMS // 2)))
+    terms = sorted(t for t, _ in sorted(df.items(), key=lambda kv: (-kv[1], kv[0]))[:MAX_FEATURES])
+    vec = _vectorizer(params, {t: i for i, t in enumerate(terms)})
+    vec.fit([""])
+    dfs = np.array([df[t] for t in terms], dtype=np.float64)
+    vec.idf_ = np.log((1 + n_docs) / (1 + dfs)) + 1    # sklearn's smooth_idf formula
+    return vec
+
+def _segments(start: int, n: int, n_rows: int, folds: int):
+    """Split rows [start, start+n) of the stream into (fold, lo, hi) runs."""
+    fold_of = lambda i: min(folds, i * (folds + 1) // n_rows)
+    lo = 0
+    while lo < n:
+        f = fold_of(start + lo)
+        hi = lo
+        while hi < n and fold_of(start + hi) == f:
+            hi += 1
+        yield f, lo, hi
+        lo = hi
+
+def evaluate_candidate(db_path: str, params: Dict[str, Any], n_rows: int, folds: int,
+                       include_gmail: bool, chunk_size: int = CHUNK_SIZE):
+    """Runs in a worker process. Returns (params, per-fold Counts, us per message, fitted pipeline)."""
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+    st = Storage(db_path)
+    try:
+        vec = _fit_vocabulary(st, params, include_gmail, chunk_size)
+        clf = SGDClassifier(loss="log_loss", alpha=params["alpha"], random_state=0)
+        counts = [Counts() for _ in range(folds + 1)]
+        scored, scoring_s, seen, fitted = 0, 0.0, 0, False
+        for rows in st.iter_training_rows(chunk_size, include_gmail):
+            texts = _texts(rows)
+            y = np.fromiter((r[5] for r in rows), dtype=np.int64, count=len(rows))
+            for fold, lo, hi in _segments(seen, len(rows), n_rows, folds):
+                t0 = time.perf_counter()
+                X = vec.transform(texts[lo:hi])
+                if fold > 0 and fitted:
+                    spam_col = list(clf.classes_).index(1)
+                    p = clf.predict_proba(X)[:, spam_col]
+                    scoring_s += time.perf_counter() - t0
+                    scored += hi - lo
+                    counts[fold].add(y[lo:hi], p >= 0.5)
+                for _ in range(EPOCHS_PER_CHUNK):
+                    clf.partial_fit(X, y[lo:hi], classes=[0, 1])
+                fitted = True
+            seen += len(rows)
+    finally:
+        st.close()
+    us = scoring_s / scored * 1e6 if scored else float("nan")
+    return params, counts[1:], us, Pipeline([("tfidf", vec), ("lr", clf)])
+
+def score_current(st: Storage, n_rows: int, folds: int, include_gmail: bool,
+                  chunk_size: int = CHUNK_SIZE) -> Tuple[Counts, float]:
+    """The deployed model on the most recent fold (it may have trained on it, which only favours it)."""
+    model = load_or_init()
+    first = folds * n_rows // (folds + 1)
+    while first > 0 and min(folds, (first - 1) * (folds + 1) // n_rows) == folds:
+        first -= 1
+    counts, seen, elapsed, scored = Counts(), 0, 0.0, 0
+    for rows in st.iter_training_rows(chunk_size, include_gmail):
+        lo = max(0, first - seen)
+        seen += len(rows)
+        if lo >= len(rows):
+            continue
+        texts = _texts(rows[lo:])
+        y = np.fromiter((r[5] for r in rows[lo:]), dtype=np.int64, count=len(rows) - lo)
+        t0 = time.perf_counter()
+        p = np.asarray(predict(model, texts))
+        elapsed += time.perf_counter() - t0
+        scored += len(texts)
+        counts.add(y, p >= 0.5)
+    return counts, (elapsed / scored * 1e6 if scored else float("nan"))
+
+def heuristic_levels(st: Storage, include_gmail: bool,
+                     chunk_size: int = CHUNK_SIZE) -> Counter:
+    """{(heuristic score, label): count} over all labeled mail, for calibrate_bounds()."""
+    counts: Counter = Counter()
+    for rows in st.iter_training_rows(chunk_size, include_gmail):
+        heur, _ = heuristics_batch([(r[2] or "").strip() for r in rows], [r[3] or "" for r in rows],
+                                   [r[4] or "" for r in rows])
+        counts.update(zip(np.round(heur, 4).tolist(), (r[5] for r in rows)))
+    return counts
 
 def main():
-    rows = fetch_labeled_data()
-    texts: List[str] = []
-    labels: List[int] = []
-    for r in rows:
-        # only train on explicit labels
-        if r["label"] in ("spam","ham"):
-            # we didn’t store the raw text; approximate with reasons and score for now
-            # For better training, you can store subject/snippet too (extend storage.py & main)
-            texts.append(r["reasons"])
-            labels.append(1 if r["label"] == "spam" else 0)
-
-    if len(labels) < 20:
-        print(f"Not enough labeled items yet ({len(labels)}). Aim for at least 50.")
+    ap = argparse.ArgumentParser(description="Evaluate candidate models on state.db and save the best.")
+    ap.add_argument("--include-gmail", action="store_true",
+                    help="also learn from Gmail's spam flag on backfilled mail")
+    ap.add_argument("--folds", type=int, default=4, help="time-ordered evaluation folds")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--dry-run", action="store_true", help="report only; never save")
+    ap.add_argument("--max-exit-error", type=float, default=0.01,
+                    help="error allowed in mail the cascade decides from heuristics alone")
+    ap.add_argument("--shadow", action="store_true",
+                    help="publish as the shadow model instead of serving it")
+    args = ap.parse_args()
+
+    st = Storage(DB_PATH)
+    n_rows = st.count_training_rows(args.include_gmail)
+    if n_rows < MIN_ROWS:
+        print(f"Not enough labeled items yet ({n_rows}). Aim for at least 50.")
         return
+    print(f"{n_rows} labeled messages, {args.folds} time-ordered folds, {len(GRID)} candidates")
+
+    with ProcessPoolExecutor(max(1, min(args.workers, len(GRID)))) as pool:
+        futures = [pool.submit(evaluate_candidate, str(DB_PATH), params, n_rows, args.folds,
+                               args.include_gmail) for params in GRID]
+        results = [f.result() for f in futures]
+
+    print(f"{'alpha':>8} {'ngrams':>7} {'prec':>6} {'recall':>6} {'F1':>6} {'last F1':>8} {'us/msg':>7}")
+    for params, folds, us, _ in results:
+        c = Counts()
+        for f in folds:
+            c.tp, c.fp, c.fn, c.tn = c.tp + f.tp, c.fp + f.fp, c.fn + f.fn, c.tn + f.tn
+        print(f"{params['alpha']:>8g} {str(params['ngram_range']):>7} {c.precision:6.3f} "
+              f"{c.recall:6.3f} {np.mean([f.f1 for f in folds]):6.3f} {folds[-1].f1:8.3f} {us:7.1f}")
 
-    pipe = build_pipeline()
-    train(pipe, texts, labels)
-    print(f"Trained on {len(labels)} items and saved model.")
+    levels = heuristic_levels(st, args.include_gmail)
+    low, high = calibrate_bounds(levels, args.max_exit_error)
+    exits = sum(n for (h, _), n in levels.items()
+                if (low is not None and h < low) or (high is not None and h >= high))
+    fmt = lambda b: "" if b is None else f"{b:.3f}"
+    print(f"cascade bounds at {args.max_exit_error:.1%} error: SPAM_CASCADE={fmt(low)},{fmt(high)} "
+          f"({exits / n_rows:.0%} of mail skips the model; default is {DEFAULT_EXIT_LOW:.3f}, no high exit)")
+
+    best = max(results, key=lambda r: (np.mean([f.f1 for f in r[1]]), -r[2]))
+    params, folds, us, pipe = best
+    current, current_us = score_current(st, n_rows, args.folds, args.include_gmail)
+    st.close()
+    print(f"best: alpha={params['alpha']:g} ngrams={params['ngram_range']} last-fold F1 {folds[-1].f1:.3f}; "
+          f"current model {current.f1:.3f} (p={current.precision:.3f} r={current.recall:.3f}, {current_us:.1f} us/msg)")
+    if folds[-1].f1 <= current.f1:
+        print("Current model is at least as good; not saving.")
+        return
+    if args.dry_run:
+        print("Dry run; not saving.")
+        return
+    version = save_model(pipe, promote=not args.shadow)
+    print(f"Published model {version}" + (" as shadow." if args.shadow else "; running daemons pick it up."))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,57 @@
+from __future__ import annotations
+import os, pathlib, sys, tempfile, time, types
+from typing import List
+
+import pytest
+
+SRC = pathlib.Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC))
+
+# model files live in a throwaway directory, never next to the checkout's own
+_MODELS = pathlib.Path(tempfile.mkdtemp(prefix="spam-tests-"))
+os.environ["SPAM_MODELS_DIR"] = str(_MODELS / "models")
+os.environ["SPAM_MODEL_PATH"] = str(_MODELS / "model.joblib")
+os.environ["SPAM_COMPACT_PATH"] = str(_MODELS / "model_compact")
+
+import gmail_client, quota
+from fake_gmail import FakeGmailService, FakeMailbox
+
+class FakeClock:
+    """Stands in for the `time` module: sleep() advances monotonic() instantly and is recorded."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps: List[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += max(0.0, seconds)
+
+@pytest.fixture(autouse=True)
+def quota_buckets(monkeypatch):
+    """Fresh buckets per test; the default mailbox is never throttled."""
+    buckets = {"default": quota.TokenBucket(rate=1e9)}
+    monkeypatch.setattr(quota, "_buckets", buckets)
+    return buckets
+
+@pytest.fixture
+def clock(monkeypatch, quota_buckets) -> FakeClock:
+    """Backoff and quota waits run on a fake clock instead of sleeping."""
+    c = FakeClock()
+    fake_time = types.SimpleNamespace(monotonic=c.monotonic, sleep=c.sleep,
+                                      time=time.time, perf_counter=time.perf_counter)
+    monkeypatch.setattr(quota, "time", fake_time)
+    monkeypatch.setattr(gmail_client, "time", fake_time)
+    quota_buckets["default"] = quota.TokenBucket(rate=1e9)     # on the fake clock
+    return c
+
+@pytest.fixture
+def box() -> FakeMailbox:
+    return FakeMailbox()
+
+@pytest.fixture
+def svc(box) -> FakeGmailService:
+    return FakeGmailService(box)
@@ -0,0 +1,69 @@
+from __future__ import annotations
+import base64
+
+import body
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode()
+
+def _part(mime: str, data: bytes, charset: str = "utf-8", **extra):
+    return {"mimeType": mime, "filename": "",
+            "headers": [{"name": "Content-Type", "value": f"{mime}; charset={charset}"}],
+            "body": {"size": len(data), "data": _b64(data)}, **extra}
+
+def _msg(*parts, mime: str = "multipart/mixed"):
+    return {"id": "m1", "payload": {"mimeType": mime, "headers": [], "parts": list(parts)}}
+
+def test_multipart_message_from_the_fake(svc, box):
+    text = "Claim your prize at https://prize.example.xyz/now or https://other.example.org"
+    [mid] = box.deliver([{"from": "a@example.com", "subject": "hi", "snippet": text[:40],
+                          "body": text, "attachment": ("invoice.zip", 40000)}])
+    msg = svc.users().messages().get(userId="me", id=mid, format="full").execute()
+    f = body.extract(msg)
+    assert "Claim your prize" in f.text
+    assert f.links == ["https://prize.example.xyz/now", "https://other.example.org"]
+    assert f.domains == {"example.xyz", "example.org"}
+    assert f.bad_tld_links == 1
+    assert f.attachments_skipped == 1
+    assert not f.truncated
+    assert f.body_bytes > 2 * len(text)      # both the plain and the HTML alternative
+
+def test_html_anchors_scripts_and_mismatched_links():
+    page = (b'<html><head><style>p {color: red}</style><script>var x = "hidden";</script></head>'
+            b'<body><p>Your account is locked.</p>'
+            b'<a href="http://login.evil.top/x">www.paypal.com</a>'
+            b'<a href="https://paypal.com/help">paypal.com</a></body></html>')
+    f = body.extract(_msg(_part("text/html", page), mime="multipart/alternative"))
+    assert "Your account is locked." in f.text
+    assert "hidden" not in f.text and "color" not in f.text
+    assert f.mismatched == 1
+    assert f.bad_tld_links == 1
+    assert f.domains == {"evil.top", "paypal.com"}
+
+def test_charset_and_nested_parts():
+    latin = "Café olé".encode("latin-1")
+    inner = {"mimeType": "multipart/alternative", "parts": [_part("text/plain", latin, "iso-8859-1")]}
+    f = body.extract(_msg(inner, {"mimeType": "application/pdf", "filename": "a.pdf",
+                                  "body": {"attachmentId": "x", "size": 10}}))
+    assert f.text == "Café olé"
+    assert f.attachments_skipped == 1
+
+def test_base64_is_decoded_across_slices():
+    # multi-byte characters straddle the SLICE_CHARS boundaries
+    text = "é€ünïcødé " * (3 * body.SLICE_CHARS // 10)
+    f = body.extract(_msg(_part("text/plain", text.encode())), max_bytes=10**7)
+    assert f.text == text
+    assert f.body_bytes == len(text.encode())
+    assert not f.truncated
+
+def test_large_bodies_are_truncated_at_max_bytes():
+    text = ("lorem ipsum " * 20000).encode()
+    f = body.extract(_msg(_part("text/plain", text), _part("text/html", b"<p>second</p>")),
+                     max_bytes=1000)
+    assert f.truncated
+    assert f.body_bytes == 1000
+    assert len(f.text) == 1000
+
+def test_message_without_body():
+    f = body.extract({"id": "m2", "payload": {"mimeType": "text/plain", "body": {"size": 0}}})
+    assert (f.text, f.links, f.body_bytes, f.truncated) == ("", [], 0, False)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+import sqlite3
+
+import pytest
+
+import mailgen
+from cache import ResultCache
+from classify.baseline import Cascade, build_pipeline, classify_batch, model_version
+from classify.online import CHECKPOINT_EVERY, OnlineModel
+
+def _r(score: float):
+    return {"score": score, "model_score": score, "reasons": ""}
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "classify_cache.db"
+
+def test_results_survive_a_restart(path):
+    c = ResultCache(path)
+    assert c.get_many("v1", [b"a"]) == {}
+    c.put_many("v1", {b"a": _r(0.1), b"b": _r(0.9)})
+    assert c.get_many("v1", [b"a"]) == {b"a": _r(0.1)}
+    c.close()
+    warm = ResultCache(path)
+    assert warm.get_many("v1", [b"a", b"b", b"c"]) == {b"a": _r(0.1), b"b": _r(0.9)}
+    assert warm.stats()["disk_hits"] == 2 and warm.stats()["misses"] == 1
+
+def test_results_are_only_served_to_their_version(path):
+    c = ResultCache(path)
+    c.put_many("v1", {b"a": _r(0.1)})
+    assert c.get_many("v2", [b"a"]) == {}
+    assert c.stats()["invalidations"] == 1
+    c.put_many("v2", {b"a": _r(0.7)})
+    assert ResultCache(path).get_many("v1", [b"a"]) == {}
+
+def test_processes_on_different_versions_share_the_file(path):
+    daemon, mcp = ResultCache(path), ResultCache(path)
+    daemon.get_many("v2", [b"x"])            # the daemon swapped to v2 ...
+    mcp.put_many("v1", {b"x": _r(0.2)})      # ... while the MCP server still scores with v1
+    assert daemon.get_many("v2", [b"x"]) == {}
+    daemon.put_many("v2", {b"y": _r(0.8)})
+    assert ResultCache(path).get_many("v1", [b"x", b"y"]) == {b"x": _r(0.2)}
+
+def test_table_from_before_versioned_rows_is_replaced(path):
+    db = sqlite3.connect(str(path))
+    db.executescript("CREATE TABLE results (key BLOB PRIMARY KEY, value TEXT NOT NULL, created_at INTEGER NOT NULL);"
+                     "CREATE TABLE meta (k TEXT PRIMARY KEY, v TEXT NOT NULL);"
+                     "INSERT INTO results VALUES (x'61', '{}', 0); INSERT INTO meta VALUES ('version', 'v1');")
+    db.commit()
+    db.close()
+    c = ResultCache(path)
+    assert c.get_many("v1", [b"a"]) == {}
+    c.put_many("v1", {b"a": _r(0.3)})
+    assert ResultCache(path).get_many("v1", [b"a"]) == {b"a": _r(0.3)}
+
+def test_table_is_pruned_to_maxsize(path):
+    c = ResultCache(path, maxsize=500)
+    c.put_many("v1", {i.to_bytes(4, "big"): _r(0.5) for i in range(1200)})
+    with c._lock:
+        assert c._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 500
+
+def test_classify_batch_reuses_cached_scores(path):
+    mail = mailgen.generate(200, seed=3)
+    pipe = build_pipeline().fit([f"{m['subject']}\n{m['snippet']}" for m in mail], [m["label"] for m in mail])
+    cache, cascade = ResultCache(path), Cascade(None, None)
+    first = classify_batch(pipe, mail[:50], cache, cascade=cascade)
+    assert first == classify_batch(pipe, mail[:50], cascade=cascade)
+    assert classify_batch(pipe, mail[:50], cache, cascade=cascade) == first
+    assert cache.stats()["hits"] == 50
+
+def test_online_version_moves_on_first_fit_then_per_checkpoint(tmp_path):
+    model = OnlineModel(tmp_path / "online.joblib")
+    unfitted = model_version(model)
+    model.partial_fit(["win money now"], [1])
+    fitted = model_version(model)
+    assert fitted != unfitted
+    model.partial_fit(["lunch tomorrow?"] * (CHECKPOINT_EVERY - 2), [0] * (CHECKPOINT_EVERY - 2))
+    assert model_version(model) == fitted
+    model.partial_fit(["meeting notes"], [0])
+    assert model_version(model) != fitted
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import pytest
+
+from classify.baseline import DEFAULT_EXIT_LOW, Cascade, calibrate_bounds
+
+def test_separable_mail_gets_both_exits():
+    counts = {(0.0, 0): 500, (0.1, 0): 200, (0.8, 1): 100, (0.9, 1): 300}
+    low, high = calibrate_bounds(counts)
+    assert low == DEFAULT_EXIT_LOW           # capped: would otherwise be 0.8
+    assert high == 0.8
+
+def test_low_stops_below_the_first_spam_level():
+    counts = {(0.0, 0): 100, (0.05, 1): 50, (0.1, 0): 100, (0.9, 1): 10}
+    assert calibrate_bounds(counts)[0] == 0.05
+
+def test_max_error_tolerates_a_few_mistakes():
+    counts = {(0.0, 0): 199, (0.0, 1): 1, (0.1, 0): 50, (0.1, 1): 50, (0.9, 1): 99, (0.9, 0): 1}
+    assert calibrate_bounds(counts, max_error=0.01) == (0.1, 0.9)
+    assert calibrate_bounds(counts, max_error=0.001) == (None, None)
+
+def test_no_exit_when_the_classes_overlap_everywhere():
+    counts = {(h, y): 10 for h in (0.0, 0.5, 1.0) for y in (0, 1)}
+    assert calibrate_bounds(counts) == (None, None)
+
+def test_low_never_exceeds_high():
+    counts = {(0.0, 0): 100, (0.1, 1): 100}
+    low, high = calibrate_bounds(counts)
+    assert high == 0.1 and low <= high
+
+def test_env_low_is_capped(monkeypatch, capsys):
+    monkeypatch.setenv("SPAM_CASCADE", "0.5,0.9")
+    c = Cascade.from_env()
+    assert (c.low, c.high) == (pytest.approx(DEFAULT_EXIT_LOW), 0.9)
+    assert "capped" in capsys.readouterr().err
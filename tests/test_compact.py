@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+import mailgen
+from classify import compact
+from classify.baseline import build_pipeline
+
+def _text(m) -> str:
+    return f"{m['subject']}\n{m['snippet']}"
+
+@pytest.fixture(scope="module")
+def trained():
+    mail = mailgen.generate(400, seed=11)
+    return build_pipeline().fit([_text(m) for m in mail], [m["label"] for m in mail])
+
+def test_compact_model_matches_the_sklearn_pipeline(trained, tmp_path):
+    model = compact.CompactModel(compact.export(trained, tmp_path / "c", version="v1"))
+    texts = [_text(m) for m in mailgen.generate(200, seed=12)] + [
+        "",
+        "Café CRÈME brûlée — naïve façade",          # accents are stripped like sklearn
+        "FREE free FrEe!!! win win win $$$",
+        "the and of",                                 # only stop words
+        "unseen-token zzqx 12345",
+    ]
+    expected = trained.predict_proba(texts)[:, list(trained.classes_).index(1)]
+    np.testing.assert_allclose(model.predict_spam(texts), expected, rtol=0, atol=1e-9)
+    assert model.version == "v1"
+
+def test_weights_are_memory_mapped(trained, tmp_path):
+    model = compact.CompactModel(compact.export(trained, tmp_path / "c"))
+    assert isinstance(model.coef, np.memmap) or isinstance(model.coef.base, np.memmap)
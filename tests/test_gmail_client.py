@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import pytest
+from googleapiclient.errors import HttpError
+
+import mailgen
+from fake_gmail import FakeGmailService
+from gmail_client import BATCH_LIMIT, MODIFY_LIMIT, BulkActions, LabelRegistry, get_messages_batch
+
+def test_batch_fetch_chunks_and_dedupes(svc, box):
+    ids = box.deliver(mailgen.generate(250, seed=1))
+    got = get_messages_batch(svc, ids + ids[:10], "metadata", ["From", "Subject"])
+    assert set(got) == set(ids)
+    assert svc.calls["batch"] == -(-len(ids) // BATCH_LIMIT)
+    headers = {h["name"] for h in got[ids[0]]["payload"]["headers"]}
+    assert headers == {"From", "Subject"}
+
+def test_batch_fetch_omits_deleted_messages(svc, box):
+    ids = box.deliver(mailgen.generate(20, seed=2))
+    del box.messages[ids[3]], box.messages[ids[7]]
+    got = get_messages_batch(svc, ids, "minimal")
+    assert set(got) == set(ids) - {ids[3], ids[7]}
+    # the two 404s were retried one by one before being dropped
+    assert svc.calls["messages.get"] == len(ids) + 2
+
+def test_batch_fetch_rebatches_throttled_items(box, clock):
+    ids = box.deliver(mailgen.generate(100, seed=3))
+    svc = FakeGmailService(box, error_rate=0.3, error_status=429, seed=4)
+    got = get_messages_batch(svc, ids, "minimal")
+    assert set(got) == set(ids)
+    assert svc.calls["batch"] > 1            # the throttled items went back in a batch
+    assert clock.sleeps                      # after a backoff
+    assert svc.calls["messages.get"] < 2 * len(ids)
+
+def test_single_id_skips_the_batch(svc, box):
+    ids = box.deliver(mailgen.generate(1, seed=5))
+    assert set(get_messages_batch(svc, ids, "minimal")) == set(ids)
+    assert svc.calls["batch"] == 0
+
+# --- BulkActions ---
+
+def _labels(box, mid):
+    return set(box.messages[mid]["labelIds"])
+
+def test_bulk_groups_by_label_change(svc, box):
+    ids = box.deliver(mailgen.generate(7, seed=6))
+    acts = BulkActions(LabelRegistry())
+    for mid in ids[:3]:
+        acts.spam(mid)
+    acts.spam(ids[0])                        # repeated: sent once
+    for mid in ids[3:5]:
+        acts.keep(mid)
+    for mid in ids[5:]:
+        acts.label(mid, "Suspicious")
+    assert acts.flush(svc) == 3
+    assert svc.calls["messages.batchModify"] == 3
+    assert svc.calls["labels.create"] == 1
+    assert all("SPAM" in _labels(box, m) and "INBOX" not in _labels(box, m) for m in ids[:3])
+    assert all("INBOX" in _labels(box, m) for m in ids[3:5])
+    suspicious = box.labels["Suspicious"]
+    assert all(suspicious in _labels(box, m) for m in ids[5:])
+    assert len(acts) == 0 and acts.flush(svc) == 0
+
+def test_bulk_splits_at_modify_limit(svc, box):
+    ids = box.deliver(mailgen.generate(MODIFY_LIMIT + 5, seed=7))
+    acts = BulkActions(LabelRegistry())
+    for mid in ids:
+        acts.spam(mid)
+    assert acts.flush(svc) == 2
+    assert all("SPAM" in _labels(box, m) for m in ids)
+
+def test_bulk_retries_once_with_a_fresh_label_id(svc, box):
+    ids = box.deliver(mailgen.generate(4, seed=8))
+    registry = LabelRegistry()
+    acts = BulkActions(registry)
+    acts.label(ids[0], "Suspicious")
+    acts.flush(svc)
+    stale = box.labels.pop("Suspicious")     # deleted in Gmail; the registry still has it
+    box.labels["Other"] = "Label_99"
+    for mid in ids[1:]:
+        acts.label(mid, "Suspicious")
+    assert acts.flush(svc) == 2              # rejected once, then resent
+    fresh = box.labels["Suspicious"]
+    assert fresh != stale
+    assert all(fresh in _labels(box, m) for m in ids[1:])
+
+def test_bulk_does_not_retry_system_label_errors(svc, box):
+    ids = box.deliver(mailgen.generate(2, seed=9))
+    acts = BulkActions(LabelRegistry())
+    acts.spam(ids[0])
+    del box.labels["SPAM"]
+    with pytest.raises(HttpError):
+        acts.flush(svc)
+    assert svc.calls["messages.batchModify"] == 1
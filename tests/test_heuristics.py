@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import pytest
+
+import mailgen
+from classify.baseline import _heuristics, heuristics_batch
+
+EDGE_CASES = [
+    ("", "", ""),
+    ("URGENT WINNER", "act now: claim your prize", "Promo <x@mail.offers.xyz>"),
+    ("contact nowhere", "a winnerwinner and a bitcoin-crypto", "a@example.com"),    # overlapping phrases
+    ("links", "https://a.example http://b.example HTTPS://C.EXAMPLE", "b@example.com"),
+    ("no scheme", "see example.com:// or ftp://x", "c@example.com"),
+    ("earn $$$ fast", "work from home, double your investment, risk-free, limited time", "d@spam.top"),
+]
+
+def _rows():
+    mail = mailgen.generate(500, seed=31)
+    return [(m["subject"], m["snippet"], m["from"]) for m in mail] + EDGE_CASES
+
+def test_batch_matches_single_message_heuristics():
+    rows = _rows()
+    scores, reasons = heuristics_batch(*zip(*rows))
+    for row, score, why in zip(rows, scores, reasons):
+        single_score, single_why = _heuristics(*row)
+        assert score == pytest.approx(single_score, abs=1e-12), row
+        assert why == single_why, row
+
+def test_phrases_are_substring_matches_in_list_order():
+    score, reasons = _heuristics("contact nowhere", "a winnerwinner and a bitcoin-crypto", "a@example.com")
+    assert reasons == ["suspicious terms: winner, bitcoin, crypto, act now"]
+    assert score == pytest.approx(0.2)
+
+def test_only_url_schemes_count_as_links():
+    assert _heuristics("x", "https://a http://b HTTPS://C", "a@example.com")[1] == ["3 links"]
+    assert _heuristics("x", "example.com:// ftp://x", "a@example.com")[1] == []
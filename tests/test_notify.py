@@ -0,0 +1,46 @@
+from __future__ import annotations
+import threading, time
+
+from notify import Dispatcher, Notification
+
+class Recorder:
+    def __init__(self, gate: threading.Event = None):
+        self.sent = []
+        self.gate = gate
+
+    def send(self, n: Notification) -> bool:
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.sent.append(n)
+        return True
+
+def test_single_notification_is_sent_as_is():
+    rec = Recorder()
+    d = Dispatcher(rec, window=0.05)
+    n = Notification("New Email", "a@example.com", "hello")
+    d.submit(n)
+    d.close()
+    assert rec.sent == [n]
+
+def test_burst_is_merged_into_one_digest():
+    rec = Recorder()
+    d = Dispatcher(rec, window=0.5)
+    for i in range(3):
+        d.submit(Notification("New Email", f"sender{i}@example.com", spam=i == 0))
+    d.close()
+    assert len(rec.sent) == 1
+    assert rec.sent[0].subtitle == "3 new emails, 1 likely spam"
+    assert rec.sent[0].spam
+
+def test_dropped_notifications_are_reported_in_the_next_digest():
+    gate = threading.Event()
+    rec = Recorder(gate)
+    d = Dispatcher(rec, window=0.05, maxsize=2)
+    d.submit(Notification("New Email", "first"))
+    time.sleep(0.3)                          # dispatcher is now blocked sending it
+    for i in range(5):
+        d.submit(Notification("New Email", f"s{i}"))
+    gate.set()
+    d.close()
+    assert d.dropped == 3
+    assert [n.subtitle for n in rec.sent] == ["first", "2 new emails, 0 likely spam (+3 more)"]
@@ -0,0 +1,80 @@
+from __future__ import annotations
+import threading, time
+
+import pytest
+
+import mailgen, pipeline
+from fake_gmail import FakeGmailService
+from scheduler import PollScheduler
+
+@pytest.fixture
+def logged(monkeypatch):
+    rows = []
+    monkeypatch.setattr(pipeline, "log_decision", lambda mid, *a: rows.append(mid))
+    return rows
+
+def _pipe(factory, tmp_path) -> pipeline.MailPipeline:
+    return pipeline.MailPipeline(factory, None, scheduler=PollScheduler(state_path=tmp_path / "state.json"))
+
+def _item(mid: str) -> pipeline.Scored:
+    return pipeline.Scored({"id": mid, "subject": "hi", "snippet": "", "from": "a@example.com"},
+                           0.6, "", "suspicious")
+
+def _wait(cond, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def _run(p: pipeline.MailPipeline):
+    t = threading.Thread(target=p._executor, daemon=True)
+    t.start()
+    return t
+
+def test_executor_survives_a_failing_service_factory(box, svc, tmp_path, logged):
+    ids = box.deliver(mailgen.generate(2, seed=1))
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("offline")
+        return svc
+
+    p = _pipe(factory, tmp_path)
+    t = _run(p)
+    p.submit_action(_item(ids[0]), "l")
+    _wait(lambda: calls and p.action_q.empty())
+    time.sleep(0.1)
+    assert t.is_alive() and logged == []
+
+    p.submit_action(_item(ids[1]), "l")
+    _wait(lambda: logged)
+    assert logged == [ids[1]]
+    assert box.labels["Suspicious"] in box.messages[ids[1]]["labelIds"]
+    p.stop_event.set()
+    t.join(5)
+
+def test_failed_actions_are_not_logged(box, tmp_path, logged):
+    ids = box.deliver(mailgen.generate(2, seed=2))
+    bad = FakeGmailService(box, error_rate=1.0, error_status=400)
+    p = _pipe(lambda: bad, tmp_path)
+    t = _run(p)
+    for mid in ids:
+        p.submit_action(_item(mid), "l")
+    _wait(lambda: bad.calls["labels.list"] >= 1 + len(ids) and p.action_q.empty())
+    p.stop_event.set()
+    t.join(5)
+    assert not t.is_alive()
+    assert logged == []
+
+def test_failing_polls_back_off(box, tmp_path):
+    bad = FakeGmailService(box, error_rate=1.0, error_status=401)
+    sched = PollScheduler(min_interval=0.01, max_interval=0.08, jitter=0, state_path=tmp_path / "state.json")
+    p = pipeline.MailPipeline(lambda: bad, None, scheduler=sched)
+    t = threading.Thread(target=p._poller, daemon=True)
+    t.start()
+    _wait(lambda: sched.stats()["errors"] >= 4)
+    p.stop_event.set()
+    t.join(5)
+    assert sched.stats()["interval_s"] == 0.08
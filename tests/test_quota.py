@@ -0,0 +1,90 @@
+from __future__ import annotations
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import quota
+
+def _error(status: int, reason: str = "", **headers) -> HttpError:
+    resp = httplib2.Response({"status": status, **{k.replace("_", "-"): v for k, v in headers.items()}})
+    content = json.dumps({"error": {"code": status, "errors": [{"reason": reason}]}}).encode()
+    return HttpError(resp, content, uri="fake://gmail")
+
+class Flaky:
+    """A request that raises each of `errors` in turn, then returns "ok"."""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+@pytest.fixture
+def bucket(clock) -> quota.TokenBucket:
+    return quota.TokenBucket(rate=100)
+
+def test_transient_errors_are_retried(bucket, clock):
+    req = Flaky(_error(429), _error(503), ConnectionError("reset"))
+    assert quota.call(req, bucket, 1) == "ok"
+    assert req.calls == 4
+    assert len(clock.sleeps) == 3
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(quota.random, "uniform", lambda lo, hi: hi)
+    assert [quota.backoff_delay(a) for a in range(7)] == [1, 2, 4, 8, 16, 32, 32]
+
+def test_retry_after_is_honored(bucket, clock, monkeypatch):
+    monkeypatch.setattr(quota.random, "uniform", lambda lo, hi: 0.0)
+    req = Flaky(_error(429, retry_after="7"))
+    assert quota.call(req, bucket, 1) == "ok"
+    assert clock.sleeps[0] == 7
+
+def test_pause_holds_every_caller(bucket, clock):
+    bucket.pause(3)
+    assert bucket.acquire(1) == pytest.approx(3)
+    assert bucket.acquire(1) == 0
+
+def test_retry_after_http_date_falls_back_to_backoff():
+    assert quota.retry_after(_error(429, retry_after="Wed, 21 Oct 2015 07:28:00 GMT")) is None
+    assert quota.retry_after(_error(429, retry_after="2.5")) == 2.5
+    assert quota.retry_after(_error(429)) is None
+
+@pytest.mark.parametrize("exc, retryable", [
+    (_error(429), True),
+    (_error(500), True),
+    (_error(403, "userRateLimitExceeded"), True),
+    (_error(403, "rateLimitExceeded"), True),
+    (_error(403, "insufficientPermissions"), False),
+    (_error(400), False),
+    (_error(404), False),
+    (TimeoutError(), True),
+    (ValueError(), False),
+])
+def test_is_retryable(exc, retryable):
+    assert quota.is_retryable(exc) is retryable
+
+def test_permanent_errors_are_raised_at_once(bucket, clock):
+    req = Flaky(_error(404))
+    with pytest.raises(HttpError):
+        quota.call(req, bucket, 1)
+    assert req.calls == 1 and clock.sleeps == []
+
+def test_gives_up_after_max_retries(bucket, clock):
+    req = Flaky(*[_error(503)] * (quota.MAX_RETRIES + 2))
+    with pytest.raises(HttpError):
+        quota.call(req, bucket, 1)
+    assert req.calls == quota.MAX_RETRIES + 1
+
+def test_bucket_paces_calls(clock):
+    b = quota.TokenBucket(rate=10)
+    assert b.acquire(10) == 0
+    assert b.acquire(5) == pytest.approx(0.5)
+    # a call larger than the bucket runs once it is full, then is paid back
+    assert b.acquire(50) == pytest.approx(1.0)
+    assert b.acquire(1) == pytest.approx(4.1)
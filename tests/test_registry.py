@@ -0,0 +1,92 @@
+from __future__ import annotations
+import json
+
+import pytest
+
+import mailgen
+from classify import baseline, registry
+from classify.baseline import build_pipeline
+
+def test_load_or_init_keeps_stdout_clean(capsys):
+    # the MCP server speaks JSON-RPC on stdout; diagnostics must go to stderr
+    baseline.load_or_init("tfidf")
+    out, err = capsys.readouterr()
+    assert out == ""
+    assert "no trained model" in err
+
+@pytest.fixture(scope="module")
+def pipe():
+    mail = mailgen.generate(200, seed=21)
+    return build_pipeline().fit([f"{m['subject']}\n{m['snippet']}" for m in mail], [m["label"] for m in mail])
+
+def test_publish_moves_current_and_shadow_pointers(pipe, tmp_path):
+    v1 = registry.publish(pipe, root=tmp_path)
+    assert registry.current_version(tmp_path) == v1
+    assert registry.shadow_version(tmp_path) is None
+    v2 = registry.publish(pipe, promote=False, root=tmp_path)
+    assert registry.current_version(tmp_path) == v1
+    assert registry.shadow_version(tmp_path) == v2
+    assert set(registry.versions(tmp_path)) == {v1, v2}
+    assert not list(tmp_path.glob(".*.tmp"))
+
+    assert registry.promote(root=tmp_path) == v2
+    assert registry.current_version(tmp_path) == v2
+    assert registry.shadow_version(tmp_path) is None
+    assert registry.promote(v1, root=tmp_path) == v1          # rollback
+    with pytest.raises(LookupError):
+        registry.promote(root=tmp_path)                       # no shadow left
+    with pytest.raises(LookupError):
+        registry.promote("nope", root=tmp_path)
+
+def test_live_model_swaps_on_pointer_change(pipe, tmp_path):
+    old = object()
+    live = registry.LiveModel(old, None, root=tmp_path)
+    assert live.check() is False
+
+    v1 = registry.publish(pipe, root=tmp_path)
+    assert live.check() is True
+    assert live.version == v1 and live.current is not old
+    assert live.check() is False and live.swaps == 1
+
+    v2 = registry.publish(pipe, promote=False, root=tmp_path)
+    assert live.check() is False                              # shadow only
+    assert live.shadow_version == v2 and live.shadow is not None
+
+    registry.promote(root=tmp_path)
+    assert live.check() is True
+    assert live.version == v2 and live.swaps == 2
+    assert live.shadow is None and live.shadow_version is None
+
+def test_unloadable_version_keeps_serving_the_old_one(pipe, tmp_path, capsys):
+    v1 = registry.publish(pipe, root=tmp_path)
+    live = registry.LiveModel(registry.load_version(v1, tmp_path), v1, root=tmp_path)
+    (tmp_path / "broken").mkdir()
+    (tmp_path / "broken" / "model.joblib").write_bytes(b"not a model")
+    registry._set_pointer("CURRENT", "broken", tmp_path)
+    assert live.check() is False
+    assert live.check() is False
+    assert live.version == v1
+    assert capsys.readouterr().err.count("loading model broken") == 1
+
+def test_shadow_comparison_counts_deltas_and_flips(tmp_path):
+    live = registry.LiveModel(None, "live", root=tmp_path, flip_threshold=0.5)
+    messages = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    results = [{"score": 0.2, "model_score": 0.2}, {"score": 0.6, "model_score": 0.6},
+               {"score": 0.99, "model_score": None}]             # decided before the model
+    scored = [{"score": 0.3}, {"score": 0.4}, {"score": 0.1}]
+    live._compare(messages, results, scored, 0.01, 0.03, "cand")
+
+    stats = live.stats()
+    assert stats["shadow_messages"] == 2
+    assert stats["shadow_flips"] == 1
+    assert stats["mean_abs_delta"] == pytest.approx(0.15)
+    entry = json.loads((tmp_path / "shadow.jsonl").read_text())
+    assert entry["live"] == "live" and entry["shadow"] == "cand"
+    assert entry["flips"] == ["b"]
+    assert entry["max_abs_delta"] == pytest.approx(0.2)
+
+def test_shadow_queue_drops_instead_of_blocking(tmp_path):
+    live = registry.LiveModel(None, "live", root=tmp_path, shadow=object(), shadow_version="cand")
+    for _ in range(registry.SHADOW_QUEUE + 3):
+        live.shadow_score([{"id": "a"}], [{"score": 0.5}], 0.001)
+    assert live.stats()["shadow_dropped"] == 3
@@ -0,0 +1,69 @@
+from __future__ import annotations
+import time
+
+import pytest
+
+from classify.baseline import classify_batch
+from reputation import HALF_LIFE_DAYS, MIN_SENDER_VOTES, Reputation
+
+DAY = 86400.0
+T0 = 1_700_000_000.0
+
+@pytest.fixture
+def rep(tmp_path) -> Reputation:
+    return Reputation(tmp_path / "reputation.json", save_every=10_000)
+
+def _votes(rep, sender, label, n, now=T0):
+    for _ in range(n):
+        rep.record(sender, label, now)
+
+def test_one_sided_sender_is_decided_from_history(rep):
+    _votes(rep, "Alice <alice@example.com>", "ham", int(MIN_SENDER_VOTES))
+    score, reason = rep.verdict("ALICE@example.com", now=T0)
+    assert score < 0.2
+    assert reason.startswith("sender reputation: 0 spam / 5 ham")
+    assert rep.stats()["bypassed"] == 1
+
+def test_too_few_or_mixed_votes_go_to_the_model(rep):
+    _votes(rep, "bob@example.com", "spam", int(MIN_SENDER_VOTES) - 1)
+    assert rep.verdict("bob@example.com", now=T0) is None
+    _votes(rep, "carol@example.com", "spam", 5)
+    _votes(rep, "carol@example.com", "ham", 1)
+    assert rep.verdict("carol@example.com", now=T0) is None
+
+def test_other_labels_are_not_evidence(rep):
+    _votes(rep, "dave@example.com", "suspicious", 20)
+    assert rep.stats()["senders"] == 0
+
+def test_votes_decay_with_the_half_life(rep):
+    _votes(rep, "eve@example.com", "spam", 8)
+    assert rep.verdict("eve@example.com", now=T0 + 30 * DAY) is not None
+    # one half-life later 8 votes count as 4, below the bypass minimum
+    assert rep.verdict("eve@example.com", now=T0 + HALF_LIFE_DAYS * DAY) is None
+    # old votes are decayed before a new one is added
+    rep.record("eve@example.com", "ham", T0 + HALF_LIFE_DAYS * DAY)
+    s, h, ts = rep.senders["eve@example.com"]
+    assert (s, h, ts) == (pytest.approx(4.0), 1.0, T0 + HALF_LIFE_DAYS * DAY)
+
+def test_domain_bypasses_towards_spam_only(rep):
+    for i in range(10):
+        rep.record(f"x{i}@spam-farm.com", "spam", T0)
+        rep.record(f"y{i}@gmail.com", "ham", T0)
+    score, reason = rep.verdict("new@mail.spam-farm.com", now=T0)
+    assert score > 0.9 and reason.startswith("domain reputation")
+    assert rep.verdict("stranger@gmail.com", now=T0) is None
+
+def test_snapshot_round_trip(rep, tmp_path):
+    _votes(rep, "frank@example.com", "ham", 6)
+    rep.save()
+    again = Reputation(tmp_path / "reputation.json")
+    assert again.load()
+    assert again.verdict("frank@example.com", now=T0) == rep.verdict("frank@example.com", now=T0)
+
+def test_classify_batch_skips_later_stages_for_decided_senders(rep):
+    _votes(rep, "alice@example.com", "ham", 6, now=time.time())     # verdict() runs on the wall clock
+    msgs = [{"id": "1", "from": "alice@example.com", "subject": "WIN $$$ FREE", "snippet": "click now"}]
+    # no model is needed when every sender is decided
+    [r] = classify_batch(None, msgs, reputation=rep)
+    assert r["model_score"] is None
+    assert r["score"] < 0.2 and "sender reputation" in r["reasons"]
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import pytest
+
+import mailgen
+from gmail_client import BulkActions, LabelRegistry
+from scheduler import PollScheduler
+
+@pytest.fixture
+def sched(tmp_path, svc) -> PollScheduler:
+    s = PollScheduler(min_interval=5, max_interval=40, seed=1, state_path=tmp_path / "state.json")
+    s.poll(svc)               # baseline the history cursor
+    return s
+
+def _spam(svc, ids) -> None:
+    acts = BulkActions(LabelRegistry())
+    for mid in ids:
+        acts.spam(mid)
+    acts.flush(svc)
+
+def test_idle_ticks_skip_history_list_and_back_off(sched, svc):
+    full = sched.full_polls
+    for _ in range(3):
+        assert sched.poll(svc) == []
+    assert sched.full_polls == full
+    assert sched.interval == 40
+
+def test_new_mail_resets_the_interval(sched, svc, box):
+    sched.poll(svc)
+    ids = box.deliver(mailgen.generate(3, seed=1))
+    assert [m["id"] for m in sched.poll(svc)] == ids
+    assert sched.interval == 5
+
+def test_own_writes_do_not_trigger_a_full_poll(sched, svc, box):
+    ids = box.deliver(mailgen.generate(3, seed=2))
+    sched.poll(svc)
+    full = sched.full_polls
+    with sched.own_writes(svc):
+        _spam(svc, ids)
+    assert sched.poll(svc) == []
+    assert sched.full_polls == full
+
+def test_untracked_label_changes_still_poll(sched, svc, box):
+    ids = box.deliver(mailgen.generate(3, seed=3))
+    sched.poll(svc)
+    full = sched.full_polls
+    _spam(svc, ids)           # e.g. the user, in the Gmail UI
+    assert sched.poll(svc) == []
+    assert sched.full_polls == full + 1
+
+def _new_mail(box, tag: str):
+    [m] = mailgen.generate(1, seed=5)
+    m["id"] = f"{tag}-0001"               # mailgen ids restart at 1 for every call
+    return box.deliver([m])
+
+def test_mail_arriving_before_our_write_is_still_found(sched, svc, box):
+    ids = box.deliver(mailgen.generate(2, seed=4))
+    sched.poll(svc)
+    late = _new_mail(box, "before")
+    assert late[0] not in ids
+    with sched.own_writes(svc):
+        _spam(svc, ids)
+    assert [m["id"] for m in sched.poll(svc)] == late
+
+def test_mail_arriving_during_our_write_is_found_next_tick(sched, svc, box):
+    ids = box.deliver(mailgen.generate(4, seed=6))
+    sched.poll(svc)
+    with sched.own_writes(svc):
+        _spam(svc, ids[:2])
+        late = _new_mail(box, "during")
+        _spam(svc, ids[2:])
+    assert [m["id"] for m in sched.poll(svc)] == late
+    assert sched.poll(svc) == []
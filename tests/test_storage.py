@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import pytest
+
+import retention
+from storage import Storage
+
+DAY = 86400
+T0 = 1_700_000_000 // DAY * DAY
+
+@pytest.fixture
+def st(tmp_path):
+    s = Storage(tmp_path / "state.db")
+    yield s
+    s.close()
+
+def _rows(n: int, labels=("spam", "ham", "suspicious", "none")):
+    # created_at repeats every 5 rows so the created_at order needs its id tie-break
+    return [(f"m{i}", i / n, labels[i % len(labels)], "", T0 + (i // 5) * DAY, f"s{i % 3}@example.com")
+            for i in range(n)]
+
+def test_iter_decisions_pages_by_id(st):
+    st.insert_many(_rows(23))
+    ids = [r["id"] for r in st.iter_decisions(chunk_size=4)]
+    assert ids == list(range(1, 24))
+    assert [r["id"] for r in st.iter_decisions(descending=True, chunk_size=4)] == ids[::-1]
+    assert [r["id"] for r in st.iter_decisions(chunk_size=23)] == ids    # exact multiple
+
+def test_iter_decisions_by_date_with_filters(st):
+    st.insert_many(list(reversed(_rows(20))))             # ids no longer follow dates
+    rows = list(st.iter_decisions(order="created_at", chunk_size=3))
+    keys = [(r["created_at"], r["id"]) for r in rows]
+    assert keys == sorted(keys) and len(keys) == 20
+    desc = list(st.iter_decisions(order="created_at", descending=True, chunk_size=3))
+    assert [r["id"] for r in desc] == [r["id"] for r in rows][::-1]
+
+    picked = list(st.iter_decisions(order="created_at", labels=["spam", "ham"],
+                                    since=T0 + DAY, until=T0 + 3 * DAY, chunk_size=2))
+    assert picked and all(r["label"] in ("spam", "ham") for r in picked)
+    assert all(T0 + DAY <= r["created_at"] < T0 + 3 * DAY for r in picked)
+    assert len(picked) == sum(1 for r in rows if r["label"] in ("spam", "ham")
+                              and T0 + DAY <= r["created_at"] < T0 + 3 * DAY)
+
+def test_iter_decisions_rejects_unknown_order(st):
+    with pytest.raises(ValueError):
+        next(st.iter_decisions(order="label"))
+
+def test_expired_decisions_keep_the_latest_label(st):
+    old, new = T0, T0 + 400 * DAY
+    st.insert_many([
+        ("a", 0.9, "spam", "", old, None),            # superseded by the ham below: expires
+        ("a", 0.9, "ham", "", old + 1, None),         # latest label for a: kept
+        ("b", 0.5, "suspicious", "", old, None),      # not a label: expires
+        ("c", 0.2, "none", "", new, None),            # too recent
+        ("d", 0.8, "spam", "", old, None),            # only label for d: kept
+    ])
+    chunks = list(st.expired_decisions(old + DAY, chunk_size=1))
+    assert [[(r[0], r[1]) for r in c] for c in chunks] == [[(1, "spam")], [(3, "suspicious")]]
+
+def test_expired_chunks_can_be_deleted_while_paging(st):
+    st.insert_many(_rows(30, labels=("suspicious", "none")))
+    seen = []
+    for chunk in st.expired_decisions(T0 + 100 * DAY, chunk_size=7):
+        st.archive_decisions({}, [r[0] for r in chunk])
+        seen.extend(r[0] for r in chunk)
+    assert seen == list(range(1, 31))
+    assert list(st.iter_decisions()) == []
+
+def test_retention_rolls_up_and_deletes(st):
+    st.insert_many(_rows(40) + [("m0", 0.1, "ham", "", T0 + 9 * DAY, None)])   # relabels m0
+    now = T0 + 400 * DAY
+    dry = retention.run(st, days=365, now=now, dry_run=True)
+    assert dry["archived"] == 21 and len(list(st.iter_decisions())) == 41
+
+    r = retention.run(st, days=365, now=now, chunk_size=8)
+    assert r["archived"] == 21 and r["days"] == 8
+    left = list(st.iter_decisions())
+    assert len(left) == 20 and all(d["label"] in ("spam", "ham") for d in left)
+    total = {}
+    for _, rollup in st.rollups():
+        for label, domains in rollup.items():
+            total[label] = total.get(label, 0) + sum(c[0] for c in domains.values())
+    assert total == {"suspicious": 10, "none": 10, "spam": 1}
+    assert retention.run(st, days=365, now=now)["archived"] == 0
+
+def _message(mid: str, seen_at: int):
+    return (mid, None, "a@example.com", "subject", "snippet", seen_at * 1000, 0, 0.1, "", seen_at)
+
+def test_retention_expires_unreferenced_messages(st):
+    old, new = T0, T0 + 390 * DAY
+    st.upsert_messages([_message("old-labeled", old), _message("old-suspicious", old),
+                        _message("old-plain", old), _message("recent", new)] +
+                       [_message(f"bulk{i}", old) for i in range(10)])
+    st.insert_many([("old-labeled", 0.9, "spam", "", old, None),
+                    ("old-suspicious", 0.5, "suspicious", "", old, None)])
+    now = T0 + 400 * DAY
+    assert retention.run(st, days=365, now=now, dry_run=True)["messages"] == 11
+    r = retention.run(st, days=365, now=now, chunk_size=4)
+    assert r["archived"] == 1 and r["messages"] == 12     # the suspicious one went with its decision
+    with st._lock:
+        left = {m for (m,) in st._db.execute("SELECT message_id FROM messages")}
+    assert left == {"old-labeled", "recent"}
+    assert st.count_training_rows() == 1